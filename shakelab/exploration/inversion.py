@@ -0,0 +1,550 @@
+# ****************************************************************************
+#
+# Copyright (C) 2019-2022, ShakeLab Developers.
+# This file is part of ShakeLab.
+#
+# ShakeLab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ShakeLab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+#
+# ****************************************************************************
+"""
+Inversion of shear-wave velocity profiles.
+
+Layered models are sampled by Monte Carlo or by the neighbourhood
+algorithm (Sambridge, 1999) and fitted to dispersion curves and/or
+HVSR curves. Forward models are computed in chunks, serially or in a
+process pool, and misfits of repeated parameter vectors are cached.
+The ensemble of models and misfits can be streamed to a column store
+(see libutils.columnar).
+"""
+
+import time
+
+import numpy as np
+
+from shakelab.libutils.columnar import ColumnStore
+from shakelab.libutils.utils import run_jobs
+from shakelab.site.cps.surf96 import surf96
+from shakelab.site.psvq.psvqlib import psvq_soil_response
+from shakelab.site.soil import Model1D
+
+# Default number of models per forward job
+CHUNK_SIZE = 100
+
+# Layer parameters that can be inverted
+PARAMETERS = ['hl', 'vs', 'vpvs']
+
+
+class ParameterSpace():
+    """
+    Parameterization of a layered profile (the last layer is the
+    half-space). Units are as in site.soil.Model1D (m, m/s, kg/m3).
+    """
+    def __init__(self):
+        self.layer = []
+
+    def __len__(self):
+        return len(self.layer)
+
+    def add_layer(self, hl=0., vs=None, vpvs=2., dn=2000., qs=None):
+        """
+        Add a layer to the bottom of the profile.
+
+        Parameters hl, vs and vpvs can be a fixed value, a (min, max)
+        range or a (min, max, step) range, where values are rounded
+        to the step.
+
+        :param hl:
+            layer thickness (ignored for the half-space)
+
+        :param vs:
+            shear-wave velocity
+
+        :param vpvs:
+            ratio of P- and S-wave velocities
+
+        :param float dn:
+            density
+
+        :param float qs:
+            shear-wave quality factor (elastic if None)
+        """
+        self.layer.append({'hl': hl, 'vs': vs, 'vpvs': vpvs,
+                           'dn': dn, 'qs': qs})
+
+    @property
+    def names(self):
+        """
+        Names of the free parameters, as <key>_<layer>.
+        """
+        return [n for n, _ in self._free()]
+
+    @property
+    def bounds(self):
+        """
+        Ranges of the free parameters as (n_parameters, 2).
+        """
+        return np.array([v[:2] for _, v in self._free()], dtype=float)
+
+    @property
+    def step(self):
+        """
+        Rounding step of the free parameters (0 if continuous).
+        """
+        return np.array([v[2] if len(v) > 2 else 0.
+                         for _, v in self._free()], dtype=float)
+
+    def to_arrays(self, x):
+        """
+        Convert parameter vectors (n_models, n_parameters) to layer
+        arrays (n_models, n_layers).
+
+        :return dict:
+            hl, vp, vs, dn and qs (None if elastic)
+        """
+        x = np.atleast_2d(x)
+        layer_num = len(self.layer)
+
+        out = {}
+        for key in PARAMETERS + ['dn']:
+            out[key] = np.empty((len(x), layer_num))
+            for i, layer in enumerate(self.layer):
+                if np.size(layer[key]) == 1:
+                    out[key][:, i] = layer[key]
+
+        for k, (name, _) in enumerate(self._free()):
+            key, i = name.rsplit('_', 1)
+            out[key][:, int(i)] = x[:, k]
+
+        out['hl'][:, -1] = 0.
+        out['vp'] = out.pop('vpvs')*out['vs']
+
+        if any(layer['qs'] is None for layer in self.layer):
+            out['qs'] = None
+        else:
+            qs = np.array([layer['qs'] for layer in self.layer])
+            out['qs'] = np.tile(qs, (len(x), 1))
+
+        return out
+
+    def to_model(self, x):
+        """
+        Convert a parameter vector to a Model1D object.
+        """
+        data = self.to_arrays(x)
+        model = Model1D()
+
+        for i in range(len(self.layer)):
+            layer = {k: data[k][0, i] for k in ('hl', 'vp', 'vs', 'dn')}
+            if data['qs'] is not None:
+                layer['qs'] = data['qs'][0, i]
+            model.add_layer(layer)
+
+        return model
+
+    def from_unit(self, u):
+        """
+        Map points of the unit hypercube to parameter vectors,
+        rounded to the parameter steps.
+        """
+        lo, hi = self.bounds.T
+        x = lo + np.asarray(u)*(hi - lo)
+
+        step = np.where(self.step > 0., self.step, 1.)
+        rounded = lo + np.round((x - lo)/step)*step
+        x = np.where(self.step > 0., rounded, x)
+
+        return np.clip(x, lo, hi)
+
+    def to_unit(self, x):
+        """
+        Map parameter vectors to the unit hypercube.
+        """
+        lo, hi = self.bounds.T
+        return (np.asarray(x) - lo)/np.where(hi > lo, hi - lo, 1.)
+
+    def _free(self):
+        """
+        Internal: (name, range) of the free parameters.
+        """
+        free = []
+        for i, layer in enumerate(self.layer):
+            for key in PARAMETERS:
+                if key == 'hl' and i == len(self.layer) - 1:
+                    continue
+                if np.size(layer[key]) > 1:
+                    free.append(('{0}_{1}'.format(key, i), layer[key]))
+        return free
+
+
+class DispersionCurve():
+    """
+    Observed surface-wave dispersion curve.
+    """
+    def __init__(self, frequency, velocity, sigma=None, mode=0,
+                 wave='rayleigh', itype=0, weight=1.):
+        """
+        :param numpy.array frequency:
+            frequencies in Hz
+
+        :param numpy.array velocity:
+            phase or group velocity in m/s
+
+        :param numpy.array sigma:
+            standard deviation of the velocity (relative misfit
+            if None)
+
+        :param int mode:
+            mode number (0 if fundamental)
+
+        :param string wave:
+            'rayleigh' or 'love'
+
+        :param int itype:
+            0 for phase, 1 for group velocity
+
+        :param float weight:
+            weight of the curve in the total misfit
+        """
+        self.frequency = np.asarray(frequency, dtype=float)
+        self.data = np.asarray(velocity, dtype=float)
+        self.sigma = self.data if sigma is None else np.asarray(sigma)
+        self.mode = mode
+        self.ifunc = 1 if wave == 'love' else 2
+        self.itype = itype
+        self.weight = weight
+
+    def forward(self, model):
+        """
+        Dispersion curves of a batch of models (see
+        ParameterSpace.to_arrays), as (n_models, n_frequencies).
+        """
+        # Increasing periods for the mode search
+        order = np.argsort(1./self.frequency)
+        period = 1./self.frequency[order]
+
+        out = np.zeros((len(model['vs']), len(period)))
+        for i in range(len(out)):
+            out[i, order] = surf96(period, model['hl'][i]/1e3,
+                                   model['vp'][i]/1e3, model['vs'][i]/1e3,
+                                   model['dn'][i]/1e3, mode=self.mode,
+                                   itype=self.itype, ifunc=self.ifunc,
+                                   dc=0.0001, dt=0.025)
+        return out*1e3
+
+
+class HvsrCurve():
+    """
+    Observed horizontal to vertical spectral ratio, approximated
+    by the SH-wave transfer function at vertical incidence.
+    """
+    def __init__(self, frequency, amplitude, sigma=None, weight=1.):
+        """
+        :param numpy.array frequency:
+            frequencies in Hz
+
+        :param numpy.array amplitude:
+            spectral ratio
+
+        :param numpy.array sigma:
+            standard deviation of the ratio (relative misfit if None)
+
+        :param float weight:
+            weight of the curve in the total misfit
+        """
+        self.frequency = np.asarray(frequency, dtype=float)
+        self.data = np.asarray(amplitude, dtype=float)
+        self.sigma = self.data if sigma is None else np.asarray(sigma)
+        self.weight = weight
+
+    def forward(self, model):
+        """
+        Surface amplification of a batch of models (see
+        ParameterSpace.to_arrays), as (n_models, n_frequencies).
+        """
+        out = np.zeros((len(model['vs']), len(self.frequency)))
+        for i in range(len(out)):
+            qs = None if model['qs'] is None else model['qs'][i]
+            sh = psvq_soil_response(self.frequency, model['hl'][i], None,
+                                    model['vs'][i], model['dn'][i],
+                                    None, qs, iwave='sh')
+            out[i] = np.abs(sh[0])
+        return out
+
+
+class Inversion():
+    """
+    Sampling-based inversion of a layered profile.
+
+    Models and misfits are accumulated in memory (attributes x,
+    misfit and iteration) and, if a store is given, appended to
+    its 'model' table after each batch.
+    """
+    def __init__(self, space, data, store=None, workers=None,
+                 chunk_size=CHUNK_SIZE, seed=None, verbose=False,
+                 overwrite=False):
+        """
+        :param ParameterSpace space:
+            the model parameterization
+
+        :param list data:
+            observed curves (DispersionCurve and/or HvsrCurve)
+
+        :param string store:
+            path of a column store for the ensemble (columns
+            Iteration, Misfit and one per free parameter)
+
+        :param int workers:
+            number of processes (serial if None)
+
+        :param int chunk_size:
+            number of models per forward job
+
+        :param int seed:
+            seed of the random generator
+
+        :param bool verbose:
+            print progress after each batch
+
+        :param bool overwrite:
+            replace the 'model' table if the store already has one
+            (otherwise an error is raised)
+        """
+        self.space = space
+        self.data = data if isinstance(data, list) else [data]
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.verbose = verbose
+
+        self.rng = np.random.default_rng(seed)
+        self.cache = {}
+
+        self.x = np.empty((0, len(space.names)))
+        self.misfit = np.empty(0)
+        self.iteration = np.empty(0, dtype=int)
+
+        self.evaluated = 0
+        self.cached = 0
+        self.runtime = 0.
+        self.start = time.perf_counter()
+
+        self.store = None
+        if store is not None:
+            self.store = ColumnStore(store, 'a')
+            if 'model' in self.store:
+                if not overwrite:
+                    raise ValueError('Store already contains a model table')
+                self.store.remove('model')
+            self.store.set_attributes({'Parameters': space.names})
+
+    def monte_carlo(self, model_num, batch_size=1000):
+        """
+        Uniform random sampling of the parameter space.
+
+        :param int model_num:
+            number of models
+
+        :param int batch_size:
+            number of models evaluated (and stored) at once
+        """
+        iteration = self._next_iteration()
+
+        for m0 in range(0, model_num, batch_size):
+            size = min(batch_size, model_num - m0)
+            u = self.rng.random((size, len(self.space.names)))
+            self.evaluate(self.space.from_unit(u), iteration)
+
+    def neighbourhood(self, initial_num, iteration_num, sample_num,
+                      cell_num):
+        """
+        Neighbourhood algorithm: at each iteration, new models are
+        sampled uniformly inside the Voronoi cells of the models
+        with the lowest misfit, by a Gibbs random walk.
+
+        :param int initial_num:
+            number of initial Monte Carlo models (ignored if the
+            ensemble is not empty)
+
+        :param int iteration_num:
+            number of iterations
+
+        :param int sample_num:
+            number of new models per iteration
+
+        :param int cell_num:
+            number of cells resampled at each iteration
+        """
+        if len(self.misfit) == 0:
+            self.monte_carlo(initial_num)
+
+        for _ in range(iteration_num):
+            iteration = self._next_iteration()
+
+            unit = self.space.to_unit(self.x)
+            cell = np.argsort(self.misfit)[:cell_num]
+            size = np.full(len(cell), sample_num // len(cell))
+            size[:sample_num % len(cell)] += 1
+
+            u = np.concatenate([_voronoi_walk(unit, k, n, self.rng)
+                                for k, n in zip(cell, size)])
+
+            self.evaluate(self.space.from_unit(u), iteration)
+
+    def evaluate(self, x, iteration=0):
+        """
+        Misfit of a batch of parameter vectors (n_models,
+        n_parameters). Models are added to the ensemble.
+        """
+        x = np.atleast_2d(np.asarray(x, dtype=float))
+        keys = [xi.tobytes() for xi in x]
+
+        new = {}
+        for i, key in enumerate(keys):
+            if key not in self.cache and key not in new:
+                new[key] = i
+        self.cached += len(keys) - len(new)
+
+        t0 = time.perf_counter()
+        index = np.array(list(new.values()), dtype=int)
+        jobs = ((self.space, self.data, x[index[i:i+self.chunk_size]])
+                for i in range(0, len(index), self.chunk_size))
+
+        result = list(run_jobs(_misfit_chunk, jobs, self.workers))
+        if result:
+            result = np.concatenate(result)
+            self.cache.update(zip(new.keys(), result))
+
+        self.runtime += time.perf_counter() - t0
+        self.evaluated += len(new)
+
+        result = np.array([self.cache[key] for key in keys])
+
+        self.x = np.concatenate((self.x, x))
+        self.misfit = np.concatenate((self.misfit, result))
+        self.iteration = np.concatenate(
+                (self.iteration, np.full(len(x), iteration)))
+
+        if self.store is not None:
+            table = {'Iteration': np.full(len(x), iteration, dtype=np.int32),
+                     'Misfit': result}
+            for k, name in enumerate(self.space.names):
+                table[name] = x[:, k]
+            self.store.append('model', table)
+
+        if self.verbose:
+            print(_format_progress(self.progress()))
+
+        return result
+
+    def best(self, num=1):
+        """
+        Parameter vectors and misfits of the best models.
+        """
+        order = np.argsort(self.misfit)[:num]
+        return self.x[order], self.misfit[order]
+
+    def best_model(self):
+        """
+        Model1D object of the best model.
+        """
+        return self.space.to_model(self.best(1)[0])
+
+    def progress(self):
+        """
+        Progress and throughput of the run.
+
+        :return dict:
+            Iteration, Models (ensemble size), Evaluated (forward
+            models), Cached (cache hits), Elapsed (s), Throughput
+            (forward models per second) and Misfit (lowest)
+        """
+        return {'Iteration': int(self.iteration.max(initial=0)),
+                'Models': len(self.misfit),
+                'Evaluated': self.evaluated,
+                'Cached': self.cached,
+                'Elapsed': time.perf_counter() - self.start,
+                'Throughput': self.evaluated/max(self.runtime, 1e-9),
+                'Misfit': float(self.misfit.min(initial=np.inf))}
+
+    def _next_iteration(self):
+        """
+        Internal: index of the next iteration.
+        """
+        return int(self.iteration.max() + 1) if len(self.iteration) else 0
+
+
+def misfit(data, model):
+    """
+    Weighted RMS misfit of a batch of models (see
+    ParameterSpace.to_arrays) against a list of observed curves.
+    Missing modes (zero velocity) are compared as zero.
+    """
+    total = 0.
+    weight = 0.
+
+    for curve in data:
+        pred = curve.forward(model)
+        res = (pred - curve.data)/curve.sigma
+        total = total + curve.weight*np.sqrt(np.mean(res**2, axis=-1))
+        weight += curve.weight
+
+    return total/weight
+
+
+def _misfit_chunk(space, data, x):
+    """
+    Internal: misfit of a chunk of parameter vectors.
+    """
+    return misfit(data, space.to_arrays(x))
+
+
+def _voronoi_walk(unit, k, num, rng):
+    """
+    Internal: uniform samples in the Voronoi cell of the k-th point
+    (unit hypercube), by a Gibbs random walk along the axes.
+    """
+    x = unit[k].copy()
+    d2 = np.sum((unit - x)**2, axis=1)
+    out = np.empty((num, unit.shape[1]))
+
+    for n in range(num):
+        for i in range(unit.shape[1]):
+            # Distances without the i-th axis
+            di = d2 - (unit[:, i] - x[i])**2
+            dv = unit[k, i] - unit[:, i]
+
+            # Intersections of the axis with the cell boundaries
+            ok = dv != 0.
+            with np.errstate(divide='ignore', invalid='ignore'):
+                xi = 0.5*(unit[k, i] + unit[:, i] + (di[k] - di)/dv)
+
+            lo = np.max(xi[ok & (dv > 0.)], initial=0.)
+            hi = np.min(xi[ok & (dv < 0.)], initial=1.)
+
+            new = rng.uniform(max(lo, 0.), min(hi, 1.))
+            d2 += (unit[:, i] - new)**2 - (unit[:, i] - x[i])**2
+            x[i] = new
+
+        out[n] = x
+
+    return out
+
+
+def _format_progress(info):
+    """
+    Internal: one-line progress report.
+    """
+    return ('Iteration {Iteration}: {Models} models, {Evaluated} evaluated, '
+            '{Cached} cached, {Throughput:.1f} models/s, '
+            'best misfit {Misfit:.4g}'.format(**info))
+
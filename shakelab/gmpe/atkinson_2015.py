@@ -23,7 +23,7 @@
 import numpy as _np
 from scipy.constants import g
 
-from shakelab.modeling.gmpe.base import GMPE
+from shakelab.gmpe.base import GMPE
 
 class Atkinson2015(GMPE):
     """
@@ -40,13 +40,10 @@ class Atkinson2015(GMPE):
 
     _COEFF_FILE = 'atkinson_2015.json'
 
-    def ground_motion(self, imt, mag, dist):
-
-        # Extract coefficients for the given intensity measure type
-        C = self.get_coefficients(imt)
+    def _ground_motion(self, C, imt, mag, dist):
 
         # Compute mean
-        heff = _np.max([1., 10.**(-1.72+0.43*mag)])
+        heff = _np.maximum(1., 10.**(-1.72+0.43*mag))
         mean = C['c0'] + C['c1']*mag + C['c2']*(mag**2.)
         mean += C['c3']*_np.log10(_np.sqrt(dist**2. + heff**2.))
 
@@ -57,12 +54,8 @@ class Atkinson2015(GMPE):
         mean *= _np.log(10.)
         stdv *= _np.log(10.)
 
-        if not imt == 'PGV':
-            # Convert from cm/s2 to g
-            mean -= _np.log(100.*g)
-        else:
-            # Convert from cm/s to m/s
-            mean -= _np.log(100.)
+        # Convert from cm/s2 to g (PGV from cm/s to m/s)
+        mean -= _np.where(imt == 'PGV', _np.log(100.), _np.log(100.*g))
 
         return (mean, stdv)
 
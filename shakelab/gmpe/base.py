@@ -23,10 +23,17 @@
 import abc as _abc
 import os as _os
 import json as _json
+import functools as _ft
+import numpy as _np
 
 class GMPE(metaclass=_abc.ABCMeta):
     """
     Base class for ground motion prediction equation models (GMPEs).
+
+    Models implement the _ground_motion method, which receives the
+    coefficients as a dictionary of arrays (one row per intensity
+    measure type) and must be written with broadcasting operations,
+    so that all IMTs, magnitudes and distances are computed at once.
     """
 
     _COEFF_FILE = None
@@ -52,25 +59,73 @@ class GMPE(metaclass=_abc.ABCMeta):
         pass
 
     @_abc.abstractmethod
-    def ground_motion(self, imt, magnitude, distance):
+    def _ground_motion(self, C, imt, mag, dist):
         """
+        Compute mean and standard deviation (natural log).
+        C is a dictionary of coefficient arrays and imt an array of
+        intensity measure types, both broadcastable with mag and dist.
         """
         pass
 
+    def ground_motion(self, imt, mag, dist):
+        """
+        Compute mean and standard deviation (natural log) of
+        a single intensity measure type.
+        """
+        mean, stdv = self.ground_motion_table([imt], mag, dist)
+
+        if mean.ndim == 1:
+            # Scalar input
+            return (float(mean[0]), float(stdv[0]))
+        return (mean[0], stdv[0])
+
+    def ground_motion_table(self, imts, mag, dist):
+        """
+        Compute mean and standard deviation (natural log) of several
+        intensity measure types in a single vectorized call.
+
+        :param list imts:
+            intensity measure types (all available if None)
+
+        :param numpy.array mag:
+            magnitudes
+
+        :param numpy.array dist:
+            distances (broadcastable with magnitudes)
+
+        :return numpy.array mean, stdv:
+            arrays of shape (n_imt,) + broadcast shape of the inputs,
+            e.g. (n_imt, n_sites)
+        """
+        if imts is None:
+            imts = self.imts
+
+        mag, dist = _np.broadcast_arrays(_np.asarray(mag, dtype=float),
+                                         _np.asarray(dist, dtype=float))
+        shape = (len(imts),) + (1,)*mag.ndim
+
+        C = self.get_coefficient_table(imts)
+        C = {k: v.reshape(shape) for k, v in C.items()}
+        imt = _np.array(imts).reshape(shape)
+
+        mean, stdv = self._ground_motion(C, imt, mag, dist)
+
+        shape = (len(imts),) + mag.shape
+        return (_np.broadcast_to(mean, shape), _np.broadcast_to(stdv, shape))
+
     def import_coeff_from_json(self, json_file, coeff_set='default'):
         """
         Loads the coefficient from a separate file in json format.
         File has to be stored in the same directory of the GMPE class.
+        Tables are parsed once and shared by all instances.
         """
-        full_path = _os.path.dirname(__file__)
-        path_file = _os.path.join(full_path, 'data', json_file)
+        (self.keys, self.imts, self.table) = _load_coeff_table(json_file,
+                                                              coeff_set)
+        self._imt_index = {imt: i for i, imt in enumerate(self.imts)}
 
         self.coeff = {}
-        with open(path_file) as jf:
-            data = _json.load(jf)['coefficients'][coeff_set]
-            self.keys = data['keys']
-            for kp in data['type']:
-                self.coeff[kp] = [float(c) for c in data['type'][kp]]
+        for imt, row in zip(self.imts, self.table.tolist()):
+            self.coeff[imt] = row
 
     def get_coefficients(self, imt):
         """
@@ -82,9 +137,42 @@ class GMPE(metaclass=_abc.ABCMeta):
         else:
             raise KeyError('Not a valid intensity measure type')
 
+    def get_coefficient_table(self, imts):
+        """
+        Extract the coefficients of several intensity measure types
+        as a dictionary of arrays (one element per IMT).
+        """
+        try:
+            idx = [self._imt_index[imt] for imt in imts]
+        except KeyError:
+            raise KeyError('Not a valid intensity measure type')
+
+        table = self.table[idx]
+        return {k: table[:, i] for i, k in enumerate(self.keys)}
+
     def list_imts(self):
         """
         List the available intensity measure types for the gmpe.
         """
         return [k for k in self.coeff.keys()]
 
+
+@_ft.lru_cache(maxsize=None)
+def _load_coeff_table(json_file, coeff_set='default'):
+    """
+    Internal: read a coefficient file as (keys, imts, table), where
+    table is a read-only (n_imt, n_keys) array.
+    """
+    full_path = _os.path.dirname(__file__)
+    path_file = _os.path.join(full_path, 'data', json_file)
+
+    with open(path_file) as jf:
+        data = _json.load(jf)['coefficients'][coeff_set]
+
+    keys = tuple(data['keys'])
+    imts = tuple(data['type'].keys())
+    table = _np.array([[float(c) for c in data['type'][imt]]
+                       for imt in imts])
+    table.setflags(write=False)
+
+    return keys, imts, table
@@ -23,7 +23,7 @@
 import numpy as _np
 from scipy.constants import g
 
-from shakelab.modeling.gmpe.base import GMPE
+from shakelab.gmpe.base import GMPE
 
 class BragatoSlejko2005(GMPE):
     """
@@ -44,10 +44,7 @@ class BragatoSlejko2005(GMPE):
     _COEFF_FILE = 'bragato_slejko_2005.json'
     _COEFF_SET = 'epicentral'
 
-    def ground_motion(self, imt, mag, dist):
-
-        # Extract coefficients for the given intensity measure type
-        C = self.get_coefficients(imt)
+    def _ground_motion(self, C, imt, mag, dist):
 
         # Distance term
         r = _np.sqrt(dist**2 + C['h']**2)
@@ -63,9 +60,8 @@ class BragatoSlejko2005(GMPE):
         mean *= _np.log(10.)
         stdv *= _np.log(10.)
 
-        if imt == 'PGV':
-            # Convert from cm/s to m/s
-            mean -= _np.log(100.)
+        # Convert PGV from cm/s to m/s
+        mean -= _np.where(imt == 'PGV', _np.log(100.), 0.)
 
         return (mean, stdv)
 
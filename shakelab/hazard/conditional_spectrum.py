@@ -0,0 +1,179 @@
+# ****************************************************************************
+#
+# Copyright (C) 2019-2020, ShakeLab Developers.
+# This file is part of ShakeLab.
+#
+# ShakeLab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ShakeLab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+#
+# ****************************************************************************
+"""
+Conditional mean spectrum and conditional spectrum (Baker, 2011;
+Jayaram et al., 2011) for ground-motion record selection.
+
+All spectral values are natural logarithms; cross-period correlation
+follows Baker and Jayaram (2008).
+"""
+
+import numpy as np
+
+from shakelab.hazard.correlation import baker_jayaram_matrix
+from shakelab.hazard.ground_motion_field import imt_period
+
+
+def conditional_mean_spectrum(period, mean, stdv, period_star, epsilon):
+    """
+    Conditional mean spectrum and its standard deviation, given
+    the epsilon at the conditioning period.
+
+    :param numpy.array period:
+        spectral periods in seconds
+
+    :param numpy.array mean:
+        mean log spectral values at the periods
+
+    :param numpy.array stdv:
+        log standard deviations at the periods
+
+    :param float period_star:
+        conditioning period
+
+    :param float epsilon:
+        target epsilon at the conditioning period
+
+    :return numpy.array cms_mean:
+        conditional mean of the log spectrum
+
+    :return numpy.array cms_stdv:
+        conditional standard deviation of the log spectrum
+    """
+    rho = baker_jayaram_matrix(period, [period_star])[:, 0]
+
+    cms_mean = np.asarray(mean) + rho*epsilon*np.asarray(stdv)
+    cms_stdv = np.asarray(stdv)*np.sqrt(np.maximum(1. - rho**2, 0.))
+
+    return cms_mean, cms_stdv
+
+
+def conditional_covariance(period, stdv, period_star):
+    """
+    Covariance matrix of the log spectrum conditioned on the value
+    at the conditioning period.
+    """
+    stdv = np.asarray(stdv)
+
+    rho = baker_jayaram_matrix(period)
+    rho_star = baker_jayaram_matrix(period, [period_star])[:, 0]
+
+    corr = rho - np.outer(rho_star, rho_star)
+
+    return corr*np.outer(stdv, stdv)
+
+
+def conditional_spectrum(period, mean, stdv, period_star, epsilon,
+                         spectrum_num=1, seed=None):
+    """
+    Simulate spectra from the conditional spectrum distribution
+    (multivariate normal in log units).
+
+    :param int spectrum_num:
+        number of simulated spectra
+
+    :param int seed:
+        seed (or numpy Generator) of the random sampling
+
+    :return numpy.array spectra:
+        simulated log spectra as (spectrum_num, n_periods)
+    """
+    cms_mean, _ = conditional_mean_spectrum(period, mean, stdv,
+                                            period_star, epsilon)
+    cov = conditional_covariance(period, stdv, period_star)
+
+    # The matrix is singular at the conditioning period:
+    # factorisation by eigen-decomposition
+    eig, vec = np.linalg.eigh(cov)
+    factor = vec*np.sqrt(np.maximum(eig, 0.))
+
+    rng = np.random.default_rng(seed)
+    z = rng.standard_normal((spectrum_num, len(cms_mean)))
+
+    return cms_mean + z @ factor.T
+
+
+def gmpe_conditional_spectrum(gmpe, mag, dist, period_star, epsilon,
+                              imts=None):
+    """
+    Conditional mean spectrum of a scenario from a GMPE. The
+    spectral ordinates of all IMTs are computed in a single call.
+
+    :param GMPE gmpe:
+        the ground motion model
+
+    :param list imts:
+        spectral IMTs (all SA of the model if not given)
+
+    :return numpy.array period:
+        periods of the IMTs
+
+    :return numpy.array cms_mean, cms_stdv:
+        conditional mean spectrum and standard deviation (log)
+    """
+    if imts is None:
+        imts = [imt for imt in gmpe.imts if imt.startswith('SA-')]
+
+    period = np.array([imt_period(imt) for imt in imts])
+    mean, stdv = gmpe.ground_motion_table(imts, mag, dist)
+
+    cms_mean, cms_stdv = conditional_mean_spectrum(period, mean, stdv,
+                                                   period_star, epsilon)
+
+    return period, cms_mean, cms_stdv
+
+
+def rank_records(spectra, target, period=None, period_star=None,
+                 weights=None):
+    """
+    Rank records by the misfit of their log spectra with respect to
+    a target (e.g. the conditional mean spectrum). If the conditioning
+    period is given, records are first scaled to match the target
+    at that period.
+
+    :param numpy.array spectra:
+        record log spectra as (n_records, n_periods)
+
+    :param numpy.array target:
+        target log spectrum
+
+    :return numpy.array order:
+        record indexes sorted by increasing misfit
+
+    :return numpy.array misfit:
+        sum of squared log differences of each record
+
+    :return numpy.array scale:
+        linear scale factor of each record
+    """
+    spectra = np.atleast_2d(spectra)
+    target = np.asarray(target)
+
+    shift = np.zeros(len(spectra))
+    if period_star is not None:
+        idx = np.argmin(np.abs(np.asarray(period) - period_star))
+        shift = target[idx] - spectra[:, idx]
+
+    if weights is None:
+        weights = np.ones(len(target))
+
+    misfit = np.sum(weights*(spectra + shift[:, None] - target)**2, axis=1)
+
+    return np.argsort(misfit), misfit, np.exp(shift)
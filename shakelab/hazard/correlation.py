@@ -20,6 +20,7 @@
 """
 """
 
+import functools
 import numpy as np
 
 
@@ -50,8 +51,8 @@ def baker_jayaram(t1, t2):
     C1 = 1. - np.cos(np.pi/2. - np.log(tmax/np.max([tmin, 0.109])) * 0.366)
 
     if tmax < 0.2:
-        C2 = 1. - 0.105*(1. - 1./(1. + np.exp(100.*tmax - 5.)))
-        C2 *= (tmax-tmin)/(tmax-0.0099)
+        C2 = 1. - 0.105*(1. - 1./(1. + np.exp(100.*tmax - 5.))) \
+                * (tmax-tmin)/(tmax-0.0099)
 
     if tmax < 0.109:
         C3 = C2
@@ -69,4 +70,96 @@ def baker_jayaram(t1, t2):
     else:
         rho = C4
 
-    return rho
\ No newline at end of file
+    return rho
+
+
+def jayaram_baker_range(period=0., clustered=False):
+    """
+    Range (km) of the exponential model of spatial correlation
+    of within-event residuals.
+
+    Reference:
+    Jayaram N, Baker JW. (2009). Correlation model for spatially
+    distributed ground-motion intensities. Earthquake Engineering and
+    Structural Dynamics, 38(15), 1687-1708
+
+    input:
+        period - Spectral period in seconds (0 for PGA)
+        clustered - True if Vs30 values show clustering
+    output:
+        b - The correlation range in km
+    """
+
+    period = np.asarray(period, dtype=float)
+
+    if clustered:
+        b = np.where(period < 1., 40.7 - 15.0*period, 22.0 + 3.7*period)
+    else:
+        b = np.where(period < 1., 8.5 + 17.2*period, 22.0 + 3.7*period)
+
+    return b
+
+
+def jayaram_baker(distance, period=0., clustered=False):
+    """
+    Spatial correlation of within-event residuals (Jayaram and
+    Baker, 2009) for arrays of separation distances (km).
+    """
+
+    b = jayaram_baker_range(period, clustered)
+
+    return np.exp(-3.*np.asarray(distance)/b)
+
+
+def baker_jayaram_matrix(t1, t2=None):
+    """
+    Vectorized version of baker_jayaram, returning the correlation
+    matrix between two arrays of periods (t2 = t1 if not given).
+    Matrices are cached for repeated period grids and returned as
+    read-only arrays.
+
+    input:
+        t1, t2 - Arrays of periods
+    output:
+        rho - The correlation matrix, as (len(t1), len(t2))
+    """
+
+    t1 = tuple(np.atleast_1d(np.asarray(t1, dtype=float)).tolist())
+    t2 = t1 if t2 is None else tuple(
+        np.atleast_1d(np.asarray(t2, dtype=float)).tolist())
+
+    return _baker_jayaram_cached(t1, t2)
+
+
+@functools.lru_cache(maxsize=64)
+def _baker_jayaram_cached(t1, t2):
+    """
+    Internal: correlation matrix for period tuples.
+    """
+
+    t1 = np.array(t1)[:, None]
+    t2 = np.array(t2)[None, :]
+
+    tmin = np.minimum(t1, t2)
+    tmax = np.maximum(t1, t2)
+
+    if np.any(tmin < 0.01):
+        print('Warning: minimum period not in the validity range')
+    if np.any(tmax > 10):
+        print('Warning: maximum period not in the validity range')
+
+    C1 = 1. - np.cos(np.pi/2. - np.log(tmax/np.maximum(tmin, 0.109)) * 0.366)
+
+    with np.errstate(over='ignore'):
+        C2 = 1. - 0.105*(1. - 1./(1. + np.exp(100.*tmax - 5.))) \
+                * (tmax-tmin)/(tmax-0.0099)
+
+    C3 = np.where(tmax < 0.109, C2, C1)
+
+    C4 = C1 + 0.5*(np.sqrt(C3) - C3) * (1 + np.cos(np.pi*tmin/0.109))
+
+    rho = np.select([tmax <= 0.109, tmin > 0.109, tmax < 0.2],
+                    [C2, C1, np.minimum(C2, C4)], C4)
+
+    rho.setflags(write=False)
+    return rho
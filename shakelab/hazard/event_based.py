@@ -0,0 +1,349 @@
+# ****************************************************************************
+#
+# Copyright (C) 2019-2020, ShakeLab Developers.
+# This file is part of ShakeLab.
+#
+# ShakeLab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ShakeLab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+#
+# ****************************************************************************
+"""
+Event-based stochastic event sets and hazard.
+
+Ruptures are generated in chunks of fixed size. Every chunk has its
+own seed, spawned from a root seed, so that results do not depend on
+the number of workers or on the processing order. Chunks are plain
+dictionaries of arrays that can be streamed to a column store
+(see libutils.columnar) and read back in chunks for the hazard stage.
+"""
+
+import numpy as np
+
+from shakelab.libutils.columnar import ColumnStore
+from shakelab.libutils.utils import run_jobs
+from shakelab.hazard.psha import AreaSource, _distance, MAX_ELEMENTS
+from shakelab.hazard.ground_motion_field import CorrelatedResiduals
+from shakelab.seismicity.seismicity import poisson_probability
+
+# Default number of ruptures per chunk
+CHUNK_SIZE = 100000
+
+RUPTURE_KEYS = ['Source', 'Time', 'Magnitude',
+                'Latitude', 'Longitude', 'Depth']
+
+
+def stochastic_event_set(sources, duration, chunk_size=CHUNK_SIZE,
+                         seed=None, workers=None, store=None):
+    """
+    Generate a stochastic event set from point and area sources.
+
+    The number of ruptures of each source is Poisson distributed;
+    occurrence times are uniform over the duration, magnitudes are
+    sampled from the source MFD and locations uniformly inside the
+    source polygon (area sources).
+
+    :param list sources:
+        list of PointSource / AreaSource objects (see hazard.psha)
+
+    :param float duration:
+        duration of the event set in years
+
+    :param int chunk_size:
+        number of ruptures per chunk
+
+    :param int seed:
+        root seed
+
+    :param int workers:
+        number of processes (serial if None)
+
+    :param string store:
+        if given, chunks are appended to the 'rupture' table of
+        a column store at this path, and nothing is returned
+
+    :return generator:
+        chunks of ruptures, as dictionaries of arrays (Source, Time
+        in years, Magnitude, Latitude, Longitude, Depth)
+    """
+    jobs = _plan_chunks(sources, duration, chunk_size, seed)
+    chunks = run_jobs(_generate_chunk, jobs, workers)
+
+    if store is None:
+        return chunks
+
+    db = ColumnStore(store, 'a')
+    if 'rupture' in db:
+        db.remove('rupture')
+    db.set_attributes({'Duration': duration})
+
+    for chunk in chunks:
+        db.append('rupture', chunk)
+
+
+def read_ruptures(store, chunk_size=CHUNK_SIZE):
+    """
+    Read the ruptures of a column store in chunks (memory-mapped).
+    """
+    db = ColumnStore(store, 'r')
+    data = db.read('rupture')
+
+    for i0 in range(0, db.size('rupture'), chunk_size):
+        yield {k: np.asarray(v[i0:i0+chunk_size]) for k, v in data.items()}
+
+
+def event_based_hazard(ruptures, mesh, gmpe, imts, imls, duration,
+                       investigation_time=50., between_std=None,
+                       correlation_range=None, imt_correlation=None,
+                       seed=None, store=None):
+    """
+    Empirical hazard curves from the ground-motion fields of
+    a stochastic event set.
+
+    :param ruptures:
+        iterable of rupture chunks (see stochastic_event_set and
+        read_ruptures)
+
+    :param WgsMesh mesh:
+        the site mesh
+
+    :param GMPE gmpe:
+        the ground motion model
+
+    :param list imts:
+        intensity measure types
+
+    :param numpy.array imls:
+        intensity measure levels (n_iml,) or (n_imt, n_iml)
+
+    :param float duration:
+        duration of the event set in years
+
+    :param float investigation_time:
+        investigation time of the output probabilities
+
+    :param float between_std:
+        standard deviation (natural log) of the between-event residuals
+
+    :param float correlation_range:
+        range (km) of the spatial correlation of within-event
+        residuals; uncorrelated if None. The correlation matrix
+        is factorised once for the mesh
+
+    :param numpy.array imt_correlation:
+        correlation matrix (n_imt, n_imt) of the residuals of
+        different IMTs (e.g. from correlation.baker_jayaram_matrix),
+        applied to both between and within-event terms; if None, the
+        same residuals are used for all IMTs (perfect correlation)
+
+    :param int seed:
+        root seed of the residual sampling (one child per chunk)
+
+    :param string store:
+        if given, ground motions exceeding the lowest level of
+        at least one IMT are appended to the 'gmf' table of a column
+        store (columns Rupture, Site and one per IMT)
+
+    :return numpy.array poe:
+        probabilities of exceedance as (n_imt, n_sites, n_iml)
+    """
+    lat, lon = mesh.to_array()
+
+    imls = np.asarray(imls, dtype=float)
+    if imls.ndim == 1:
+        imls = np.tile(imls, (len(imts), 1))
+    log_iml = np.log(imls)
+
+    if between_std is None:
+        between_std = 0.
+
+    sampler = None
+    if correlation_range is not None:
+        sampler = CorrelatedResiduals(lat, lon, correlation_range)
+
+    cross = None
+    if imt_correlation is not None:
+        cross = _correlation_factor(imt_correlation, len(imts))
+
+    if store is not None:
+        db = ColumnStore(store, 'a')
+        if 'gmf' in db:
+            db.remove('gmf')
+
+    count = np.zeros((len(imts), len(lat), imls.shape[1]))
+    root = np.random.SeedSequence(seed)
+    offset = 0
+
+    for chunk in ruptures:
+        rng = np.random.default_rng(root.spawn(1)[0])
+        size = len(chunk['Magnitude'])
+
+        # Sub-blocks of ruptures to bound memory
+        block = max(1, MAX_ELEMENTS // (len(imts)*len(lat)))
+
+        for r0 in range(0, size, block):
+            r1 = min(r0 + block, size)
+
+            dist = _distance(chunk['Latitude'][r0:r1],
+                             chunk['Longitude'][r0:r1],
+                             chunk['Depth'][r0:r1], lat, lon,
+                             gmpe.DISTANCE_METRIC)
+
+            # Log ground motion as (imt, rupture, site)
+            mean, stdv = gmpe.ground_motion_table(
+                imts, chunk['Magnitude'][r0:r1, None], dist)
+
+            within = np.sqrt(np.maximum(stdv**2 - between_std**2, 0.))
+
+            if cross is None:
+                # Same residuals for all IMTs
+                eps = _residuals(sampler, r1 - r0, len(lat), rng)
+                eta = rng.standard_normal((r1 - r0, 1))
+            else:
+                eps = np.array([_residuals(sampler, r1 - r0, len(lat), rng)
+                                for i in range(len(imts))])
+                eps = np.einsum('ij,jrs->irs', cross, eps)
+                eta = cross @ rng.standard_normal((len(imts), r1 - r0))
+                eta = eta[..., None]
+
+            lgm = mean + between_std*eta + within*eps
+
+            # Exceedance counts by sorting the levels
+            for i in range(len(imts)):
+                idx = np.searchsorted(log_iml[i], lgm[i], side='left')
+                count[i] += _level_counts(idx, imls.shape[1])
+
+            if store is not None:
+                above = np.any(lgm >= log_iml[:, 0, None, None], axis=0)
+                rup, site = np.nonzero(above)
+                data = {'Rupture': rup + offset + r0, 'Site': site}
+                for i, imt in enumerate(imts):
+                    data[imt] = np.exp(lgm[i][rup, site])
+                db.append('gmf', data)
+
+        offset += size
+
+    return poisson_probability(count/duration, investigation_time)
+
+
+def _residuals(sampler, size, site_num, rng):
+    """
+    Internal: within-event residuals as (size, n_sites),
+    spatially correlated if a sampler is given.
+    """
+    if sampler is None:
+        return rng.standard_normal((size, site_num))
+
+    return sampler.sample(size, rng)
+
+
+def _correlation_factor(corr, imt_num):
+    """
+    Internal: factor L of a correlation matrix (L @ L.T = corr),
+    by eigen-decomposition to allow semi-definite matrices.
+    """
+    corr = np.asarray(corr, dtype=float)
+
+    if corr.shape != (imt_num, imt_num):
+        raise ValueError('IMT correlation matrix does not match the IMTs')
+
+    eig, vec = np.linalg.eigh(corr)
+
+    return vec*np.sqrt(np.maximum(eig, 0.))
+
+
+def _level_counts(idx, level_num):
+    """
+    Internal: number of values exceeding each level, given the
+    insertion indexes of the values in the sorted levels,
+    as (n_sites, n_levels).
+    """
+    site_num = idx.shape[1]
+    flat = idx + (level_num + 1)*np.arange(site_num)[None, :]
+    hist = np.bincount(flat.ravel(), minlength=site_num*(level_num + 1))
+    hist = hist.reshape(site_num, level_num + 1)
+
+    # Values with index k exceed levels 0..k-1
+    return np.cumsum(hist[:, ::-1], axis=1)[:, ::-1][:, 1:]
+
+
+def _plan_chunks(sources, duration, chunk_size, seed):
+    """
+    Internal: list of chunk jobs (source index, source, size,
+    duration, seed sequence). The number of ruptures of each source
+    is drawn from the source seed, so the plan is reproducible.
+    """
+    root = np.random.SeedSequence(seed)
+    jobs = []
+
+    for i, (source, ss) in enumerate(zip(sources,
+                                         root.spawn(len(sources)))):
+        rate = np.sum(source.mfd.incremental_rates(source.bin_width)[1])
+        num = np.random.default_rng(ss).poisson(rate*duration)
+
+        chunk_num = -(-num // chunk_size)
+        for k, css in enumerate(ss.spawn(chunk_num)):
+            size = min(chunk_size, num - k*chunk_size)
+            jobs.append((i, source, size, duration, css))
+
+    return jobs
+
+
+def _generate_chunk(index, source, size, duration, seed):
+    """
+    Internal: generate a chunk of ruptures of a source.
+    """
+    rng = np.random.default_rng(seed)
+
+    time = np.sort(rng.random(size)*duration)
+    mag = source.mfd.inverse_sampling(size, rng)
+
+    if isinstance(source, AreaSource):
+        lat, lon = _sample_polygon(source.polygon, size, rng)
+    else:
+        lat = np.full(size, float(source.latitude))
+        lon = np.full(size, float(source.longitude))
+
+    return {'Source': np.full(size, index, dtype=np.int32),
+            'Time': time,
+            'Magnitude': mag,
+            'Latitude': lat,
+            'Longitude': lon,
+            'Depth': np.full(size, float(source.depth))}
+
+
+def _sample_polygon(polygon, size, rng):
+    """
+    Internal: points uniformly distributed (on the sphere) inside
+    a polygon, by rejection sampling over its bounding box.
+    """
+    latlim, lonlim = polygon.get_bounds()
+
+    zlim = np.sin(np.radians(latlim))
+
+    lat = np.empty(0)
+    lon = np.empty(0)
+    ratio = 1.
+
+    while len(lat) < size:
+        num = int((size - len(lat))/ratio*1.1) + 16
+
+        la = np.degrees(np.arcsin(rng.uniform(zlim[0], zlim[1], num)))
+        lo = rng.uniform(lonlim[0], lonlim[1], num)
+
+        inside = polygon.contains_array(la, lo)
+        ratio = max(np.mean(inside), 0.01)
+
+        lat = np.concatenate((lat, la[inside]))
+        lon = np.concatenate((lon, lo[inside]))
+
+    return lat[:size], lon[:size]
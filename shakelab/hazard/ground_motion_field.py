@@ -0,0 +1,336 @@
+# ****************************************************************************
+#
+# Copyright (C) 2019-2020, ShakeLab Developers.
+# This file is part of ShakeLab.
+#
+# ShakeLab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ShakeLab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+#
+# ****************************************************************************
+"""
+Scenario ground-motion fields with spatially correlated residuals.
+
+Within-event residuals follow an exponential correlation model
+(Jayaram and Baker, 2009). Small site sets are sampled exactly by
+Cholesky factorisation of the correlation matrix; large sets are
+sampled by circulant embedding (FFT) on a regular grid, which is the
+mesh itself for cartesian meshes, or an auxiliary grid finer than the
+correlation range for irregular site sets.
+"""
+
+import numpy as np
+
+from shakelab.libutils.geodetic import (wgs_to_xy_sinproj,
+                                        circle_distance_matrix)
+from shakelab.hazard.correlation import jayaram_baker_range
+
+# Maximum number of sites for the Cholesky method
+CHOLESKY_MAX = 5000
+
+# Maximum number of (complex) grid cells sampled at once
+FFT_BLOCK = 2**24
+
+
+def ground_motion_field(mesh, event, gmpe, imt='PGA', realizations=1,
+                        between_std=None, correlation_range=None,
+                        clustered=False, method='auto', grid_spacing=None,
+                        seed=None):
+    """
+    Generate realizations of a scenario ground-motion field.
+
+    :param WgsMesh mesh:
+        the site mesh
+
+    :param Event event:
+        the earthquake (prime location and magnitude are used)
+
+    :param GMPE gmpe:
+        the ground motion model
+
+    :param string imt:
+        intensity measure type (e.g. PGA, SA-0.10)
+
+    :param int realizations:
+        number of realizations
+
+    :param float between_std:
+        standard deviation (natural log) of the between-event
+        residuals; the within-event standard deviation is obtained
+        from the total one. If None, all the variability is assigned
+        to the (correlated) within-event term
+
+    :param float correlation_range:
+        range (km) of the exponential correlation model; if not
+        given, it is derived from the IMT period (Jayaram and Baker)
+
+    :param bool clustered:
+        Vs30 clustering option of the Jayaram and Baker model
+
+    :param string method:
+        'cholesky', 'fft' or 'auto'
+
+    :param float grid_spacing:
+        spacing (km) of the auxiliary grid for irregular site sets
+        (default is one tenth of the correlation range)
+
+    :param int seed:
+        seed (or numpy Generator) of the random sampling
+
+    :return numpy.array gmf:
+        ground motion in the GMPE units, as (realizations, n_sites)
+    """
+    lat, lon = mesh.to_array()
+
+    loc = event.location.prime
+    mag = event.magnitude.prime.size
+
+    dist = site_distance(lat, lon, loc.latitude, loc.longitude,
+                         loc.depth, gmpe.DISTANCE_METRIC)
+
+    mean, stdv = gmpe.ground_motion(imt, mag, dist)
+
+    if between_std is None:
+        between_std = 0.
+    within_std = np.sqrt(np.maximum(stdv**2 - between_std**2, 0.))
+
+    if correlation_range is None:
+        correlation_range = jayaram_baker_range(imt_period(imt), clustered)
+
+    rng = np.random.default_rng(seed)
+
+    eps = correlated_residuals(lat, lon, correlation_range, realizations,
+                               method=method, grid_spacing=grid_spacing,
+                               seed=rng)
+    eta = rng.standard_normal((realizations, 1))
+
+    return np.exp(mean + between_std*eta + within_std*eps)
+
+
+def site_distance(latitude, longitude, event_latitude, event_longitude,
+                  depth=0., metric='epicentral'):
+    """
+    Source-to-site distances (km) of a point source.
+    Joyner-Boore distance is equal to the epicentral one.
+    """
+    dist = circle_distance_matrix(event_latitude, event_longitude,
+                                  latitude, longitude)[0]/1e3
+
+    if metric == 'hypocentral':
+        dist = np.sqrt(dist**2 + (depth or 0.)**2)
+
+    elif metric not in ['epicentral', 'joyner-boore']:
+        raise ValueError('distance metric not supported')
+
+    return dist
+
+
+def imt_period(imt):
+    """
+    Period (s) of an intensity measure type label.
+    """
+    if imt == 'PGA':
+        return 0.
+    elif imt.startswith('SA-'):
+        return float(imt[3:])
+    else:
+        raise ValueError('period not defined for {0}'.format(imt))
+
+
+def correlated_residuals(latitude, longitude, correlation_range,
+                         realizations=1, method='auto', grid_spacing=None,
+                         seed=None):
+    """
+    Sample standard normal residuals with exponential spatial
+    correlation exp(-3h/b). To sample the same site set repeatedly,
+    use CorrelatedResiduals, which factorises the correlation once.
+
+    :return numpy.array eps:
+        residuals as (realizations, n_sites)
+    """
+    sampler = CorrelatedResiduals(latitude, longitude, correlation_range,
+                                  method, grid_spacing)
+
+    return sampler.sample(realizations, seed)
+
+
+class CorrelatedResiduals():
+    """
+    Sampler of standard normal residuals with exponential spatial
+    correlation exp(-3h/b) on a fixed site set. The factorisation
+    (Cholesky factor or circulant embedding) is computed once.
+    """
+
+    def __init__(self, latitude, longitude, correlation_range,
+                 method='auto', grid_spacing=None):
+        """
+        :param float correlation_range:
+            range (km) of the exponential correlation model
+
+        :param string method:
+            'cholesky', 'fft' or 'auto'
+
+        :param float grid_spacing:
+            spacing (km) of the auxiliary grid of the fft method
+            (default is the site spacing for regular grids, or one
+            tenth of the correlation range)
+        """
+        x, y = wgs_to_xy_sinproj(np.asarray(latitude),
+                                 np.asarray(longitude))
+        x = x/1e3
+        y = y/1e3
+
+        if method == 'auto':
+            method = 'cholesky' if len(x) <= CHOLESKY_MAX else 'fft'
+
+        self.method = method
+        self.size = len(x)
+
+        if method == 'cholesky':
+            self._lower = _cholesky_factor(x, y, correlation_range)
+
+        elif method == 'fft':
+            if grid_spacing is None:
+                grid_spacing = _grid_spacing(x, y)
+                if grid_spacing is None:
+                    grid_spacing = correlation_range/10.
+
+            ix = np.round((x - np.min(x))/grid_spacing).astype(int)
+            iy = np.round((y - np.min(y))/grid_spacing).astype(int)
+
+            self._node = (ix, iy)
+            self._sqrt_eig = _embedding(np.max(ix) + 1, np.max(iy) + 1,
+                                        grid_spacing, correlation_range)
+
+        else:
+            raise ValueError('method not recognized')
+
+    def sample(self, realizations=1, seed=None):
+        """
+        Draw realizations of the residuals.
+
+        :param int seed:
+            seed (or numpy Generator) of the random sampling
+
+        :return numpy.array eps:
+            residuals as (realizations, n_sites)
+        """
+        rng = np.random.default_rng(seed)
+
+        if self.method == 'cholesky':
+            z = rng.standard_normal((realizations, self.size))
+            return z @ self._lower.T
+
+        return _fft_sampling(self._node, self._sqrt_eig, realizations, rng)
+
+
+def _cholesky_factor(x, y, correlation_range):
+    """
+    Internal: Cholesky factor of the full correlation matrix
+    for exact sampling.
+    """
+    dist = np.hypot(x[:, None] - x[None, :], y[:, None] - y[None, :])
+    corr = np.exp(-3.*dist/correlation_range)
+
+    # Small jitter for numerical stability (coincident sites)
+    corr[np.diag_indices_from(corr)] += 1e-10
+
+    return np.linalg.cholesky(corr)
+
+
+def _fft_sampling(node, sqrt_eig, realizations, rng):
+    """
+    Internal: sampling by circulant embedding of the correlation
+    matrix of a regular grid; sites take the value of the nearest
+    grid node.
+    """
+    ix, iy = node
+    mx, my = sqrt_eig.shape
+
+    eps = np.empty((realizations, len(ix)))
+    block = max(1, FFT_BLOCK // (mx*my))
+
+    n = 0
+    while n < realizations:
+        # Real and imaginary parts are independent realizations
+        num = min(block, (realizations - n + 1)//2)
+        z = (rng.standard_normal((num, mx, my))
+             + 1j*rng.standard_normal((num, mx, my)))
+        field = np.fft.fft2(sqrt_eig*z, axes=(1, 2))[:, ix, iy]
+
+        for part in [field.real, field.imag]:
+            size = min(num, realizations - n)
+            eps[n:n+size] = part[:size]
+            n += size
+
+    return eps
+
+
+def _embedding(nx, ny, spacing, correlation_range, max_iter=5):
+    """
+    Internal: square root of the (scaled) eigenvalues of the
+    circulant embedding of the grid correlation matrix. The torus
+    is enlarged until the embedding is (almost) positive definite.
+    """
+    mx = _fft_size(2*(nx - 1))
+    my = _fft_size(2*(ny - 1))
+
+    for it in range(max_iter):
+        lx = np.minimum(np.arange(mx), mx - np.arange(mx))*spacing
+        ly = np.minimum(np.arange(my), my - np.arange(my))*spacing
+        dist = np.hypot(lx[:, None], ly[None, :])
+
+        eig = np.fft.fft2(np.exp(-3.*dist/correlation_range)).real
+
+        if np.min(eig) >= -1e-8*np.max(eig):
+            break
+
+        mx = _fft_size(2*mx)
+        my = _fft_size(2*my)
+
+    return np.sqrt(np.maximum(eig, 0.)/(mx*my))
+
+
+def _fft_size(n):
+    """
+    Internal: smallest 2-3-5 smooth number not lower than n.
+    """
+    n = max(int(n), 1)
+    while True:
+        m = n
+        for p in [2, 3, 5]:
+            while m % p == 0:
+                m //= p
+        if m == 1:
+            return n
+        n += 1
+
+
+def _grid_spacing(x, y, tol=0.25):
+    """
+    Internal: spacing of the sites if they lie on a regular
+    grid (e.g. a cartesian mesh), otherwise None.
+    """
+    uy = np.unique(np.round(y, 3))
+    if len(uy) < 2:
+        return None
+
+    # Average spacing is more robust to coordinate rounding
+    span = uy[-1] - uy[0]
+    spacing = span/np.round(span/np.min(np.diff(uy)))
+
+    for v in [x, y]:
+        r = (v - np.min(v))/spacing
+        if np.max(np.abs(r - np.round(r))) > tol:
+            return None
+
+    return spacing
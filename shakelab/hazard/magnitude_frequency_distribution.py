@@ -86,22 +86,41 @@ class BoundedGutembergRichter():
         if magnitude is None:
             magnitude = self.min_mag
 
+        magnitude = np.asarray(magnitude, dtype=float)
+
         p1 = 10.**self.a_value
         p2 = 10.**(-self.b_value * magnitude)
         p3 = 10.**(-self.b_value * self.max_mag)
 
         cumrts = p1 * (p2 - p3)
 
-        cumrts[magnitude > self.max_mag] = 0.
-        return cumrts
+        return np.where(magnitude > self.max_mag, 0., cumrts)
+
+    def incremental_rates(self, bin_width=0.1):
+        """
+        Annual rates of magnitude bins of given width between
+        minimum and maximum magnitude.
+        Return bin centres and rates.
+        """
+
+        bin_num = max(int(np.round((self.max_mag - self.min_mag)
+                                   / bin_width)), 1)
+        edges = np.linspace(self.min_mag, self.max_mag, bin_num + 1)
+
+        cumrts = self.cumulative_rates(edges)
+
+        return (edges[:-1] + edges[1:])/2., cumrts[:-1] - cumrts[1:]
 
-    def inverse_sampling(self, snum):
+    def inverse_sampling(self, snum, seed=None):
         """
         Samples are derived using the inverse transform sampling (also known
         as inversion sampling, inverse probability integral transform)
+        A seed (or numpy Generator) can be given for reproducibility;
+        if None, the global numpy random state is used.
         """
 
-        um = np.random.rand(snum)
+        rng = np.random if seed is None else np.random.default_rng(seed)
+        um = rng.random(snum)
         cf = 1.-(10.**(-self.b_value*(self.max_mag-self.min_mag)))
         return self.min_mag-np.log10(1.-(um*cf))/self.b_value
 
@@ -0,0 +1,280 @@
+# ****************************************************************************
+#
+# Copyright (C) 2019-2020, ShakeLab Developers.
+# This file is part of ShakeLab.
+#
+# ShakeLab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ShakeLab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+#
+# ****************************************************************************
+"""
+Classical probabilistic seismic hazard analysis (PSHA).
+
+For each source, exceedance probabilities are computed as a single
+tensor (IMT, magnitude, source point, site, IML) and contracted with
+the occurrence rates. Sites, source points and magnitudes are processed
+in blocks to bound memory, while sources can be distributed to a
+process pool.
+"""
+
+import numpy as np
+from scipy.special import ndtr
+
+from shakelab.libutils.geodetic import circle_distance_matrix
+from shakelab.libutils.utils import run_jobs
+from shakelab.seismicity.seismicity import poisson_probability
+
+# Maximum number of elements of the exceedance tensor
+MAX_ELEMENTS = 2**24
+
+
+class PointSource():
+    """
+    Point source with a magnitude frequency distribution
+    (e.g. BoundedGutembergRichter).
+    """
+
+    def __init__(self, latitude, longitude, depth, mfd, bin_width=0.1):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.depth = depth
+        self.mfd = mfd
+        self.bin_width = bin_width
+
+    def get_ruptures(self):
+        """
+        Return location of the source points (latitude, longitude and
+        depth arrays), magnitude bins and annual rates as
+        (n_magnitudes, n_points).
+        """
+        mag, rate = self.mfd.incremental_rates(self.bin_width)
+
+        return (np.array([self.latitude]), np.array([self.longitude]),
+                np.array([self.depth]), mag, rate[:, None])
+
+
+class AreaSource():
+    """
+    Area source with uniform seismicity, discretised into point
+    sources on a cartesian mesh of given spacing (km).
+    """
+
+    def __init__(self, polygon, depth, mfd, spacing=5., bin_width=0.1):
+        self.polygon = polygon
+        self.depth = depth
+        self.mfd = mfd
+        self.spacing = spacing
+        self.bin_width = bin_width
+
+    def get_ruptures(self):
+        """
+        Return location of the source points (latitude, longitude and
+        depth arrays), magnitude bins and annual rates as
+        (n_magnitudes, n_points).
+        """
+        mesh = self.polygon.create_mesh(self.spacing*1e3, meters=True)
+        lat, lon = mesh.to_array()
+
+        if not len(lat):
+            raise ValueError('source discretisation is empty')
+
+        mag, rate = self.mfd.incremental_rates(self.bin_width)
+        rate = np.repeat(rate[:, None]/len(lat), len(lat), axis=1)
+
+        return lat, lon, np.full(len(lat), float(self.depth)), mag, rate
+
+
+def hazard_curves(mesh, sources, gmpe, imts, imls, investigation_time=50.,
+                  truncation=None, max_distance=300., workers=None):
+    """
+    Compute hazard curves on a site mesh.
+
+    :param WgsMesh mesh:
+        the site mesh
+
+    :param list sources:
+        list of PointSource / AreaSource objects
+
+    :param GMPE gmpe:
+        the ground motion model
+
+    :param list imts:
+        intensity measure types
+
+    :param numpy.array imls:
+        intensity measure levels in GMPE units, either common to all
+        IMTs (n_iml,) or one row per IMT (n_imt, n_iml)
+
+    :param float investigation_time:
+        investigation time in years
+
+    :param float truncation:
+        truncation level of the GMPE distribution (number of standard
+        deviations); no truncation if None
+
+    :param float max_distance:
+        integration distance in km
+
+    :param int workers:
+        number of processes for the source loop (serial if None)
+
+    :return numpy.array poe:
+        probabilities of exceedance as (n_imt, n_sites, n_iml)
+    """
+    lat, lon = mesh.to_array()
+
+    imls = np.asarray(imls, dtype=float)
+    if imls.ndim == 1:
+        imls = np.tile(imls, (len(imts), 1))
+
+    args = (lat, lon, gmpe, list(imts), imls, truncation, max_distance)
+    rate = np.zeros((len(imts), len(lat), imls.shape[1]))
+
+    jobs = ((src,) + args for src in sources)
+    for src_rate in run_jobs(source_rates, jobs, workers):
+        rate += src_rate
+
+    return poisson_probability(rate, investigation_time)
+
+
+def source_rates(source, latitude, longitude, gmpe, imts, imls,
+                 truncation=None, max_distance=300.):
+    """
+    Annual rates of exceedance due to a single source, as
+    (n_imt, n_sites, n_iml). Sites, source points and (if needed)
+    magnitudes are processed in blocks, so that the exceedance
+    tensor has at most MAX_ELEMENTS elements.
+    """
+    (slat, slon, sdep, mag, rate) = source.get_ruptures()
+
+    log_iml = np.log(imls)
+    nimt, niml = imls.shape
+    nsite = len(latitude)
+
+    # Block sizes of magnitudes, then source points, then sites
+    size = nimt * niml
+    mblock = min(max(MAX_ELEMENTS // size, 1), len(mag))
+    size *= mblock
+    pblock = min(max(MAX_ELEMENTS // size, 1), len(slat))
+    size *= pblock
+    sblock = max(MAX_ELEMENTS // size, 1)
+
+    out = np.zeros((nimt, nsite, niml))
+
+    for s0 in range(0, nsite, sblock):
+        s1 = min(s0 + sblock, nsite)
+
+        for p0 in range(0, len(slat), pblock):
+            p1 = min(p0 + pblock, len(slat))
+
+            # Distances (source points, sites) in km
+            dist = _distance(slat[p0:p1], slon[p0:p1], sdep[p0:p1],
+                             latitude[s0:s1], longitude[s0:s1],
+                             gmpe.DISTANCE_METRIC)
+            near = dist <= max_distance
+
+            if not np.any(near):
+                continue
+
+            for m0 in range(0, len(mag), mblock):
+                m1 = min(m0 + mblock, len(mag))
+
+                # Mean and stdv as (imt, magnitude, point, site)
+                mean, stdv = gmpe.ground_motion_table(
+                        imts, mag[m0:m1, None, None], dist[None, :, :])
+
+                # Exceedance probability (imt, magnitude, point, site, iml)
+                z = (log_iml[:, None, None, None, :] - mean[..., None])
+                z /= stdv[..., None]
+                poe = _exceedance(z, truncation)
+
+                out[:, s0:s1, :] += np.einsum('mp,ps,impsl->isl',
+                                              rate[m0:m1, p0:p1],
+                                              near.astype(float), poe)
+    return out
+
+
+def uniform_hazard_spectrum(imls, poe, target_poe):
+    """
+    Intensity levels with a given probability of exceedance,
+    by log-log interpolation of the hazard curves.
+
+    :param numpy.array imls:
+        intensity measure levels (n_iml,) or (n_imt, n_iml)
+
+    :param numpy.array poe:
+        hazard curves as (n_imt, n_sites, n_iml)
+
+    :param float target_poe:
+        target probability of exceedance (e.g. 0.1 in 50 years)
+
+    :return numpy.array uhs:
+        intensity levels as (n_imt, n_sites); NaN where the target
+        is outside the curve
+    """
+    poe = np.asarray(poe)
+    imls = np.asarray(imls, dtype=float)
+    if imls.ndim == 1:
+        imls = np.tile(imls, (poe.shape[0], 1))
+
+    log_poe = np.log(np.maximum(poe, 1e-300))
+    log_iml = np.log(imls)
+    target = np.log(target_poe)
+
+    # Hazard curves are decreasing: first level below the target
+    below = log_poe < target
+    idx = np.argmax(below, axis=-1)
+    valid = np.any(below, axis=-1) & (idx > 0)
+    idx = np.maximum(idx, 1)
+
+    p0 = np.take_along_axis(log_poe, (idx - 1)[..., None], -1)[..., 0]
+    p1 = np.take_along_axis(log_poe, idx[..., None], -1)[..., 0]
+
+    l0 = np.take_along_axis(log_iml[:, None, :].repeat(poe.shape[1], 1),
+                            (idx - 1)[..., None], -1)[..., 0]
+    l1 = np.take_along_axis(log_iml[:, None, :].repeat(poe.shape[1], 1),
+                            idx[..., None], -1)[..., 0]
+
+    with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+        uhs = np.exp(l0 + (target - p0)*(l1 - l0)/(p1 - p0))
+
+    return np.where(valid, uhs, np.nan)
+
+
+def _distance(slat, slon, depth, latitude, longitude, metric):
+    """
+    Internal: distance matrix (source points, sites) in km.
+    """
+    dist = circle_distance_matrix(slat, slon, latitude, longitude)/1e3
+
+    if metric == 'hypocentral':
+        dist = np.sqrt(dist**2 + depth[:, None]**2)
+
+    elif metric not in ['epicentral', 'joyner-boore']:
+        raise ValueError('distance metric not supported')
+
+    return dist
+
+
+def _exceedance(z, truncation=None):
+    """
+    Internal: probability of exceeding normalised levels, with
+    optional truncation of the normal distribution.
+    """
+    if truncation is None:
+        return ndtr(-z)
+
+    tail = ndtr(-truncation)
+    poe = (ndtr(-z) - tail)/(1. - 2.*tail)
+
+    return np.clip(poe, 0., 1.)
@@ -0,0 +1,278 @@
+# ****************************************************************************
+#
+# Copyright (C) 2019-2020, ShakeLab Developers.
+# This file is part of ShakeLab.
+#
+# ShakeLab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ShakeLab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+#
+# ****************************************************************************
+"""
+A simple columnar storage on disk.
+
+A store is a directory containing one raw binary file per column
+and a JSON header with table sizes and column types. Columns can be
+read selectively as memory maps and new rows can be appended without
+rewriting the existing data.
+"""
+
+import os
+import json
+import numpy as np
+
+HEADER_FILE = 'header.json'
+
+
+class ColumnStore():
+    """
+    Columnar storage of one or more tables (dictionaries of
+    equal-length 1-D arrays) in a directory.
+    """
+    def __init__(self, path, mode='r'):
+        """
+        :param string path:
+            store directory
+
+        :param string mode:
+            'r' read only, 'a' read and append (the store is created
+            if not existing), 'w' create a new empty store (existing
+            tables are removed)
+        """
+        self.path = path
+        self.mode = mode
+        self.header = {'Attributes': {}, 'Tables': {}}
+
+        if mode == 'w':
+            os.makedirs(path, exist_ok=True)
+            for table in self._read_header()['Tables']:
+                self.remove(table)
+            self._write_header()
+
+        elif mode == 'a':
+            os.makedirs(path, exist_ok=True)
+            self.header = self._read_header()
+
+        elif mode == 'r':
+            if not is_store(path):
+                raise ValueError('not a valid column store')
+            self.header = self._read_header()
+
+        else:
+            raise ValueError('mode not recognized')
+
+    def __contains__(self, table):
+        return table in self.header['Tables']
+
+    @property
+    def tables(self):
+        return list(self.header['Tables'].keys())
+
+    @property
+    def attributes(self):
+        return self.header['Attributes']
+
+    def set_attributes(self, data):
+        """
+        Store a dictionary of (JSON serialisable) attributes.
+        """
+        self._check_writable()
+        self.header['Attributes'].update(data)
+        self._write_header()
+
+    def size(self, table):
+        """
+        Number of rows of a table.
+        """
+        return self.header['Tables'][table]['Size']
+
+    def columns(self, table):
+        """
+        Column names of a table.
+        """
+        return list(self.header['Tables'][table]['Columns'].keys())
+
+    def read(self, table, columns=None, mmap=True):
+        """
+        Read the selected columns of a table.
+
+        :param string table:
+            table name
+
+        :param list columns:
+            column names; if not given, all columns are read
+
+        :param bool mmap:
+            if True, columns are returned as read-only memory maps,
+            otherwise they are loaded into memory
+
+        :return dict data:
+            dictionary of 1-D arrays
+        """
+        info = self.header['Tables'][table]
+
+        if columns is None:
+            columns = info['Columns'].keys()
+
+        data = {}
+        for col in columns:
+            dtype = np.dtype(info['Columns'][col])
+            file = self._column_file(table, col)
+
+            if info['Size'] == 0:
+                data[col] = np.empty(0, dtype=dtype)
+            elif mmap:
+                data[col] = np.memmap(file, dtype=dtype, mode='r',
+                                      shape=(info['Size'],))
+            else:
+                data[col] = np.fromfile(file, dtype=dtype,
+                                        count=info['Size'])
+        return data
+
+    def write(self, table, data):
+        """
+        Write a table, replacing any existing one with the same name.
+        """
+        self._check_writable()
+        if table in self:
+            self.remove(table)
+
+        self.header['Tables'][table] = {'Size': 0, 'Columns': {}}
+        self.append(table, data)
+
+    def append(self, table, data):
+        """
+        Append rows to a table (created if not existing).
+        Column set must match the existing one. Columns are
+        promoted to a wider type (e.g. longer strings) if necessary;
+        only in such case the column is rewritten.
+
+        Column files are first truncated to the size recorded in the
+        header, so that rows left by an interrupted append (written
+        to the columns but not to the header) are discarded. Type
+        promotion is not protected in this way.
+        """
+        self._check_writable()
+        data = {k: np.asarray(v) for k, v in data.items()}
+        data = {k: v.astype(str) if v.dtype.kind == 'O' else v
+                for k, v in data.items()}
+
+        size = set(len(v) for v in data.values())
+        if len(size) > 1:
+            raise ValueError('columns must have equal length')
+        size = size.pop() if size else 0
+
+        if table not in self:
+            self.header['Tables'][table] = {'Size': 0, 'Columns': {}}
+
+        info = self.header['Tables'][table]
+
+        if info['Size'] > 0 and set(data) != set(info['Columns']):
+            raise ValueError('columns do not match the existing table')
+
+        for col, value in data.items():
+            file = self._column_file(table, col)
+
+            if col in info['Columns']:
+                dtype = np.dtype(info['Columns'][col])
+                new_dtype = _promote_types(dtype, value.dtype)
+
+                if new_dtype != dtype:
+                    old = np.fromfile(file, dtype=dtype, count=info['Size'])
+                    old.astype(new_dtype).tofile(file)
+                    info['Columns'][col] = new_dtype.str
+            else:
+                new_dtype = _promote_types(None, value.dtype)
+                info['Columns'][col] = new_dtype.str
+
+            # Discard any data beyond the recorded size
+            mode = 'r+b' if os.path.exists(file) else 'wb'
+            with open(file, mode) as f:
+                f.truncate(info['Size']*new_dtype.itemsize)
+                f.seek(0, os.SEEK_END)
+                value.astype(new_dtype).tofile(f)
+
+        info['Size'] += size
+        self._write_header()
+
+    def remove(self, table):
+        """
+        Delete a table and its column files.
+        """
+        self._check_writable()
+        info = self._read_header()['Tables'].get(table)
+
+        if info is not None:
+            for col in info['Columns']:
+                file = self._column_file(table, col)
+                if os.path.exists(file):
+                    os.remove(file)
+
+        self.header['Tables'].pop(table, None)
+        self._write_header()
+
+    def _column_file(self, table, column):
+        return os.path.join(self.path, '{0}.{1}.bin'.format(table, column))
+
+    def _check_writable(self):
+        if self.mode == 'r':
+            raise ValueError('store is opened in read-only mode')
+
+    def _read_header(self):
+        file = os.path.join(self.path, HEADER_FILE)
+        if os.path.exists(file):
+            with open(file, 'r') as f:
+                return json.load(f)
+        return {'Attributes': {}, 'Tables': {}}
+
+    def _write_header(self):
+        # Header is written last and atomically; column data not
+        # yet recorded in the header are discarded at next append
+        file = os.path.join(self.path, HEADER_FILE)
+        with open(file + '.tmp', 'w') as f:
+            json.dump(self.header, f, indent=1)
+        os.replace(file + '.tmp', file)
+
+
+def is_store(path):
+    """
+    Check if a path is a column store.
+    """
+    return os.path.isfile(os.path.join(path, HEADER_FILE))
+
+
+def _promote_types(old, new):
+    """
+    Internal: common storage type of two dtypes. Mixed numbers
+    and strings are promoted to strings.
+    """
+    if old is None:
+        return new
+
+    if old.kind == 'U' or new.kind == 'U':
+        width = max(_str_width(old), _str_width(new))
+        return np.dtype('<U{0}'.format(width))
+
+    return np.promote_types(old, new)
+
+
+def _str_width(dtype):
+    """
+    Internal: number of characters needed to represent a dtype.
+    """
+    if dtype.kind == 'U':
+        return dtype.itemsize // 4
+    if dtype.kind == 'S':
+        return dtype.itemsize
+    if dtype.kind == 'b':
+        return 5
+    return 32
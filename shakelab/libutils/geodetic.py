@@ -23,11 +23,13 @@ This modules includes a set of tools for geographical data manipulation.
 """
 
 __all__ = ['read_geometry', 'write_geometry',
-           'WgsPoint', 'WgsPolygon']
+           'WgsPoint', 'WgsPolygon', 'WgsMesh', 'WgsIndex']
 
 import numpy as np
 import json
 
+from scipy.spatial import cKDTree
+
 import matplotlib as _mat
 
 # GEODETIC CONSTANTS
@@ -37,6 +39,15 @@ POLAR_EARTH_RADIUS = 6356752.3
 DEG_TO_M = 111195.
 NDIGITS = 4
 
+# Maximum number of elements of a distance matrix block
+DISTANCE_BLOCK = 2**22
+
+# Maximum number of (point, edge) pairs tested at once
+CONTAINS_BLOCK = 2**22
+
+# Default number of points of the mesh generator chunks
+MESH_CHUNK = 2**20
+
 
 def read_geometry(geometry_file):
     """
@@ -75,6 +86,8 @@ def read_geometry(geometry_file):
             if ftype == 'Polygon':
                 item = WgsPolygon()
                 item.from_list(fcoor[0])
+                for hole in fcoor[1:]:
+                    item.add_hole(WgsPolygon(hole))
                 item.attributes = fatt
                 collection.append(item)
 
@@ -82,6 +95,8 @@ def read_geometry(geometry_file):
                 for fpart in fcoor:
                     item = WgsPolygon()
                     item.from_list(fpart[0])
+                    for hole in fpart[1:]:
+                        item.add_hole(WgsPolygon(hole))
                     item.attributes = fatt
                     collection.append(item)
 
@@ -241,11 +256,13 @@ class WgsPoint():
 class WgsPolygon():
     """
     A polygon in geographical coordinates.
-    Vertexes are in a list of WgsPoints.
+    Vertexes are in a list of WgsPoints; holes (optional) are
+    a list of WgsPolygons.
     """
 
     def __init__(self, points=None):
         self.points = []
+        self.holes = []
         if points is not None:
             self.from_list(points)
         self.attributes = {}
@@ -270,6 +287,10 @@ class WgsPolygon():
 
         self.points.append(point)
 
+    def add_hole(self, polygon):
+
+        self.holes.append(polygon)
+
     def from_array(self, latitude, longitude):
 
         for lat, lon in zip(latitude, longitude):
@@ -314,16 +335,37 @@ class WgsPolygon():
 
         return 1e-6 * polygon_area_shoelace(x, y)
 
+    def to_rings(self):
+        """
+        Export the boundary and the holes as a list of
+        (longitude, latitude) arrays.
+        """
+        rings = []
+        for poly in [self] + self.holes:
+            lat, lon = poly.to_array()
+            rings.append((lon, lat))
+
+        return rings
+
     def contains(self, point):
         """
         point is a WgsPoint object
         return boolean
         """
 
-        poly_lat, poly_lon = self.to_array()
+        return bool(self.contains_array(point.latitude, point.longitude))
 
-        return contains(poly_lon, poly_lat,
-                        point.longitude, point.latitude)
+    def contains_array(self, latitude, longitude):
+        """
+        Vectorized containment test of many points
+        (see contains_points).
+
+        Returns:
+            Boolean array, True for points inside the polygon
+            and outside its holes.
+        """
+
+        return contains_points(self.to_rings(), longitude, latitude)
 
     def create_mesh(self, delta, meters=False, mesh_type='cartesian'):
 
@@ -339,10 +381,9 @@ class WgsPolygon():
                                               lonlim=bnd[1])
 
         mesh = WgsMesh()
-        poly_lat, poly_lon = self.to_array()
-        for lat, lon in zip(grd_lat, grd_lon):
-            if contains(poly_lon, poly_lat, lon, lat):
-                mesh.add(WgsPoint(lat, lon))
+        inside = self.contains_array(grd_lat, grd_lon)
+        for lat, lon in zip(grd_lat[inside], grd_lon[inside]):
+            mesh.add(WgsPoint(lat, lon))
 
         return mesh
 
@@ -353,6 +394,7 @@ class WgsMesh():
     def __init__(self, ):
         self.points = []
         self.attributes = {}
+        self._index = None
 
     def __iter__(self):
         self._counter = 0
@@ -379,13 +421,47 @@ class WgsMesh():
 
         return lat, lon
 
+    def get_index(self):
+        """
+        Spatial index (WgsIndex) of the mesh points. The index is
+        built at the first call and rebuilt only if the mesh changes.
+        """
+        if self._index is None or len(self._index) != len(self.points):
+            lat, lon = self.to_array()
+            self._index = WgsIndex(lat, lon)
+            self._index.rebuild()
+
+        return self._index
+
+    def query_radius(self, latitude, longitude, radius):
+        """
+        Positions of the mesh points within a great-circle distance
+        (meters) from a location (see WgsIndex.query_radius).
+        """
+        return self.get_index().query_radius(latitude, longitude, radius)
+
+    def query_nearest(self, latitude, longitude, k=1):
+        """
+        Distances (meters) and positions of the k nearest mesh points
+        to one or more locations (see WgsIndex.query_nearest).
+        """
+        return self.get_index().query_nearest(latitude, longitude, k)
+
     def intersect(self, polygon):
+        """
+        Keep only the points inside a polygon, or inside any polygon
+        of a list (multi-polygon).
+        """
+        if isinstance(polygon, WgsPolygon):
+            polygon = [polygon]
+
+        # Polygons are tested separately, since they may overlap
+        lat, lon = self.to_array()
+        inside = np.zeros(len(self.points), dtype=bool)
+        for poly in polygon:
+            inside |= contains_points(poly.to_rings(), lon, lat)
 
-        points = []
-        for p in self.points:
-            if polygon.contains(p):
-                points.append(p)
-        self.points = points
+        self.points = [p for p, i in zip(self.points, inside) if i]
 
     def create_mesh(self, delta, meters=False, polygon=None,
                     latlim=(-90, 90), lonlim=(-180, 180),
@@ -417,6 +493,173 @@ class WgsMesh():
             for p in self.points:
                 f.write('{0},{1}\n'.format(p.latitude, p.longitude))
 
+
+class WgsIndex():
+    """
+    Spatial index of geographical locations for fast radius and
+    nearest-neighbour queries.
+
+    The index is a KD-tree built over the earth-centred cartesian
+    coordinates of the points (spherical earth approximation), so that
+    chord lengths map exactly to great-circle distances, consistently
+    with circle_distance. Distances are in meters.
+
+    Points can be added and removed incrementally. New points are kept
+    in a small buffer, searched by brute force, until the tree is
+    rebuilt; removal invalidates the tree, which is then rebuilt lazily
+    at the next query. Points with missing (NaN) coordinates are stored
+    to preserve indexing, but never returned by the queries.
+    """
+
+    def __init__(self, latitude=None, longitude=None, leafsize=16):
+        self.leafsize = leafsize
+
+        self._xyz = np.zeros((0, 3))
+        self._tree = None
+        self._tree_map = np.array([], dtype=int)
+        self._ntree = 0
+
+        if latitude is not None:
+            self.add(latitude, longitude)
+
+    def __len__(self):
+        return len(self._xyz)
+
+    def add(self, latitude, longitude):
+        """
+        Append one or more points to the index.
+
+        Args:
+            latitude (float or array):
+                Latitude of the points in decimal degrees.
+
+            longitude (float or array):
+                Longitude of the points in decimal degrees.
+        """
+        xyz = _wgs_to_xyz_array(latitude, longitude)
+        self._xyz = np.concatenate((self._xyz, xyz))
+
+        # Rebuild when the brute-force buffer becomes too large
+        if (len(self) - self._ntree) > max(256, self._ntree // 10):
+            self._tree = None
+
+    def remove(self, index):
+        """
+        Remove one or more points from the index, by position.
+        Positions of the following points are shifted accordingly.
+        """
+        index = np.array(index, ndmin=1, dtype=int) % len(self)
+        self._xyz = np.delete(self._xyz, index, axis=0)
+
+        if np.any(index < self._ntree):
+            self._tree = None
+
+    def rebuild(self):
+        """
+        (Re)build the KD-tree over all the stored points.
+        """
+        valid = np.all(np.isfinite(self._xyz), axis=1)
+        self._tree_map = np.flatnonzero(valid)
+        self._tree = cKDTree(self._xyz[valid], leafsize=self.leafsize)
+        self._ntree = len(self._xyz)
+
+    def _check_tree(self):
+        """
+        Internal: rebuild the tree if invalidated.
+        """
+        if self._tree is None:
+            self.rebuild()
+
+    def _pending(self):
+        """
+        Internal: positions and coordinates of the points
+        not yet included in the tree.
+        """
+        idx = np.arange(self._ntree, len(self))
+        xyz = self._xyz[self._ntree:]
+        valid = np.all(np.isfinite(xyz), axis=1)
+
+        return idx[valid], xyz[valid]
+
+    def query_radius(self, latitude, longitude, radius):
+        """
+        Find all points within a given great-circle distance from
+        a geographical location.
+
+        Args:
+            latitude (float):
+                Latitude of the query location in decimal degrees.
+
+            longitude (float):
+                Longitude of the query location in decimal degrees.
+
+            radius (float):
+                Search radius (great-circle distance) in meters.
+
+        Returns:
+            Sorted array of the positions of the selected points.
+        """
+        self._check_tree()
+
+        xyz = _wgs_to_xyz_array(latitude, longitude)[0]
+        chord = _arc_to_chord(radius)
+
+        idx = self._tree_map[self._tree.query_ball_point(xyz, chord)]
+
+        pidx, pxyz = self._pending()
+        if len(pidx):
+            pdst = np.sqrt(np.sum((pxyz - xyz)**2, axis=1))
+            idx = np.concatenate((idx, pidx[pdst <= chord]))
+
+        return np.sort(idx)
+
+    def query_nearest(self, latitude, longitude, k=1):
+        """
+        Find the k nearest points to one or more geographical locations.
+
+        Args:
+            latitude (float or array):
+                Latitude of the query locations in decimal degrees.
+
+            longitude (float or array):
+                Longitude of the query locations in decimal degrees.
+
+            k (int = 1):
+                Number of neighbours to return.
+
+        Returns:
+            Great-circle distances in meters and positions of the
+            nearest points, both with shape (n_query, k). Missing
+            neighbours (k larger than the number of points) are marked
+            with infinite distance and position equal to len(index).
+        """
+        self._check_tree()
+
+        xyz = _wgs_to_xyz_array(latitude, longitude)
+        nq = len(xyz)
+
+        dst = np.full((nq, k), np.inf)
+        idx = np.full((nq, k), len(self), dtype=int)
+
+        if self._tree.n > 0:
+            tdst, tidx = self._tree.query(xyz, k=k)
+            tdst = np.reshape(tdst, (nq, k))
+            tidx = np.reshape(tidx, (nq, k))
+            found = tidx < self._tree.n
+            dst[found] = tdst[found]
+            idx[found] = self._tree_map[tidx[found]]
+
+        pidx, pxyz = self._pending()
+        if len(pidx):
+            pdst = np.sqrt(np.sum((xyz[:, None, :] - pxyz[None])**2, axis=2))
+            dst = np.concatenate((dst, pdst), axis=1)
+            idx = np.concatenate((idx, np.tile(pidx, (nq, 1))), axis=1)
+            order = np.argsort(dst, axis=1)[:, :k]
+            dst = np.take_along_axis(dst, order, axis=1)
+            idx = np.take_along_axis(idx, order, axis=1)
+
+        return _chord_to_arc(dst), idx
+
 # ----------------------------------------------------------------------------
 # Geometric functions (cartesian x, y)
 
@@ -448,6 +691,132 @@ def contains(polygon_x, polygon_y, x, y):
 
     return result
 
+def contains_points(rings, x, y, prefilter=True, index=None,
+                    block=CONTAINS_BLOCK):
+    """
+    Vectorized point-in-polygon test (even-odd rule), consistent
+    with contains for single points.
+
+    Crossings of all the rings are counted together, so holes and
+    multi-polygons are given simply as additional rings. Points
+    outside the bounding box are discarded first; the remaining ones
+    are tested against the edges by blocks. For complex polygons,
+    edges are indexed on a uniform grid of horizontal bands, so that
+    each point is only tested against the edges of its band.
+
+    Args:
+        rings (list):
+            List of (x, y) vertex arrays; rings are closed implicitly.
+
+        x, y (float or array):
+            Coordinates of the points.
+
+        prefilter (bool = True):
+            Use the bounding box prefilter.
+
+        index (int = None):
+            Number of bands of the edge index; by default it is
+            chosen from the number of edges (no index for simple
+            polygons).
+
+        block (int):
+            Maximum number of (point, edge) pairs tested at once.
+
+    Returns:
+        Boolean array with the shape of the points.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    shape = np.broadcast(x, y).shape
+    x = np.broadcast_to(x, shape).ravel()
+    y = np.broadcast_to(y, shape).ravel()
+
+    x0, y0, x1, y1 = _ring_edges(rings)
+    inside = np.zeros(len(x), dtype=bool)
+
+    if not len(x0):
+        return inside.reshape(shape)
+
+    # Points to be tested
+    sel = np.isfinite(x) & np.isfinite(y)
+    if prefilter:
+        sel &= ((x >= min(x0.min(), x1.min()))
+                & (x <= max(x0.max(), x1.max()))
+                & (y > min(y0.min(), y1.min()))
+                & (y <= max(y0.max(), y1.max())))
+    sel = np.flatnonzero(sel)
+
+    if index is None:
+        index = int(np.sqrt(len(x0)/16)) if len(x0) > 64 else 1
+
+    if index <= 1:
+        inside[sel] = _crossings(x[sel], y[sel], x0, y0, x1, y1, block)
+        return inside.reshape(shape)
+
+    # Uniform band index over the edge y range
+    ymin = np.minimum(y0, y1)
+    ymax = np.maximum(y0, y1)
+    edges = np.linspace(ymin.min(), ymax.max(), index + 1)
+
+    band = np.clip(np.searchsorted(edges, y[sel]) - 1, 0, index - 1)
+    b0 = np.clip(np.searchsorted(edges, ymin, side='right') - 1,
+                 0, index - 1)
+    b1 = np.clip(np.searchsorted(edges, ymax) - 1, 0, index - 1)
+
+    for b in np.unique(band):
+        pts = sel[band == b]
+        e = (b0 <= b) & (b1 >= b)
+        inside[pts] = _crossings(x[pts], y[pts], x0[e], y0[e],
+                                 x1[e], y1[e], block)
+
+    return inside.reshape(shape)
+
+def _ring_edges(rings):
+    """
+    Internal: start and end vertexes of the edges of all the rings
+    (each ring is closed implicitly).
+    """
+    x0, y0, x1, y1 = [], [], [], []
+
+    for rx, ry in rings:
+        rx = np.asarray(rx, dtype=float)
+        ry = np.asarray(ry, dtype=float)
+        x0.append(rx)
+        y0.append(ry)
+        x1.append(np.roll(rx, -1))
+        y1.append(np.roll(ry, -1))
+
+    if not x0:
+        return [np.array([])]*4
+
+    return [np.concatenate(v) for v in (x0, y0, x1, y1)]
+
+def _crossings(x, y, x0, y0, x1, y1, block):
+    """
+    Internal: parity of the crossings of rightward rays from
+    the points with the edges, computed by blocks of points.
+    """
+    result = np.zeros(len(x), dtype=bool)
+
+    # Horizontal edges are never crossed
+    dy = np.where(y0 == y1, 1., y1 - y0)
+    slope = (x1 - x0)/dy
+    ymin = np.minimum(y0, y1)
+    ymax = np.maximum(y0, y1)
+
+    step = max(1, block // max(len(x0), 1))
+
+    for i0 in range(0, len(x), step):
+        px = x[i0:i0+step, None]
+        py = y[i0:i0+step, None]
+
+        cross = (ymin < py) & (py <= ymax)
+        cross &= px <= x0 + (py - y0)*slope
+
+        result[i0:i0+step] = np.count_nonzero(cross, axis=1) % 2 == 1
+
+    return result
+
 def polygon_area(x, y):
     """
     Calculates the area of an arbitrary polygon given its verticies.
@@ -509,6 +878,37 @@ def wgs_to_xyz_sphere(lat, lon, ele):
 
     return np.round(x, NDIGITS), np.round(y, NDIGITS), np.round(z, NDIGITS)
 
+def _wgs_to_xyz_array(lat, lon):
+    """
+    Internal: earth-centred coordinates of points at the surface of the
+    spherical earth as a (n, 3) array. Missing values become NaN.
+    """
+    lat = np.array(lat, ndmin=1, dtype=float)
+    lon = np.array(lon, ndmin=1, dtype=float)
+
+    x, y, z = wgs_to_xyz_sphere(lat, lon, 0.)
+
+    return np.column_stack((x, y, z))
+
+def _arc_to_chord(distance):
+    """
+    Internal: convert great-circle distance to chord length (meters).
+    """
+    angle = np.minimum(np.asarray(distance) / MEAN_EARTH_RADIUS, np.pi)
+
+    return 2. * MEAN_EARTH_RADIUS * np.sin(angle / 2.)
+
+def _chord_to_arc(chord):
+    """
+    Internal: convert chord length to great-circle distance (meters).
+    Infinite chords are preserved.
+    """
+    chord = np.asarray(chord, dtype=float)
+    ratio = np.minimum(chord / (2. * MEAN_EARTH_RADIUS), 1.)
+    arc = 2. * MEAN_EARTH_RADIUS * np.arcsin(ratio)
+
+    return np.where(np.isinf(chord), np.inf, arc)
+
 def wgs_to_xyz_ellipsoid(lat, lon, ele):
     """
     Convert WGS84 coordinates to cartesian using
@@ -617,6 +1017,112 @@ def circle_distance(lat1, lon1, lat2, lon2):
     
     return np.round(distance, NDIGITS)
 
+def circle_distance_matrix(lat1, lon1, lat2, lon2, dtype=np.float64,
+                           block=DISTANCE_BLOCK, out=None):
+    """
+    Great-circle distances (meters) between all the pairs of two
+    sets of points (e.g. sources and sites), using the Haversine
+    formula on a spherical earth. Unlike circle_distance, results
+    are not rounded.
+
+    The matrix is computed by blocks of rows, so that temporary
+    arrays never exceed the given number of elements.
+
+    Args:
+        lat1, lon1 (array):
+            Coordinates of the first set (rows) in decimal degrees.
+
+        lat2, lon2 (array):
+            Coordinates of the second set (columns) in decimal degrees.
+
+        dtype (numpy dtype = float64):
+            Type of the computation and of the output (e.g. float32
+            to halve memory for large meshes).
+
+        block (int):
+            Maximum number of elements computed at once.
+
+        out (array):
+            Optional output array (e.g. a memory map) of shape
+            (n1, n2).
+
+    Returns:
+        Distance matrix with shape (n1, n2).
+    """
+    rlat1, rlon1 = _radians_array(lat1, lon1, dtype)
+    rlat2, rlon2 = _radians_array(lat2, lon2, dtype)
+
+    cos1 = np.cos(rlat1)
+    cos2 = np.cos(rlat2)
+
+    if out is None:
+        out = np.empty((len(rlat1), len(rlat2)), dtype=dtype)
+
+    step = max(1, block // max(len(rlat2), 1))
+
+    for i0 in range(0, len(rlat1), step):
+        i1 = min(i0 + step, len(rlat1))
+
+        dlat = np.sin((rlat2[None, :] - rlat1[i0:i1, None])/2)**2
+        dlon = np.sin((rlon2[None, :] - rlon1[i0:i1, None])/2)**2
+        a = dlat + dlon*cos1[i0:i1, None]*cos2[None, :]
+
+        np.clip(a, 0, 1, out=a)
+        out[i0:i1] = (2*MEAN_EARTH_RADIUS)*np.arcsin(np.sqrt(a))
+
+    return out
+
+def tunnel_distance_matrix(lat1, lon1, ele1, lat2, lon2, ele2,
+                           dtype=np.float64, block=DISTANCE_BLOCK,
+                           out=None):
+    """
+    Linear distances (meters) between all the pairs of two sets
+    of points with elevation (negative for depth), on a spherical
+    earth. Arguments are as for circle_distance_matrix; elevations
+    can be scalars or arrays.
+
+    Returns:
+        Distance matrix with shape (n1, n2).
+    """
+    rlat1, rlon1 = _radians_array(lat1, lon1, dtype)
+    rlat2, rlon2 = _radians_array(lat2, lon2, dtype)
+
+    rho1 = MEAN_EARTH_RADIUS + np.broadcast_to(
+        np.asarray(ele1, dtype=dtype), rlat1.shape)
+    rho2 = MEAN_EARTH_RADIUS + np.broadcast_to(
+        np.asarray(ele2, dtype=dtype), rlat2.shape)
+
+    cos1 = np.cos(rlat1)
+    cos2 = np.cos(rlat2)
+
+    if out is None:
+        out = np.empty((len(rlat1), len(rlat2)), dtype=dtype)
+
+    step = max(1, block // max(len(rlat2), 1))
+
+    for i0 in range(0, len(rlat1), step):
+        i1 = min(i0 + step, len(rlat1))
+
+        # Law of cosines in Haversine form (stable at short distances)
+        dlat = np.sin((rlat2[None, :] - rlat1[i0:i1, None])/2)**2
+        dlon = np.sin((rlon2[None, :] - rlon1[i0:i1, None])/2)**2
+        a = dlat + dlon*cos1[i0:i1, None]*cos2[None, :]
+
+        drho = rho2[None, :] - rho1[i0:i1, None]
+        out[i0:i1] = np.sqrt(drho**2
+                             + 4*rho1[i0:i1, None]*rho2[None, :]*a)
+
+    return out
+
+def _radians_array(lat, lon, dtype=np.float64):
+    """
+    Internal: coordinates in radians as 1-d arrays of given type.
+    """
+    lat = np.radians(np.array(lat, ndmin=1, dtype=dtype))
+    lon = np.radians(np.array(lon, ndmin=1, dtype=dtype))
+
+    return lat.ravel(), lon.ravel()
+
 def wgs_to_azimuth(lat1, lon1, lat2, lon2):
     """
     Compute the azimuth (to north) of a segment by
@@ -652,6 +1158,18 @@ def spherical_mesh(delta, meters=False,
     Modified from Chris Drost.
     """
 
+    return _collect(iter_spherical_mesh(delta, meters, latlim, lonlim))
+
+def iter_spherical_mesh(delta, meters=False, latlim=(-90, 90),
+                        lonlim=(-180, 180), chunk_size=MESH_CHUNK):
+    """
+    Generate the spherical mesh (see spherical_mesh) in chunks of
+    latitude and longitude arrays.
+
+    Latitude is monotonic along the spiral, so only the range of
+    indices within the latitude bounds is generated.
+    """
+
     if meters:
         # Distance is in meters
         num_pts = np.rint(4 * np.pi * MEAN_EARTH_RADIUS**2 / delta**2)
@@ -659,21 +1177,28 @@ def spherical_mesh(delta, meters=False,
         # Distance is in degrees
         num_pts = np.rint(4 * np.pi / np.radians(delta)**2)
 
-    indices = np.arange(0, num_pts, dtype=float) + 0.5
+    # Index range from the inverse of the latitude function
+    # (one index of margin, bounds are then applied exactly)
+    t = (1 - np.cos(np.radians(np.asarray(latlim, dtype=float) + 90.)))/2
+    i0 = max(int(np.floor(t[0] * num_pts - 0.5)) - 1, 0)
+    i1 = min(int(np.ceil(t[1] * num_pts - 0.5)) + 2, int(num_pts))
 
-    phi = np.arccos(1 - 2 * (indices / num_pts))
-    theta = np.pi * (1 + 5**0.5) * indices
+    for c0 in range(i0, i1, chunk_size):
+        c1 = min(c0 + chunk_size, i1)
 
-    # Conversion to wgs84
-    lat = np.degrees(phi) - 90.
-    lon = np.degrees(unwrap(theta))
+        indices = np.arange(c0, c1, dtype=float) + 0.5
 
-    i = (lat >= latlim[0]) & (lat <= latlim[1])
-    j = (lon >= lonlim[0]) & (lon <= lonlim[1])
-    lat = lat[i & j]
-    lon = lon[i & j]
+        phi = np.arccos(1 - 2 * (indices / num_pts))
+        theta = np.pi * (1 + 5**0.5) * indices
 
-    return np.round(lat, NDIGITS), np.round(lon, NDIGITS)
+        # Conversion to wgs84
+        lat = np.degrees(phi) - 90.
+        lon = np.degrees(unwrap(theta))
+
+        i = (lat >= latlim[0]) & (lat <= latlim[1])
+        j = (lon >= lonlim[0]) & (lon <= lonlim[1])
+
+        yield np.round(lat[i & j], NDIGITS), np.round(lon[i & j], NDIGITS)
 
 def unwrap(angle):
     """
@@ -692,6 +1217,19 @@ def cartesian_mesh(delta, meters=False,
     Delta is in degrees if not speficied otherwise.
     """
 
+    return _collect(iter_cartesian_mesh(delta, meters, latlim, lonlim))
+
+def iter_cartesian_mesh(delta, meters=False, latlim=(-90, 90),
+                        lonlim=(-180, 180), chunk_size=MESH_CHUNK):
+    """
+    Generate the cartesian mesh (see cartesian_mesh) in chunks of
+    latitude and longitude arrays, each with whole grid rows and
+    (if possible) no more than chunk_size points.
+
+    Row lengths are computed up front from the grid bounds, so that
+    points are generated directly into arrays of the final size.
+    """
+
     if not meters:
         delta *= DEG_TO_M
 
@@ -703,22 +1241,57 @@ def cartesian_mesh(delta, meters=False,
     xmax = xlen - (xlen % delta)
     ymax = ylen - (ylen % delta)
 
-    xrng = np.arange(-xmax, xmax, delta)
+    xnum = len(np.arange(-xmax, xmax, delta))
     yrng = np.arange(-ymax, ymax, delta)
 
     ylim = np.radians(latlim) * r
     ysel = yrng[(yrng >= ylim[0]) & (yrng <= ylim[1])]
 
-    lat = np.array([])
-    lon = np.array([])
+    # First grid index and number of points of each row
+    xlim0 = np.radians(lonlim[0]) * r * np.cos(ysel / r)
+    xlim1 = np.radians(lonlim[1]) * r * np.cos(ysel / r)
 
-    for ys in ysel:
-        xlim = np.radians(lonlim) * r * np.cos(ys / r)
-        xsel = xrng[(xrng >= xlim[0]) & (xrng <= xlim[1])]
+    k0 = np.clip(np.ceil((xlim0 + xmax) / delta), 0, xnum).astype(int)
+    k1 = np.clip(np.floor((xlim1 + xmax) / delta) + 1, 0, xnum).astype(int)
 
-        lat0, lon0 = xy_to_wgs_sinproj(xsel, ys*np.ones(len(xsel)))
+    # Correct round-off at the row bounds
+    k0 += (-xmax + k0 * delta) < xlim0
+    k0 -= (k0 > 0) & ((-xmax + (k0 - 1) * delta) >= xlim0)
+    k1 -= (k1 > 0) & ((-xmax + (k1 - 1) * delta) > xlim1)
+    k1 += (k1 < xnum) & ((-xmax + k1 * delta) <= xlim1)
 
-        lat = np.append(lat, lat0)
-        lon = np.append(lon, lon0)
+    count = np.maximum(k1 - k0, 0)
+    offset = np.concatenate(([0], np.cumsum(count)))
 
-    return np.round(lat, NDIGITS), np.round(lon, NDIGITS)
+    row = 0
+    while row < len(ysel):
+        # Whole rows up to the chunk size
+        last = np.searchsorted(offset, offset[row] + chunk_size, 'right') - 1
+        last = max(last, row + 1)
+
+        cnt = count[row:last]
+        size = offset[last] - offset[row]
+
+        k = np.arange(size) - np.repeat(offset[row:last] - offset[row], cnt)
+        k += np.repeat(k0[row:last], cnt)
+
+        x = -xmax + k * delta
+        y = np.repeat(ysel[row:last], cnt)
+
+        lat, lon = xy_to_wgs_sinproj(x, y)
+        yield np.round(lat, NDIGITS), np.round(lon, NDIGITS)
+
+        row = last
+
+def _collect(chunks):
+    """
+    Internal: concatenate the (latitude, longitude) chunks
+    of a mesh generator.
+    """
+    lat, lon = [np.array([])], [np.array([])]
+
+    for la, lo in chunks:
+        lat.append(la)
+        lon.append(lo)
+
+    return np.concatenate(lat), np.concatenate(lon)
@@ -20,6 +20,9 @@
 """
 """
 
+from collections import deque as _deque
+from concurrent.futures import ProcessPoolExecutor as _ProcessPoolExecutor
+
 import numpy as _np
 
 
@@ -148,3 +151,37 @@ def none_check(number):
     number = None if is_empty(number) else number
 
     return number
+
+
+def run_jobs(function, jobs, workers=None):
+    """
+    Run a function over a sequence of argument tuples, serially
+    or in a process pool. The number of pending jobs is bounded
+    (twice the workers), so that jobs can be generated lazily and
+    results are consumed as they come; results are yielded in the
+    order of the jobs.
+
+    :param function function:
+        a picklable (module level) function
+
+    :param iterable jobs:
+        argument tuples of the function calls
+
+    :param int workers:
+        number of processes (serial if None or lower than 2)
+    """
+    if workers is None or workers < 2:
+        for job in jobs:
+            yield function(*job)
+        return
+
+    with _ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = _deque()
+
+        for job in jobs:
+            pending.append(pool.submit(function, *job))
+            if len(pending) >= 2*workers:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
@@ -26,8 +26,10 @@ import pickle
 from copy import deepcopy
 
 from shakelab.libutils.time import Date
-from shakelab.libutils.geodetic import WgsPoint
+from shakelab.libutils.geodetic import (WgsPoint, WgsIndex,
+                                        circle_distance, wgs_to_xyz_sphere)
 from shakelab.libutils.ascii import AsciiTable
+from shakelab.libutils.columnar import ColumnStore, is_store
 from shakelab.libutils.utils import cast_value
 
 
@@ -312,6 +314,7 @@ class EqDatabase(object):
                        'Version': version,
                        'Info': info}
         self.event = []
+        self._sindex = None
 
     def __iter__(self):
         self._counter = 0
@@ -372,15 +375,23 @@ class EqDatabase(object):
                 self.event[idx].add_magnitude(ms)
             for ls in event.location:
                 self.event[idx].add_location(ls)
+
+            # Prime location might have changed
+            self._sindex = None
         else:
             self.event.append(event)
 
+            if self._sindex is not None:
+                self._sindex.add(*_prime_coordinates(event))
+
     def remove(self, id):
         """
         """
         idx = self._get_index(id)
         if idx is not None:
             del self.event[idx]
+            if self._sindex is not None:
+                self._sindex.remove(idx)
         else:
             raise ValueError('id not found')
 
@@ -399,6 +410,7 @@ class EqDatabase(object):
         idx = self._get_index(id)
         if idx is not None:
             self.event[idx].add_location(location, prime=prime)
+            self._sindex = None
         else:
             raise ValueError('id not found')
 
@@ -495,6 +507,8 @@ class EqDatabase(object):
             for ide in ide_list:
                 del self.event[ide]
 
+        self._sindex = None
+
     def extract(self, key, remove_empty=True, any=False):
         """
         """
@@ -546,23 +560,230 @@ class EqDatabase(object):
             events.append(self.event[i])
 
         self.event = events
+        self._sindex = None
+
+    @property
+    def spatial_index(self):
+        """
+        Spatial index of the prime (epicentral) locations.
+        The index is built on first use and then kept in sync with
+        the database when events are added or removed.
+        """
+        if self._sindex is None or len(self._sindex) != len(self.event):
+            lat = self.extract('Latitude', remove_empty=False)
+            lon = self.extract('Longitude', remove_empty=False)
+            self._sindex = WgsIndex(lat, lon)
+
+        return self._sindex
+
+    def query_radius(self, latitude, longitude, radius):
+        """
+        Return the indexes of the events whose prime epicentre is
+        within a given great-circle distance (in meters) from a
+        geographical location.
+        """
+        return self.spatial_index.query_radius(latitude, longitude, radius)
+
+    def query_nearest(self, latitude, longitude, k=1):
+        """
+        Return distances (in meters) and indexes of the k events
+        closest to a geographical location.
+        """
+        dst, idx = self.spatial_index.query_nearest(latitude, longitude, k)
+        return dst[0], idx[0]
+
+    def query_polygon(self, polygon):
+        """
+        Return the indexes of the events whose prime epicentre is
+        inside a polygon (WgsPolygon).
+        Candidates are preselected using the spherical cap enclosing
+        the polygon vertices.
+        """
+        poly_lat, poly_lon = polygon.to_array()
+
+        # Centre and radius of the enclosing cap
+        x, y, z = wgs_to_xyz_sphere(poly_lat, poly_lon, 0.)
+        clat = np.degrees(np.arctan2(np.sum(z), np.hypot(np.sum(x),
+                                                         np.sum(y))))
+        clon = np.degrees(np.arctan2(np.sum(y), np.sum(x)))
+        radius = np.max(circle_distance(clat, clon, poly_lat, poly_lon))
+
+        idx = self.query_radius(clat, clon, radius)
+
+        lat = self.extract('Latitude', remove_empty=False)
+        lon = self.extract('Longitude', remove_empty=False)
+
+        lat = np.array([lat[i] for i in idx], dtype=float)
+        lon = np.array([lon[i] for i in idx], dtype=float)
+
+        return np.asarray(idx, dtype=int)[polygon.contains_array(lat, lon)]
+
+    def select(self, idx):
+        """
+        Return a new database with the events at the given indexes.
+        Events are not copied.
+        """
+        edb = EqDatabase()
+        edb.header = dict(self.header)
+        edb.event = [self.event[i] for i in idx]
+        return edb
 
     def load(self, file_name):
         """
-        Load the database from pickle file
+        Load the database from file. Both columnar stores (see dump)
+        and pickle files are supported.
         """
+        if is_store(file_name):
+            store = ColumnStore(file_name, 'r')
+            self.header = dict(store.attributes.get('Header', self.header))
+            self.event = _events_from_columns(store.read('event'),
+                                              store.read('location'),
+                                              store.read('magnitude'))
+            self._sindex = None
+            return
+
         with open(file_name, 'rb') as f:
             buf = pickle.load(f)
             self.header = buf.header
             self.event = buf.event
+            self._sindex = None
             f.close()
             return
 
-    def dump(self, file_name):
+    def dump(self, file_name, format='pickle', append=False):
         """
-        Save the database to a pickle file
+        Save the database to file.
+
+        :param string file_name:
+            output file name (a directory for the columnar format)
+
+        :param string format:
+            'pickle' (default) serialises the whole object; 'columnar'
+            stores event, location and magnitude tables as raw binary
+            columns that can be memory-mapped (see read_columns)
+
+        :param bool append:
+            for the columnar format, add the events to an existing
+            store without rewriting it
         """
-        with open(file_name, 'wb') as f:
-            pickle.dump(self, f, protocol=2)
-            f.close()
+        if append and format != 'columnar':
+            raise ValueError('append is only supported by columnar format')
+
+        if format == 'columnar':
+            store = ColumnStore(file_name, 'a' if append else 'w')
+            offset = store.size('event') if 'event' in store else 0
+
+            tables = _events_to_columns(self.event, offset)
+            for name in ['event', 'location', 'magnitude']:
+                store.append(name, tables[name])
+
+            if not append or 'Header' not in store.attributes:
+                store.set_attributes({'Header': self.header})
             return
+
+        elif format == 'pickle':
+            with open(file_name, 'wb') as f:
+                pickle.dump(self, f, protocol=2)
+                f.close()
+                return
+
+        else:
+            raise ValueError('format not recognized')
+
+
+def read_columns(file_name, table='location', columns=None, mmap=True):
+    """
+    Read selected columns of a columnar catalogue as memory-mapped
+    arrays, without building event objects.
+
+    :param string file_name:
+        columnar catalogue (see EqDatabase.dump)
+
+    :param string table:
+        'event', 'location' or 'magnitude'; solution tables have
+        an 'Event' column with the index of the parent event
+
+    :param list columns:
+        column names (e.g. ['Event', 'Latitude', 'Longitude']);
+        all if not given
+
+    :return dict data:
+        dictionary of arrays; missing values are NaN for floats,
+        INT_NULL for integers and empty strings
+    """
+    return ColumnStore(file_name, 'r').read(table, columns, mmap)
+
+
+# Missing value code for integer columns
+INT_NULL = np.iinfo(np.int32).min
+
+_NULL = {float: np.nan, int: INT_NULL, str: '', bool: False}
+_DTYPE = {float: np.float64, int: np.int32, str: str, bool: np.bool_}
+
+
+def _events_to_columns(events, offset=0):
+    """
+    Internal: convert a list of events into event, location and
+    magnitude tables (dictionaries of arrays).
+    """
+    tables = {'event': {'Id': [e.id for e in events]}}
+
+    for name, keymap in [('location', _LOCMAP), ('magnitude', _MAGMAP)]:
+
+        index = []
+        values = {key: [] for key in keymap}
+
+        for i, event in enumerate(events):
+            for sol in event[name.capitalize()]:
+                index.append(offset + i)
+                for key, (attr, dtype, _) in keymap.items():
+                    value = getattr(sol, attr)
+                    values[key].append(_NULL[dtype] if value is None
+                                       else value)
+
+        table = {'Event': np.array(index, dtype=np.int64)}
+        for key, (attr, dtype, _) in keymap.items():
+            table[key] = np.array(values[key], dtype=_DTYPE[dtype])
+        tables[name] = table
+
+    return tables
+
+
+def _events_from_columns(event, location, magnitude):
+    """
+    Internal: build the list of events from columnar tables.
+    Solutions are created directly from stored (already cast) values.
+    """
+    events = [Event(id) for id in event['Id'].tolist()]
+
+    for table, keymap, cls, name in [(location, _LOCMAP,
+                                      LocationSolution, 'location'),
+                                     (magnitude, _MAGMAP,
+                                      MagnitudeSolution, 'magnitude')]:
+
+        keys = [k for k in keymap if k in table]
+        attrs = [keymap[k][0] for k in keys]
+        nulls = [None if keymap[k][1] is bool else _NULL[keymap[k][1]]
+                 for k in keys]
+        columns = [table[k].tolist() for k in keys]
+
+        for i, row in zip(table['Event'].tolist(), zip(*columns)):
+            sol = cls.__new__(cls)
+            for attr, null, value in zip(attrs, nulls, row):
+                if value == null or value != value:
+                    value = None
+                setattr(sol, attr, value)
+            getattr(events[i], name).solution.append(sol)
+
+    return events
+
+
+def _prime_coordinates(event):
+    """
+    Internal: epicentral coordinates of the prime location solution
+    (None if not available).
+    """
+    if event.location.prime:
+        return event.location.prime.latitude, event.location.prime.longitude
+    else:
+        return None, None
@@ -0,0 +1,392 @@
+# ****************************************************************************
+#
+# Copyright (C) 2019-2020, ShakeLab Developers.
+# This file is part of ShakeLab.
+#
+# ShakeLab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ShakeLab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+#
+# ****************************************************************************
+"""
+Catalogue declustering algorithms.
+
+Algorithms work on plain arrays (time in seconds, coordinates in
+degrees, magnitude), sorted in time internally. Space-time windows
+are searched on the sorted time axis, so that only events within the
+time window are tested for distance. Results are returned as arrays
+of cluster labels (0 for independent events) and mainshock flags.
+"""
+
+import numpy as np
+
+from shakelab.libutils.time import date_to_sec
+from shakelab.libutils.geodetic import (WgsIndex, _wgs_to_xyz_array,
+                                        _arc_to_chord)
+
+DAY_SEC = 86400.
+
+# Number of events in the time window above which
+# the spatial index is used for the distance search
+INDEX_THRESHOLD = 20000
+
+
+def gardner_knopoff_window(magnitude):
+    """
+    Gardner and Knopoff (1974) space-time windows.
+
+    :return numpy.array distance:
+        window distance in km
+
+    :return numpy.array time:
+        window time in days
+    """
+    magnitude = np.asarray(magnitude, dtype=float)
+
+    distance = 10.**(0.1238*magnitude + 0.983)
+    time = np.where(magnitude >= 6.5,
+                    10.**(0.032*magnitude + 2.7389),
+                    10.**(0.5409*magnitude - 0.547))
+
+    return distance, time
+
+
+def gruenthal_window(magnitude):
+    """
+    Gruenthal (in van Stiphout et al., 2012) space-time windows.
+    """
+    magnitude = np.asarray(magnitude, dtype=float)
+
+    distance = np.exp(1.77 + np.sqrt(0.037 + 1.02*magnitude))
+    time = np.where(magnitude >= 6.5,
+                    10.**(2.8 + 0.024*magnitude),
+                    np.abs(np.exp(-3.95 + np.sqrt(0.62 + 17.32*magnitude))))
+
+    return distance, time
+
+
+def uhrhammer_window(magnitude):
+    """
+    Uhrhammer (1986) space-time windows.
+    """
+    magnitude = np.asarray(magnitude, dtype=float)
+
+    distance = np.exp(-1.024 + 0.804*magnitude)
+    time = np.exp(-2.87 + 1.235*magnitude)
+
+    return distance, time
+
+
+WINDOWS = {'GardnerKnopoff': gardner_knopoff_window,
+           'Gruenthal': gruenthal_window,
+           'Uhrhammer': uhrhammer_window}
+
+
+def gardner_knopoff(time, latitude, longitude, magnitude,
+                    window='GardnerKnopoff', foreshock_ratio=0.):
+    """
+    Window-based declustering (Gardner and Knopoff, 1974).
+
+    Events are processed in order of decreasing magnitude; all the
+    unassigned events within the space-time window of an event
+    are assigned to its cluster.
+
+    :param numpy.array time:
+        origin times in seconds
+
+    :param numpy.array latitude:
+        epicentral latitudes in degrees
+
+    :param numpy.array longitude:
+        epicentral longitudes in degrees
+
+    :param numpy.array magnitude:
+        event magnitudes
+
+    :param string window:
+        window definition (GardnerKnopoff, Gruenthal or Uhrhammer)
+
+    :param float foreshock_ratio:
+        fraction of the time window used to search for foreshocks
+
+    :return numpy.array cluster:
+        cluster labels (1 to n); independent events are 0
+
+    :return numpy.array mainshock:
+        boolean flags of independent events and cluster mainshocks
+    """
+    (time, xyz, magnitude, order, valid) = _prepare(time, latitude,
+                                                    longitude, magnitude)
+    latitude = np.asarray(latitude, dtype=float)[order]
+    longitude = np.asarray(longitude, dtype=float)[order]
+
+    wdist, wtime = WINDOWS[window](magnitude)
+    chord2 = _arc_to_chord(wdist*1e3)**2
+    wtime = wtime*DAY_SEC
+
+    label = np.zeros(len(time), dtype=np.int64)
+    index = None
+
+    # Decreasing magnitude (stable with respect to time)
+    for i in np.argsort(-magnitude, kind='stable'):
+
+        if label[i] or not valid[i]:
+            continue
+
+        label[i] = i + 1
+
+        t0 = np.searchsorted(time, time[i] - foreshock_ratio*wtime[i], 'left')
+        t1 = np.searchsorted(time, time[i] + wtime[i], 'right')
+
+        if (t1 - t0) > INDEX_THRESHOLD:
+            if index is None:
+                index = WgsIndex(latitude, longitude)
+            idx = index.query_radius(latitude[i], longitude[i],
+                                     wdist[i]*1e3)
+            idx = idx[(idx >= t0) & (idx < t1)]
+        else:
+            idx = np.arange(t0, t1)
+            dxyz = xyz[t0:t1] - xyz[i]
+            idx = idx[np.einsum('ij,ij->i', dxyz, dxyz) <= chord2[i]]
+
+        idx = idx[(label[idx] == 0) & valid[idx]]
+        label[idx] = i + 1
+
+    return _finalise(label, magnitude, order)
+
+
+def reasenberg(time, latitude, longitude, magnitude, rfact=10.,
+               tau_min=1., tau_max=10., p1=0.99, xk=0.5, xmeff=1.5):
+    """
+    Cluster-linking declustering (Reasenberg, 1985).
+
+    Events are linked if they are within the interaction distance
+    (a multiple of the source dimension) and the look-ahead time,
+    which grows with the time elapsed since the largest event of
+    the cluster (Omori decay). Location errors are not considered.
+
+    :param numpy.array time:
+        origin times in seconds
+
+    :param numpy.array latitude:
+        epicentral latitudes in degrees
+
+    :param numpy.array longitude:
+        epicentral longitudes in degrees
+
+    :param numpy.array magnitude:
+        event magnitudes
+
+    :param float rfact:
+        number of crack radii defining the interaction zone
+
+    :param float tau_min:
+        look-ahead time for unclustered events in days
+
+    :param float tau_max:
+        maximum look-ahead time for clustered events in days
+
+    :param float p1:
+        confidence of observing the next event in the sequence
+
+    :param float xk:
+        increase of the lower cut-off magnitude during clusters
+
+    :param float xmeff:
+        effective lower magnitude cut-off of the catalogue
+
+    :return numpy.array cluster:
+        cluster labels (1 to n); independent events are 0
+
+    :return numpy.array mainshock:
+        boolean flags of independent events and cluster mainshocks
+    """
+    (time, xyz, magnitude, order, valid) = _prepare(time, latitude,
+                                                    longitude, magnitude)
+
+    # Interaction radius (Kanamori and Anderson, 1975) in meters
+    radius = rfact * 0.011 * 10.**(0.4*magnitude) * 1e3
+    tau_min = tau_min * DAY_SEC
+    tau_max = tau_max * DAY_SEC
+    tau_fact = -np.log(1. - p1)
+
+    label = np.zeros(len(time), dtype=np.int64)
+    members = {}
+    biggest = {}
+
+    for i in range(len(time)):
+
+        if not valid[i]:
+            continue
+
+        c = label[i]
+
+        if c:
+            # Look-ahead time from the largest event of the cluster
+            b = biggest[c]
+            deltam = (1. - xk)*magnitude[b] - xmeff
+            denom = 10.**((deltam - 1.)*2./3.)
+            tau = tau_fact * (time[i] - time[b]) / denom
+            tau = min(max(tau, tau_min), tau_max)
+            rmax = max(radius[i], radius[b])
+        else:
+            tau = tau_min
+            rmax = radius[i]
+
+        t1 = np.searchsorted(time, time[i] + tau, 'right')
+        if t1 <= i + 1:
+            continue
+
+        dxyz = xyz[i+1:t1] - xyz[i]
+        near = np.einsum('ij,ij->i', dxyz, dxyz) <= _arc_to_chord(rmax)**2
+        idx = np.arange(i + 1, t1)[near & valid[i+1:t1]]
+
+        if not len(idx):
+            continue
+
+        # Open a new cluster if needed
+        if not c:
+            c = i + 1
+            label[i] = c
+            members[c] = [i]
+            biggest[c] = i
+
+        for j in idx:
+            cj = label[j]
+
+            if cj == c:
+                continue
+
+            elif not cj:
+                label[j] = c
+                members[c].append(j)
+                if magnitude[j] > magnitude[biggest[c]]:
+                    biggest[c] = j
+
+            else:
+                # Merge the smaller cluster into the larger
+                if len(members[cj]) > len(members[c]):
+                    c, cj = cj, c
+                label[members[cj]] = c
+                members[c] += members.pop(cj)
+                bj = biggest.pop(cj)
+                if magnitude[bj] > magnitude[biggest[c]]:
+                    biggest[c] = bj
+
+    return _finalise(label, magnitude, order)
+
+
+def decluster(edb, method='GardnerKnopoff', **kwargs):
+    """
+    Decluster an earthquake database using prime solutions.
+
+    :param EqDatabase edb:
+        the earthquake database
+
+    :param string method:
+        GardnerKnopoff or Reasenberg; other keyword arguments
+        are passed to the declustering function
+
+    :return numpy.array cluster:
+        cluster labels (0 for independent events)
+
+    :return numpy.array mainshock:
+        boolean flags of independent events and cluster mainshocks
+    """
+    data = catalogue_arrays(edb)
+    args = (data['Time'], data['Latitude'],
+            data['Longitude'], data['Magnitude'])
+
+    if method == 'GardnerKnopoff':
+        return gardner_knopoff(*args, **kwargs)
+    elif method == 'Reasenberg':
+        return reasenberg(*args, **kwargs)
+    else:
+        raise ValueError('method not recognized')
+
+
+def catalogue_arrays(edb):
+    """
+    Extract time (seconds), coordinates and magnitude of the prime
+    solutions of a database as arrays. Missing values are NaN.
+    """
+    size = len(edb.event)
+    data = {k: np.full(size, np.nan)
+            for k in ['Time', 'Latitude', 'Longitude', 'Magnitude']}
+
+    for i, event in enumerate(edb.event):
+        loc = event.location.prime
+        mag = event.magnitude.prime
+
+        if loc is not None:
+            if loc.year is not None:
+                data['Time'][i] = date_to_sec(loc.year, loc.month, loc.day,
+                                              loc.hour, loc.minute,
+                                              loc.second)
+            if loc.latitude is not None and loc.longitude is not None:
+                data['Latitude'][i] = loc.latitude
+                data['Longitude'][i] = loc.longitude
+
+        if mag is not None and mag.size is not None:
+            data['Magnitude'][i] = mag.size
+
+    return data
+
+
+def _prepare(time, latitude, longitude, magnitude):
+    """
+    Internal: sort the input arrays in time.
+    """
+    time = np.asarray(time, dtype=float)
+    magnitude = np.asarray(magnitude, dtype=float)
+    xyz = _wgs_to_xyz_array(latitude, longitude)
+
+    order = np.argsort(time, kind='stable')
+    time = time[order]
+    magnitude = magnitude[order]
+    xyz = xyz[order]
+
+    valid = (np.isfinite(time) & np.isfinite(magnitude)
+             & np.all(np.isfinite(xyz), axis=1))
+
+    return time, xyz, magnitude, order, valid
+
+
+def _finalise(label, magnitude, order):
+    """
+    Internal: remove single-event clusters, renumber labels
+    in time order and map results back to the input order.
+    """
+    size = np.bincount(label)
+    label[size[label] < 2] = 0
+
+    independent = np.any(label == 0)
+    label = np.unique(label, return_inverse=True)[1].reshape(-1)
+    if not independent:
+        label += 1
+
+    # Mainshock is the largest event of each cluster (first if equal)
+    mainshock = label == 0
+    clustered = np.nonzero(label)[0]
+    if len(clustered):
+        idx = np.lexsort((clustered, -magnitude[clustered],
+                          label[clustered]))
+        idx = clustered[idx]
+        start = np.r_[True, np.diff(label[idx]) != 0]
+        mainshock[idx[start]] = True
+
+    cluster = np.empty_like(label)
+    cluster[order] = label
+    flag = np.empty_like(mainshock)
+    flag[order] = mainshock
+
+    return cluster, flag
@@ -23,9 +23,16 @@ Module containing earthquake catalogue parsers for different formats.
 
 import os
 import json
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 import shakelab.seismicity.catalogue as cat
 from shakelab.libutils.ascii import AsciiTable
+from shakelab.libutils.time import Date, date_to_sec
+from shakelab.libutils.utils import cast_value
+
+# Default chunk size (bytes) for parallel parsing
+CHUNK_SIZE = 32 * 1024**2
 
 
 def read(file_name, type=None):
@@ -41,7 +48,7 @@ def read(file_name, type=None):
 
     edb = cat.EqDatabase()
 
-    if type in ['bin', 'pickle']:
+    if type in ['bin', 'pickle', 'col', 'columnar']:
         edb.load(file_name)
 
     elif type in ['json']:
@@ -73,11 +80,14 @@ def write(edb, file_name, type=None):
         else:
             raise ValueError('file extension not found')
 
-    if not isinstance(edb, EqDatabase):
+    if not isinstance(edb, cat.EqDatabase):
         raise ValueError('not a valid database')
 
     elif type in ['bin', 'pickle']:
-        edb.dump(file_name)
+        edb.dump(file_name, format='pickle')
+
+    elif type in ['col', 'columnar']:
+        edb.dump(file_name, format='columnar')
 
     elif type == 'json':
         data = edb.export_to_dict()
@@ -149,12 +159,128 @@ def read_isf(isf_file, name=None, version=None, info=None):
     """
     Importer for ISC bulletin in ISF format
     """
+    # Initialising database
+    edb = cat.EqDatabase(name, version, info)
+
+    for event in iter_isf(isf_file):
+        edb.event.append(event)
+
+    return edb
+
+
+def iter_isf(isf_file, batch_size=None, time_range=None, mag_range=None,
+             bbox=None, workers=None, chunk_size=CHUNK_SIZE):
+    """
+    Streaming reader for ISC bulletins in ISF format.
+
+    Events are parsed one at a time and yielded as soon as they are
+    complete, so that arbitrarily large bulletins can be processed
+    with constant memory. Optional filters are applied to the raw
+    fields of the prime solutions, before any object is built.
+
+    :param string isf_file:
+        input bulletin file
+
+    :param int batch_size:
+        if given, events are yielded in EqDatabase objects of (at most)
+        the given size, otherwise events are yielded one by one
+
+    :param tuple time_range:
+        (start, end) time of the selection; values can be Date
+        objects, ISO-8601 strings or seconds (None for open bounds)
+
+    :param tuple mag_range:
+        (minimum, maximum) magnitude of the selection
+
+    :param tuple bbox:
+        ((lat_min, lat_max), (lon_min, lon_max)) geographical bounds,
+        as returned by WgsPolygon.get_bounds
+
+    :param int workers:
+        number of worker processes; if larger than one, the file is
+        split in chunks on event boundaries, which are parsed in
+        parallel (event order is preserved)
+
+    :param int chunk_size:
+        approximate size in bytes of the chunks for parallel parsing
+    """
+    with open(isf_file, 'r') as fid:
+        data_type = fid.readline().strip()
+        if data_type != 'DATA_TYPE EVENT IMS1.0':
+            raise ValueError('wring data type format')
+
+    limits = _filter_limits(time_range, mag_range, bbox)
+
+    if workers is not None and workers > 1:
+        events = _parallel_chunks(_read_isf_chunk, isf_file, limits,
+                                  workers, chunk_size)
+    else:
+        events = _iter_isf_chunk(isf_file, 0, None, limits)
+
+    return _batch(events, batch_size)
+
+
+def iter_csv(csv_file, header=None, delimiter=',', skipline=0, comment='#',
+             batch_size=None, time_range=None, mag_range=None, bbox=None):
+    """
+    Streaming reader for catalogues in CSV format.
+    Arbitrary header is allowed (see read_csv). Filter and batch
+    options are the same of iter_isf.
+    """
+    limits = _filter_limits(time_range, mag_range, bbox)
+
+    def events():
+
+        with open(csv_file, 'r') as f:
+
+            # Ignore initial line(s) if necessary
+            for i in range(0, skipline):
+                f.readline()
 
-    def create_event(line):
-        
-        id = line[6:14].strip()
-        region = line[15:80]
-        return cat.Event(id)
+            # Import header (skip comments)
+            keys = header
+            if keys is None:
+                while 1:
+                    line = f.readline()
+                    if line[0] != comment:
+                        break
+                keys = line.strip().split(delimiter)
+
+            counter = 0
+            for line in f:
+
+                # Skip comments, if any
+                if line[0] == comment:
+                    continue
+
+                value = line.strip().split(delimiter)
+                data = {k: cast_value(v, str) for k, v in zip(keys, value)
+                        if k not in ['', None]}
+
+                if 'Id' not in data:
+                    data['Id'] = counter
+                counter += 1
+
+                if not _check_limits(limits, data, data.get('MagSize')):
+                    continue
+
+                event = cat.Event(data['Id'])
+
+                loc_dict = {k: v for k, v in data.items() if k in cat._LOCMAP}
+                event.location.add(loc_dict)
+
+                mag_dict = {k: v for k, v in data.items() if k in cat._MAGMAP}
+                event.magnitude.add(mag_dict)
+
+                yield event
+
+    return _batch(events(), batch_size)
+
+
+def _create_isf_event(block):
+    """
+    Build an event from the (already selected) lines of an ISF block.
+    """
 
     def create_location_solution(line):
 
@@ -184,53 +310,255 @@ def read_isf(isf_file, name=None, version=None, info=None):
         mag['MagPrime'] = False
         return mag
 
-    # Initialising database
-    edb = cat.EqDatabase(name, version, info)
+    (id, loc_lines, loc_prime, mag_lines) = block
 
-    with open(isf_file, 'r') as fid:
+    event = cat.Event(id)
 
-        # Bulletin header
-        data_type = fid.readline().strip()
-        if data_type != 'DATA_TYPE EVENT IMS1.0':
-            raise ValueError('wring data type format')
+    for line in loc_lines:
+        event.location.add(create_location_solution(line))
+    for idx in loc_prime:
+        event.location[idx].prime = True
 
-        bulletin = fid.readline().strip()
+    for line in mag_lines:
+        event.magnitude.add(create_magnitude_solution(line))
 
-        # Loop over events
-        while True:
+    return event
 
-            line = fid.readline()
 
-            if 'Event' in line:
-                event = create_event(line)
-                edb.event.append(event)
-
-            elif 'Date' in line:
-                # Loop over location solutions
-                while True:
-                    line2 = fid.readline()
-                    if line2.strip():
-                        if 'PRIME' in line2:
-                            edb[-1].location[-1].prime = True
-                        elif 'CENTROID' in line2:
-                            pass
-                        else:
-                            loc = create_location_solution(line2)
-                            edb[-1].location.add(loc)
-                    else:
-                        break
+def _split_isf_block(lines):
+    """
+    Split the lines of an ISF event block into id, location lines,
+    prime flags and magnitude lines, without building any object.
+    """
+    id = lines[0][6:14].strip()
+    loc_lines = []
+    loc_prime = []
+    mag_lines = []
+
+    section = None
+    for line in lines[1:]:
 
+        if section is None:
+            if 'Date' in line:
+                section = 'loc'
             elif 'Magnitude' in line:
-                # Loop over magnitude solutions
-                while True:
-                    line2 = fid.readline()
-                    if line2.strip():
-                        mag = create_magnitude_solution(line2)
-                        edb[-1].magnitude.add(mag)
-                    else:
-                        break
+                section = 'mag'
+
+        elif not line.strip():
+            section = None
+
+        elif section == 'loc':
+            if 'PRIME' in line:
+                if loc_lines:
+                    loc_prime.append(len(loc_lines) - 1)
+            elif 'CENTROID' in line:
+                pass
+            else:
+                loc_lines.append(line)
+
+        elif section == 'mag':
+            mag_lines.append(line)
+
+    return (id, loc_lines, loc_prime, mag_lines)
+
+
+def _isf_raw_prime(block):
+    """
+    Raw fields of the prime location and magnitude of an ISF block,
+    used for filtering. The prime magnitude is the last solution.
+    """
+    (id, loc_lines, loc_prime, mag_lines) = block
+
+    loc = None
+    if loc_lines:
+        line = loc_lines[loc_prime[-1] if loc_prime else -1]
+        loc = {'Year': line[0:4], 'Month': line[5:7], 'Day': line[8:10],
+               'Hour': line[10:13], 'Minute': line[14:16],
+               'Second': line[17:22], 'Latitude': line[36:44],
+               'Longitude': line[45:54]}
+        loc = {k: v.strip(' ') for k, v in loc.items()}
+
+    mag = mag_lines[-1][6:10].strip(' ') if mag_lines else None
+
+    return loc, mag
+
+
+def _iter_isf_chunk(isf_file, start=0, end=None, limits=None):
+    """
+    Generator of the events of an ISF file whose header line starts
+    in the byte range [start, end).
+    """
+    def process(lines):
+        block = _split_isf_block(lines)
+        loc, mag = _isf_raw_prime(block)
+        if _check_limits(limits, loc, mag):
+            return _create_isf_event(block)
+        return None
+
+    with open(isf_file, 'rb') as fid:
+
+        # Move to the first complete line of the chunk
+        if start > 0:
+            fid.seek(start - 1)
+            fid.readline()
+
+        lines = None
+        while True:
+            pos = fid.tell()
+            line = fid.readline()
 
             if not line:
                 break
 
-    return edb
+            line = line.decode('utf-8', 'replace').rstrip('\r\n')
+
+            if 'Event' in line:
+                if lines is not None:
+                    event = process(lines)
+                    if event is not None:
+                        yield event
+                    lines = None
+
+                if end is not None and pos >= end:
+                    break
+
+                lines = [line]
+
+            elif lines is not None:
+                lines.append(line)
+
+        if lines is not None:
+            event = process(lines)
+            if event is not None:
+                yield event
+
+
+def _read_isf_chunk(isf_file, start, end, limits):
+    """
+    Worker function for parallel parsing.
+    """
+    return list(_iter_isf_chunk(isf_file, start, end, limits))
+
+
+def _parallel_chunks(worker, file_name, limits, workers, chunk_size):
+    """
+    Split a file in chunks of bytes and parse them in a process pool.
+    The number of pending chunks is bounded to limit memory usage;
+    events are yielded in file order.
+    """
+    size = os.path.getsize(file_name)
+    bounds = [(b, min(b + chunk_size, size))
+              for b in range(0, size, chunk_size)]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+
+        for (start, end) in bounds:
+            pending.append(pool.submit(worker, file_name, start, end, limits))
+
+            if len(pending) >= 2 * workers:
+                for event in pending.popleft().result():
+                    yield event
+
+        while pending:
+            for event in pending.popleft().result():
+                yield event
+
+
+def _batch(events, batch_size):
+    """
+    Group a stream of events in databases of given size.
+    """
+    if batch_size is None:
+        yield from events
+        return
+
+    edb = cat.EqDatabase()
+    for event in events:
+        edb.event.append(event)
+
+        if len(edb) >= batch_size:
+            yield edb
+            edb = cat.EqDatabase()
+
+    if len(edb):
+        yield edb
+
+
+def _to_seconds(time):
+    """
+    Convert a time specification to seconds (None is preserved).
+    """
+    if time is None:
+        return None
+    if not isinstance(time, Date):
+        time = Date(time)
+    return time.to_seconds()
+
+
+def _filter_limits(time_range=None, mag_range=None, bbox=None):
+    """
+    Convert the filter specifications to numerical limits.
+    """
+    if time_range is None and mag_range is None and bbox is None:
+        return None
+
+    tlim = None
+    if time_range is not None:
+        tlim = (_to_seconds(time_range[0]), _to_seconds(time_range[1]))
+
+    return (tlim, mag_range, bbox)
+
+
+def _in_range(value, limits):
+    """
+    Check if value is in the (closed) range; None bounds are open.
+    """
+    if value is None:
+        return False
+    if limits[0] is not None and value < limits[0]:
+        return False
+    if limits[1] is not None and value > limits[1]:
+        return False
+    return True
+
+
+def _check_limits(limits, loc, mag):
+    """
+    Check raw location (dictionary of strings) and magnitude values
+    against the filter limits. Missing values are filtered out.
+    """
+    if limits is None:
+        return True
+
+    (tlim, mlim, bbox) = limits
+
+    if mlim is not None:
+        if not _in_range(cast_value(mag, float), mlim):
+            return False
+
+    if tlim is not None or bbox is not None:
+        if loc is None:
+            return False
+
+        if bbox is not None:
+            lat = cast_value(loc.get('Latitude'), float)
+            lon = cast_value(loc.get('Longitude'), float)
+            if not (_in_range(lat, bbox[0]) and _in_range(lon, bbox[1])):
+                return False
+
+        if tlim is not None:
+            year = cast_value(loc.get('Year'), int)
+            if year is None:
+                return False
+
+            keys = ['Month', 'Day', 'Hour', 'Minute', 'Second']
+            data = []
+            for k in keys:
+                value = cast_value(loc.get(k), cat._LOCMAP[k][1])
+                data.append(cat._LOCMAP[k][2] if value is None else value)
+
+            if not _in_range(date_to_sec(year, *data), tlim):
+                return False
+
+    return True
@@ -0,0 +1,301 @@
+# ****************************************************************************
+#
+# Copyright (C) 2019-2020, ShakeLab Developers.
+# This file is part of ShakeLab.
+#
+# ShakeLab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ShakeLab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+#
+# ****************************************************************************
+"""
+Estimation of Gutenberg-Richter parameters and magnitude of
+completeness from catalogue magnitudes.
+
+Estimators work on the last axis of the magnitude array, so that
+a whole set of bootstrap resamples (a 2-D array) is processed at once.
+Missing magnitudes are given as NaN.
+"""
+
+import numpy as np
+
+
+def get_magnitudes(edb):
+    """
+    Prime magnitudes of a database as array (NaN if missing).
+    """
+    values = edb.extract('MagSize', remove_empty=False)
+    return np.array([np.nan if v is None else v for v in values])
+
+
+def aki_utsu(magnitude, mc, dm=0.1, duration=None):
+    """
+    Maximum-likelihood b-value (Aki, 1965) with the correction
+    for binned magnitudes (Utsu, 1966) and the uncertainty of
+    Shi and Bolt (1982).
+
+    :param numpy.array magnitude:
+        magnitudes (1-D, or 2-D with one sample per row)
+
+    :param float mc:
+        magnitude of completeness (or one value per sample)
+
+    :param float dm:
+        magnitude binning (0 for continuous magnitudes)
+
+    :param float duration:
+        catalogue duration in years; if given, the a-value is
+        returned as annual rate
+
+    :return a_value, b_value, sigma_b:
+        Gutenberg-Richter parameters and b-value standard error
+    """
+    magnitude = np.asarray(magnitude, dtype=float)
+    mc = np.asarray(mc, dtype=float)
+    magnitude = np.where(magnitude >= mc[..., None] - 1e-6*dm,
+                         magnitude, np.nan)
+
+    num = np.sum(np.isfinite(magnitude), axis=-1)
+    mean = np.nansum(magnitude, axis=-1)/num
+
+    b_value = np.log10(np.e)/(mean - (mc - dm/2.))
+
+    var = np.nansum((magnitude - mean[..., None])**2, axis=-1)
+    sigma_b = 2.3 * b_value**2 * np.sqrt(var/(num*(num - 1.)))
+
+    rate = num/duration if duration is not None else num
+    a_value = np.log10(rate) + b_value*mc
+
+    return a_value, b_value, sigma_b
+
+
+def weichert(magnitude, time, completeness, dm=0.1, end_time=None,
+             b_init=1., tol=1e-5, max_iter=100):
+    """
+    Maximum-likelihood b-value for variable completeness periods
+    (Weichert, 1980).
+
+    :param numpy.array magnitude:
+        magnitudes
+
+    :param numpy.array time:
+        event times in decimal years
+
+    :param numpy.array completeness:
+        completeness table as (n, 2) array of (year, magnitude)
+        pairs: magnitudes above each threshold are complete since
+        the given year
+
+    :param float dm:
+        magnitude bin width
+
+    :param float end_time:
+        end of the catalogue in decimal years (default is last event)
+
+    :return a_value, b_value, sigma_b:
+        annual Gutenberg-Richter parameters and b-value standard error
+    """
+    magnitude = np.asarray(magnitude, dtype=float)
+    time = np.asarray(time, dtype=float)
+    completeness = np.atleast_2d(np.asarray(completeness, dtype=float))
+    completeness = completeness[np.argsort(completeness[:, 1])]
+
+    if end_time is None:
+        end_time = np.nanmax(time)
+
+    # Magnitude bins from the lowest completeness threshold
+    m0 = completeness[0, 1]
+    nbin = int(np.round((np.nanmax(magnitude) - m0)/dm)) + 1
+    centre = m0 + dm*np.arange(nbin)
+
+    # Start of the complete period of each bin
+    ci = np.searchsorted(completeness[:, 1], centre + 1e-6*dm, 'right') - 1
+    start = completeness[ci, 0]
+    length = end_time - start
+
+    # Counts of events in their complete period
+    bi = np.round((magnitude - m0)/dm)
+    valid = np.isfinite(bi) & np.isfinite(time) & (bi >= 0)
+    bi = bi[valid].astype(int)
+    valid = time[valid] >= start[bi]
+    count = np.bincount(bi[valid], minlength=nbin).astype(float)
+
+    ntot = np.sum(count)
+    mbar = np.sum(count*centre)/ntot
+
+    beta = b_init*np.log(10.)
+    for it in range(max_iter):
+        tex = length*np.exp(-beta*centre)
+        s0 = np.sum(tex)
+        s1 = np.sum(tex*centre)/s0
+        s2 = np.sum(tex*centre**2)/s0
+
+        delta = (s1 - mbar)/(s2 - s1**2)
+        beta += delta
+
+        if np.abs(delta) < tol:
+            break
+
+    tex = length*np.exp(-beta*centre)
+    s0 = np.sum(tex)
+    s1 = np.sum(tex*centre)/s0
+    s2 = np.sum(tex*centre**2)/s0
+
+    b_value = beta/np.log(10.)
+    sigma_b = np.sqrt(1./(ntot*(s2 - s1**2)))/np.log(10.)
+
+    # Annual rate above the lower edge of the first bin
+    rate = ntot*np.sum(np.exp(-beta*centre))/s0
+    a_value = np.log10(rate) + b_value*(m0 - dm/2.)
+
+    return a_value, b_value, sigma_b
+
+
+def mc_maximum_curvature(magnitude, dm=0.1, correction=0.):
+    """
+    Magnitude of completeness from the maximum of the
+    non-cumulative magnitude distribution (Wiemer and Wyss, 2000).
+
+    :param numpy.array magnitude:
+        magnitudes (1-D, or 2-D with one sample per row)
+
+    :param float correction:
+        additive correction (e.g. 0.2, Woessner and Wiemer, 2005)
+
+    :return float mc:
+        magnitude of completeness (one per sample)
+    """
+    centre, count = magnitude_histogram(magnitude, dm)
+    return centre[np.argmax(count, axis=-1)] + correction
+
+
+def mc_goodness_of_fit(magnitude, dm=0.1, level=90.):
+    """
+    Magnitude of completeness from the goodness-of-fit test
+    (Wiemer and Wyss, 2000). All candidate thresholds are tested
+    at once; the lowest one reaching the confidence level is
+    returned, or the best fitting one if the level is never reached.
+
+    :param numpy.array magnitude:
+        magnitudes (1-D)
+
+    :param float level:
+        goodness-of-fit level in percent (e.g. 90 or 95)
+
+    :return float mc:
+        magnitude of completeness
+
+    :return numpy.array centre:
+        candidate thresholds
+
+    :return numpy.array residual:
+        goodness-of-fit (percent) of each candidate
+    """
+    centre, count = magnitude_histogram(magnitude, dm)
+
+    # Number of events and mean magnitude above each threshold
+    # (from reversed cumulative sums)
+    num = np.cumsum(count[::-1])[::-1]
+    msum = np.cumsum((count*centre)[::-1])[::-1]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        b_value = np.log10(np.e)/(msum/num - (centre - dm/2.))
+
+        # Synthetic counts: (threshold, bin)
+        lower = centre[None, :] - dm/2. - (centre[:, None] - dm/2.)
+        bv = b_value[:, None]
+        synth = num[:, None]*(10.**(-bv*lower) - 10.**(-bv*(lower + dm)))
+
+        above = centre[None, :] >= centre[:, None] - 1e-6*dm
+        misfit = np.sum(np.abs(count[None, :] - synth)*above, axis=1)
+        residual = 100. - 100.*misfit/num
+
+    residual = np.where(num > 1, residual, -np.inf)
+
+    ok = np.nonzero(residual >= level)[0]
+    idx = ok[0] if len(ok) else np.argmax(residual)
+
+    return centre[idx], centre, residual
+
+
+def magnitude_histogram(magnitude, dm=0.1):
+    """
+    Non-cumulative magnitude distribution on a common grid of
+    bin centres (multiples of dm). For 2-D input, counts are
+    computed for each row.
+
+    :return numpy.array centre:
+        bin centres
+
+    :return numpy.array count:
+        number of events per bin (last axis)
+    """
+    magnitude = np.asarray(magnitude, dtype=float)
+
+    index = np.round(magnitude/dm)
+    valid = np.isfinite(index)
+    imin = int(np.min(index[valid]))
+    imax = int(np.max(index[valid]))
+    nbin = imax - imin + 1
+
+    centre = dm*np.arange(imin, imax + 1)
+
+    index = np.where(valid, index - imin, 0).astype(int)
+    if magnitude.ndim == 1:
+        count = np.bincount(index[valid], minlength=nbin)
+    else:
+        rows = np.arange(magnitude.shape[0])[:, None]*nbin
+        flat = (index + rows)[valid]
+        count = np.bincount(flat, minlength=nbin*magnitude.shape[0])
+        count = count.reshape(magnitude.shape[0], nbin)
+
+    return centre, count
+
+
+def bootstrap_samples(magnitude, sample_num=1000, seed=None):
+    """
+    Bootstrap resamples of a magnitude array, generated as a single
+    (sample_num, n) array.
+
+    :param int seed:
+        seed (or numpy Generator) for reproducible sampling
+    """
+    magnitude = np.asarray(magnitude, dtype=float)
+    rng = np.random.default_rng(seed)
+
+    idx = rng.integers(0, len(magnitude), (sample_num, len(magnitude)))
+    return magnitude[idx]
+
+
+def bootstrap_b_value(magnitude, mc=None, dm=0.1, sample_num=1000,
+                      seed=None):
+    """
+    Bootstrap estimate of b-value and magnitude of completeness.
+    If mc is not given, it is estimated by maximum curvature for
+    each resample.
+
+    :return numpy.array b_value:
+        b-values of the resamples
+
+    :return numpy.array mc:
+        completeness magnitudes of the resamples
+    """
+    samples = bootstrap_samples(magnitude, sample_num, seed)
+
+    if mc is None:
+        mc = mc_maximum_curvature(samples, dm)
+    else:
+        mc = np.full(sample_num, mc, dtype=float)
+
+    b_value = aki_utsu(samples, mc, dm)[1]
+
+    return b_value, mc
@@ -41,14 +41,20 @@ def poisson_rate(probability, investigation_time=50.):
 
     return - np.log(1 - probability)/investigation_time
 
-def generate_synthetic_catalogue(aval, bval, mmin, mmax, duration=1.):
+def generate_synthetic_catalogue(aval, bval, mmin, mmax, duration=1.,
+                                 seed=None):
     """
     Must define an initial date!
 
     also, it is probably worth to generalize the MFD as input
     instead of aval, bval.
+    A seed (or numpy Generator) can be given for reproducibility;
+    if None, the global numpy random state is used.
+    See hazard.event_based for large stochastic event sets.
     """
 
+    rng = np.random if seed is None else np.random.default_rng(seed)
+
     # Annual rate
     rate = (10.**aval)*(10.**(-bval*mmin)-10.**(-bval*mmax))
     catlen = int(rate*duration)
@@ -59,7 +65,7 @@ def generate_synthetic_catalogue(aval, bval, mmin, mmax, duration=1.):
     # See Inverse transform sampling (also known as inversion sampling,
     # the inverse probability integral transform)
 
-    Um = np.random.rand(catlen)
+    Um = rng.random(catlen)
     C = 1.-(10.**(-bval*(mmax-mmin)))
     magnitude = mmin-np.log10(1.-(Um*C))/bval
 
@@ -69,7 +75,7 @@ def generate_synthetic_catalogue(aval, bval, mmin, mmax, duration=1.):
     # (Poisson assumption)
     # TOCHECK!
 
-    Ut = np.random.rand(catlen)
+    Ut = rng.random(catlen)
     dT = -np.log(1-Ut)/catlen
     T = np.cumsum(dT)
 
@@ -0,0 +1,332 @@
+# ****************************************************************************
+#
+# Copyright (C) 2019-2022, ShakeLab Developers.
+# This file is part of ShakeLab.
+#
+# ShakeLab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ShakeLab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+#
+# ****************************************************************************
+"""
+Probabilistic power spectral densities of station noise.
+
+Continuous data are split into overlapping segments (McNamara and
+Buland, 2004); the Welch PSD of each segment is corrected for the
+instrument response, converted to acceleration, averaged over
+logarithmic period bands and accumulated in a fixed-size histogram
+(period x dB). The histogram is the whole state: new data update it
+incrementally, states can be merged and saved to a compact file.
+"""
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from shakelab.signals import base
+from shakelab.signals import response
+from shakelab.signals.spectrogram import spectrogram, log_average_matrix
+from shakelab.libutils.time import Date
+
+# Maximum number of samples of a block of segments
+PSD_BLOCK = 2**22
+
+# Exponent of (2 pi f)^2 to convert the PSD to acceleration
+_UNITS = {'M': 2, 'M/S': 1, 'M/SEC': 1, 'M/S**2': 0, 'M/S/S': 0,
+          'M/SEC**2': 0}
+
+
+class PPSD():
+    """
+    Probabilistic power spectral density of a stream.
+    """
+    def __init__(self, delta=None, segment_length=3600., overlap=0.5,
+                 nperseg=None, period_limits=None, period_step=0.125,
+                 db_limits=(-200., -50.), db_step=1., file=None):
+        """
+        :param float delta:
+            sampling interval of the data in seconds
+
+        :param float segment_length:
+            length of the segments in seconds
+
+        :param float overlap:
+            overlap of consecutive segments (fraction)
+
+        :param int nperseg:
+            number of samples of the Welch windows (default is a
+            quarter of segment, with 75% overlap)
+
+        :param list period_limits:
+            [min, max] period in seconds of the bands
+
+        :param float period_step:
+            band width in octaves
+
+        :param list db_limits:
+            [min, max] of the histogram in dB
+
+        :param float db_step:
+            bin width in dB
+
+        :param string file:
+            if given, the state is read from file (see write)
+        """
+        self._response = {}
+        self._avg = None
+
+        if file is not None:
+            self.read(file)
+            return
+
+        self.delta = float(delta)
+        self.segment_length = float(segment_length)
+        self.overlap = float(overlap)
+
+        seg = int(round(segment_length/delta))
+        self.nperseg = seg//4 if nperseg is None else int(nperseg)
+
+        if period_limits is None:
+            period_limits = [4.*delta, self.nperseg*delta/2.]
+
+        exponent = np.arange(np.log2(period_limits[0]),
+                             np.log2(period_limits[1]) + 1e-9,
+                             period_step)
+        self.period = 2.**exponent
+        self.db = np.arange(db_limits[0], db_limits[1] + db_step/2., db_step)
+
+        self.hist = np.zeros((len(self.period), len(self.db) - 1),
+                             dtype=np.int64)
+        self.times = np.empty(0)
+
+    @property
+    def count(self):
+        """
+        Number of segments in the histogram.
+        """
+        return len(self.times)
+
+    def add(self, data, resp=None):
+        """
+        Add data to the histogram. Segments already included
+        (same start time) are skipped.
+
+        :param data:
+            a Record, a Stream or a list of records
+
+        :param resp:
+            instrument response (StageRecord, StreamResponse or
+            ResponseCollection); data are not corrected if None
+        """
+        if isinstance(data, base.Record):
+            data = [data]
+        elif isinstance(data, base.Stream):
+            data = data.record
+
+        for record in data:
+            self._add_record(record, resp)
+
+    def merge(self, ppsd):
+        """
+        Merge the histogram of another PPSD with the same grids.
+        States must not share segments (same start time), which
+        would be counted twice.
+        """
+        if (self.hist.shape != ppsd.hist.shape or
+                not np.allclose(self.period, ppsd.period) or
+                not np.allclose(self.db, ppsd.db)):
+            raise ValueError('PPSD grids are not compatible')
+
+        new = ~np.isin(np.round(ppsd.times, 3), np.round(self.times, 3))
+        if not np.all(new):
+            raise ValueError('PPSD states have overlapping segments')
+
+        self.hist += ppsd.hist
+        self.times = np.sort(np.concatenate((self.times, ppsd.times)))
+
+    def pdf(self):
+        """
+        Probability density of each period band as (n_period, n_db).
+        """
+        total = np.maximum(self.hist.sum(axis=1, keepdims=True), 1)
+        return self.hist/total/np.diff(self.db)
+
+    def percentile(self, q):
+        """
+        Percentile (0-100) of the PSD (dB) in each period band.
+        """
+        cum = np.cumsum(self.hist, axis=1)
+        total = np.maximum(cum[:, -1:], 1)
+        idx = np.argmax(cum >= q/100.*total, axis=1)
+        return 0.5*(self.db[idx] + self.db[idx + 1])
+
+    def mode(self):
+        """
+        Most probable PSD (dB) in each period band.
+        """
+        idx = np.argmax(self.hist, axis=1)
+        return 0.5*(self.db[idx] + self.db[idx + 1])
+
+    def mean(self):
+        """
+        Mean PSD (dB) in each period band.
+        """
+        centre = 0.5*(self.db[1:] + self.db[:-1])
+        total = np.maximum(self.hist.sum(axis=1), 1)
+        return self.hist @ centre/total
+
+    def write(self, file):
+        """
+        Save the state to a compressed binary file (numpy npz).
+        """
+        np.savez_compressed(file,
+                            hist=self.hist.astype(np.uint32),
+                            times=self.times,
+                            period=self.period,
+                            db=self.db,
+                            param=np.array([self.delta,
+                                            self.segment_length,
+                                            self.overlap,
+                                            self.nperseg]))
+
+    def read(self, file):
+        """
+        Load the state from a file (see write).
+        """
+        with np.load(file) as data:
+            self.hist = data['hist'].astype(np.int64)
+            self.times = data['times']
+            self.period = data['period']
+            self.db = data['db']
+            param = data['param']
+
+        self.delta = float(param[0])
+        self.segment_length = float(param[1])
+        self.overlap = float(param[2])
+        self.nperseg = int(param[3])
+        self._response = {}
+        self._avg = None
+
+    def _add_record(self, record, resp):
+        """
+        Internal: process the segments of a record.
+        """
+        if not np.isclose(record.head.delta, self.delta):
+            raise ValueError('Sampling of the record does not match')
+
+        seg = int(round(self.segment_length/self.delta))
+        step = max(1, int(round(seg*(1. - self.overlap))))
+
+        if len(record.data) < seg:
+            return
+
+        start = _seconds(record.head.time)
+        segments = sliding_window_view(np.asarray(record.data, dtype=float),
+                                       seg)[::step]
+        times = start + np.arange(len(segments))*step*self.delta
+
+        # Skip segments already in the histogram
+        new = ~np.isin(np.round(times, 3), np.round(self.times, 3))
+        segments = segments[new]
+        times = times[new]
+
+        if len(times) == 0:
+            return
+
+        corr, avg = self._correction(record, resp)
+
+        block = max(1, PSD_BLOCK // seg)
+        for i0 in range(0, len(segments), block):
+            _, _, psd = spectrogram(segments[i0:i0+block], self.delta,
+                                    self.nperseg, 3*self.nperseg//4)
+
+            # Welch average, response and band average
+            psd = np.mean(psd, axis=-1)*corr
+            db = 10.*np.log10(np.maximum(psd @ avg.T, 1e-300))
+            self._accumulate(db)
+
+        self.times = np.sort(np.concatenate((self.times, times)))
+
+    def _accumulate(self, db):
+        """
+        Internal: add PSDs in dB (n_segments, n_period) to the
+        histogram; values out of range go to the extreme bins.
+        """
+        db_num = len(self.db) - 1
+        step = self.db[1] - self.db[0]
+
+        idx = np.floor((db - self.db[0])/step).astype(int)
+        idx = np.clip(idx, 0, db_num - 1)
+        flat = idx + db_num*np.arange(len(self.period))[None, :]
+
+        hist = np.bincount(flat.ravel(), minlength=self.hist.size)
+        self.hist += hist.reshape(self.hist.shape)
+
+    def _correction(self, record, resp):
+        """
+        Internal: response correction (to acceleration) of the
+        linear spectrum and band-average matrix; response values
+        are cached for each stage record.
+        """
+        freq = np.fft.rfftfreq(self.nperseg, self.delta)
+
+        if self._avg is None:
+            # Bands ordered by increasing frequency, then flipped
+            fb = 1./self.period[::-1]
+            self._avg = log_average_matrix(freq, fb)[::-1]
+
+        srec = _stage_record(record, resp)
+        if srec is None:
+            return np.ones(len(freq)), self._avg
+
+        key = id(srec)
+        if key not in self._response:
+            with np.errstate(divide='ignore'):
+                power = np.abs(srec.response_function(freq))**2
+                units = str(srec.input_units).upper().replace(' ', '')
+                if units not in _UNITS:
+                    raise ValueError('Units not recognized: {0}'.format(units))
+                omega2 = (2.*np.pi*freq)**2
+                corr = omega2**_UNITS[units]/power
+                corr[~np.isfinite(corr)] = 0.
+
+            # The stage record is kept to preserve its id
+            self._response[key] = (srec, corr)
+
+        return self._response[key][1], self._avg
+
+
+def _stage_record(record, resp):
+    """
+    Internal: stage record of the response at the record time.
+    """
+    if resp is None or isinstance(resp, response.StageRecord):
+        return resp
+
+    if isinstance(resp, response.StreamResponse):
+        return resp.get(record.head.time)
+
+    if isinstance(resp, response.ResponseCollection):
+        if record.head.sid in resp.sid:
+            return resp[record.head.sid].get(record.head.time)
+        print('Station not in database. Not correcting.')
+        return None
+
+    raise ValueError('Not a valid reponse object')
+
+
+def _seconds(time):
+    """
+    Internal: time in seconds.
+    """
+    if isinstance(time, Date):
+        return time.seconds
+    return float(time)
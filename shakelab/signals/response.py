@@ -213,6 +213,32 @@ class StageRecord():
             if stage.stage_number == stage_number:
                 srec.stage.append(stage)
 
+    def response_function(self, frequency):
+        """
+        Overall response (gain and pole-zero stages) at the
+        given frequencies.
+        """
+        resp = np.ones(np.size(frequency), dtype=complex)
+
+        for stage in self.stage:
+            if isinstance(stage, StageGain):
+                resp *= stage.sensitivity
+            elif isinstance(stage, StagePoleZero):
+                resp *= stage.response_function(frequency)
+
+        return resp
+
+    @property
+    def input_units(self):
+        """
+        Input units of the first stage that defines them.
+        """
+        for stage in self.stage:
+            units = getattr(stage, 'input_units', None)
+            if units is not None:
+                return units
+        return None
+
     #def get(self, stage_number=None):
     #    """
     #    Select specific stage sequence numbers
@@ -22,76 +22,501 @@ Collection of algorithms to compute time-frequency spectrograms.
 """
 
 import numpy as np
-from numpy.matlib import repmat
-from scipy.linalg import toeplitz
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import fft as fftpack
 from scipy import signal
 
+# Maximum number of elements of a block of S-transform rows
+ST_BLOCK = 2**22
 
-def wft(data, delta):
+# Maximum number of samples of a block of frames
+FRAME_BLOCK = 2**22
+
+
+def wft(data, delta, nperseg=256, noverlap=None, window='hann',
+        detrend=True, out=None):
     """
-    Windowed Fourier transform
+    Windowed (short-time) Fourier transform.
+
+    Frames are strided views of the signal (no copies); they are
+    windowed and transformed with a batched rfft, in blocks of
+    bounded size. Multiple channels of equal length can be given
+    as a 2D array.
+
+    :param numpy.array data:
+        the input signal (n_samples,) or (n_channels, n_samples)
+
+    :param float delta:
+        sampling interval in seconds
+
+    :param int nperseg:
+        number of samples per frame
+
+    :param int noverlap:
+        number of overlapping samples (default is half frame)
+
+    :param string or numpy.array window:
+        window name (see scipy.signal.get_window) or values
+
+    :param bool detrend:
+        remove the mean of each frame
+
+    :param numpy.array out:
+        optional preallocated output array (..., n_freq, n_frames)
+
+    :return numpy.array time, freq, spec:
+        frame centre times (s), frequencies (Hz) and complex
+        spectra as (..., n_freq, n_frames)
     """
-    pass
+    data = np.asarray(data)
+    frames, step = frame_signal(data, nperseg, noverlap)
+    win = _get_window(window, nperseg)
+
+    freq = np.fft.rfftfreq(nperseg, delta)
+    time = (np.arange(frames.shape[-2])*step + nperseg/2.)*delta
+
+    shape = frames.shape[:-2] + (len(freq), frames.shape[-2])
+    if out is None:
+        out = np.empty(shape, dtype=complex)
+
+    for i0, spec in _frame_blocks(frames, win, detrend):
+        out[..., i0:i0+spec.shape[-2]] = np.swapaxes(spec, -1, -2)
+
+    return time, freq, out
+
+def spectrogram(data, delta, nperseg=256, noverlap=None, window='hann',
+                detrend=True, freq=None):
+    """
+    Power spectral density of the frames of a signal (one-sided,
+    in units^2/Hz).
+
+    :param numpy.array data:
+        the input signal (n_samples,) or (n_channels, n_samples)
+
+    :param float delta:
+        sampling interval in seconds
+
+    :param int nperseg, noverlap, window, detrend:
+        see wft
+
+    :param numpy.array freq:
+        optional output frequencies (e.g. logarithmic, see
+        fourier.frequency_range); power is averaged over the bands
+        between the geometric midpoints of the frequencies
+
+    :return numpy.array time, freq, psd:
+        frame centre times (s), frequencies (Hz) and PSD
+        as (..., n_freq, n_frames)
+    """
+    data = np.asarray(data)
+    frames, step = frame_signal(data, nperseg, noverlap)
+    win = _get_window(window, nperseg)
+
+    f_lin = np.fft.rfftfreq(nperseg, delta)
+    time = (np.arange(frames.shape[-2])*step + nperseg/2.)*delta
+
+    scale = _psd_scale(win, delta, nperseg)
+    avg = None if freq is None else log_average_matrix(f_lin, freq)
+
+    nf = len(f_lin) if freq is None else len(freq)
+    out = np.empty(frames.shape[:-2] + (nf, frames.shape[-2]))
+
+    for i0, spec in _frame_blocks(frames, win, detrend):
+        power = np.abs(spec)**2*scale
+        if avg is not None:
+            power = power @ avg.T
+        out[..., i0:i0+power.shape[-2]] = np.swapaxes(power, -1, -2)
+
+    return time, (f_lin if freq is None else np.asarray(freq)), out
+
+def stream_spectrogram(stream_collection, nperseg=256, noverlap=None,
+                       window='hann', detrend=True, freq=None):
+    """
+    Spectrograms of all the streams of a collection. Streams with
+    the same sampling and length are processed as one batch.
+
+    :param StreamCollection stream_collection:
+        the streams (records of each stream are merged)
+
+    :return dict:
+        (time, freq, psd) of each stream id, see spectrogram
+    """
+    groups = {}
+    for stream in stream_collection.stream:
+        record = stream.get()
+        key = (record.head.delta, len(record.data))
+        groups.setdefault(key, []).append((stream.sid, record.data))
+
+    output = {}
+    for (delta, _), items in groups.items():
+        data = np.array([d for _, d in items], dtype=float)
+        time, f, psd = spectrogram(data, delta, nperseg, noverlap,
+                                   window, detrend, freq)
+        for k, (sid, _) in enumerate(items):
+            output[sid] = (time, f, psd[k])
+
+    return output
+
+class RunningPSD():
+    """
+    Running average of the power spectral density of a continuous
+    signal, fed by consecutive chunks of data. Samples at the end
+    of a chunk are kept to complete the frames of the next one.
+    """
+    def __init__(self, delta, nperseg=256, noverlap=None, window='hann',
+                 detrend=True, freq=None):
+        """
+        :param float delta:
+            sampling interval in seconds
+
+        :param int nperseg, noverlap, window, detrend, freq:
+            see spectrogram
+        """
+        self.delta = delta
+        self.nperseg = nperseg
+        self.noverlap = nperseg//2 if noverlap is None else noverlap
+        self.window = window
+        self.detrend = detrend
+        self.freq = freq
+
+        self.reset()
+
+    def reset(self):
+        """
+        Clear the average (and the pending samples).
+        """
+        self.tail = None
+        self.total = 0.
+        self.count = 0
+
+    def update(self, data):
+        """
+        Add a chunk of data (n_samples,) or (n_channels, n_samples).
+        """
+        data = np.asarray(data, dtype=float)
+        if self.tail is not None:
+            data = np.concatenate((self.tail, data), axis=-1)
+
+        step = self.nperseg - self.noverlap
+        num = (data.shape[-1] - self.nperseg)//step + 1
+
+        if num > 0:
+            _, freq, psd = spectrogram(data, self.delta, self.nperseg,
+                                       self.noverlap, self.window,
+                                       self.detrend, self.freq)
+            self.total = self.total + np.sum(psd, axis=-1)
+            self.count += num
+            self.frequency = freq
+            data = data[..., num*step:]
+
+        self.tail = data
+
+    @property
+    def mean(self):
+        """
+        Average PSD as (..., n_freq).
+        """
+        return self.total/max(self.count, 1)
 
 def cwt(data, delta, freq, omega0=6):
     """
     Continuous wavelet transform with complex Morlet wavelet.
+
+    The convolution is done in the frequency domain with the
+    analytic Fourier transform of the wavelet (same normalization
+    of scipy.signal.morlet2), in blocks of frequencies, and can be
+    applied to multiple channels as a 2D array.
+
+    :param numpy.array data:
+        the input signal (n_samples,) or (n_channels, n_samples)
+
+    :param float delta:
+        sampling interval in seconds
+
+    :param float or numpy.array freq:
+        frequencies in Hz
+
+    :param float omega0:
+        central (angular) frequency of the wavelet
+
+    :return numpy.array:
+        the transform as (..., n_freq, n_samples)
     """
+    data = np.asarray(data, dtype=float)
     freq = np.array(freq, ndmin=1)
     widths = omega0 /(2*np.pi*delta*freq)
 
-    return signal.cwt(data, signal.morlet2, widths, w=omega0)
+    # Zero padding against wrap-around
+    n = data.shape[-1]
+    nfft = fftpack.next_fast_len(n + int(np.ceil(5*np.max(widths))))
+
+    hft = np.fft.fft(data, nfft, axis=-1)[..., None, :]
+    w = 2*np.pi*np.fft.fftfreq(nfft)
+
+    out = np.empty(data.shape[:-1] + (len(freq), n), dtype=complex)
+    block = max(1, ST_BLOCK // nfft)
 
-def cst(dara, delta, freq):
+    for k0 in range(0, len(freq), block):
+        s = widths[k0:k0+block, None]
+        psi = np.pi**-0.25*np.sqrt(2*np.pi*s)*np.exp(-0.5*(s*w - omega0)**2)
+        out[..., k0:k0+block, :] = np.fft.ifft(hft*psi, axis=-1)[..., :n]
+
+    return out
+
+def cst(data, delta, freq, tstep=1, out=None):
     """
-    Continuous Stockwell transform
+    Continuous Stockwell transform at arbitrary frequencies.
+
+    Each row is computed from the FFT of the modulated signal,
+    with the same convention of stransform (so that rows at the
+    Fourier frequencies are identical). Rows are processed in blocks
+    of bounded size.
+
+    :param numpy.array data:
+        the input signal
+
+    :param float delta:
+        sampling interval in seconds
+
+    :param float or numpy.array freq:
+        frequencies in Hz (non zero)
+
+    :param int tstep:
+        time decimation of the output
+
+    :param numpy.array out:
+        optional preallocated (or memory-mapped) output array
+        (n_freq, n_time)
+
+    :return numpy.array st:
+        the S-transform as (n_freq, n_time)
+    """
+    data = np.asarray(data, dtype=float).ravel()
+    freq = np.array(freq, ndmin=1, dtype=float)
+
+    n = len(data)
+    f = np.fft.fftfreq(n, delta)
+    t = np.arange(n)*delta
+
+    out = _st_output(out, len(freq), n, tstep)
+    block = max(1, ST_BLOCK // n)
+
+    for k0 in range(0, len(freq), block):
+        fk = freq[k0:k0+block, None]
+        hw = np.fft.fft(data*np.exp(2j*np.pi*fk*t), axis=1)
+        gw = np.exp(-2.*(np.pi*f/fk)**2)
+        out[k0:k0+block] = _decimated_ifft(hw*gw, tstep)
+
+    return out
+
+def stransform(data, delta, flim=None, fstep=1, tstep=1, out=None):
     """
-    pass
-    #wav = np.exp(-(2*np.pi*freq)**2/f0) * np.exp(2*pi*1j*freq)
+    Stockwell transform (S-transform) of a signal.
 
-def stransform(data, delta):
-    # Compute Stockwell Transform without for loops
-    # Ported in python from the origina code by Kalyan S. Dash
-    # (IIT Bhubaneswaqr, India)
+    Rows are computed in blocks of bounded size from a single FFT
+    of the signal (shifted spectrum times the frequency-domain
+    Gaussian window), so that memory does not grow as n^2. Output
+    can be decimated in frequency and time and written directly
+    into a preallocated or memory-mapped array.
 
-    data = np.reshape(data, (1, -1))
+    :param numpy.array data:
+        the input signal
 
-    (_, n) = data.shape
+    :param float delta:
+        sampling interval in seconds
 
-    nhaf = int(np.fix(n/2))
+    :param list flim:
+        optional frequency range [min, max] of the output in Hz
 
-    odvn = 1
-    if nhaf*2 == n:
-        odvn = 0
+    :param int fstep:
+        frequency decimation of the output (every fstep-th
+        Fourier frequency)
 
+    :param int tstep:
+        time decimation of the output
+
+    :param numpy.array out:
+        optional preallocated (or memory-mapped) output array
+        (n_freq, n_time)
+
+    :return numpy.array freq, st:
+        frequencies of the output and the S-transform as
+        (n_freq, n_time); the zero frequency row is the mean
+    """
+    data = np.asarray(data, dtype=float).ravel()
+
+    n = len(data)
+    nhaf = n//2
+
+    f = np.fft.fftfreq(n, delta)
     f_l = np.arange(0, nhaf + 1)/(delta*n)
-    f_r = np.arange(-nhaf + 1 - odvn, 0)/(delta*n)
-    f = np.concatenate([f_l, f_r])
 
-    hft = np.fft.fft(data)
+    k = np.arange(0, nhaf + 1)
+    if flim is not None:
+        k = k[(f_l >= flim[0]) & (f_l <= flim[1])]
+    k = k[::fstep]
 
-    # Compute all frequency domain Gaussians as one matrix
-    invfk = np.array([1.0 / f[1 : nhaf + 1]]).T
-    w = 2 * np.pi * repmat(f, nhaf, 1) * repmat(invfk, 1, n)
-    gw = np.exp((-w**2)/2)
+    hft = np.fft.fft(data)
+    out = _st_output(out, len(k), n, tstep)
+    block = max(1, ST_BLOCK // n)
 
-    # Compute Toeplitz matrix with the shifted fft(h)
-    hw = toeplitz(np.conj(hft.T[0 : nhaf + 1]), hft)
+    for i0 in range(0, len(k), block):
+        kb = k[i0:i0+block]
+        row = kb > 0
 
-    # Exclude the first row, corresponding to zero frequency
-    hw = hw[1 : nhaf + 1, :]
+        st = np.empty((len(kb), out.shape[1]), dtype=complex)
+        st[~row] = np.mean(data)
 
-    # Convolution
-    st = np.fft.ifft(hw * gw)
+        if np.any(row):
+            # Shifted spectrum and Gaussian windows of the block
+            kr = kb[row, None]
+            hw = hft[(np.arange(n) - kr) % n]
+            gw = np.exp(-2.*(np.pi*f/f_l[kr])**2)
+            st[row] = _decimated_ifft(hw*gw, tstep)
 
-    # Add the zero freq row
-    st0 = np.mean(data) * np.ones((1, n))
-    st = np.concatenate([st0, st])
+        out[i0:i0+block] = st
 
-    return f_l, st
+    return f_l[k], out
 
 def istransform(h, delta):
     """
-    Not yet implemented
+    Inverse Stockwell transform.
+
+    The spectrum of the signal is recovered by summing the
+    S-transform over time, then transformed back. It requires the
+    full output of stransform (no frequency or time decimation)
+    of a real signal.
+
+    :param numpy.array h:
+        the S-transform as (n/2 + 1, n)
+
+    :param float delta:
+        sampling interval in seconds
+
+    :return numpy.array data:
+        the signal
+    """
+    n = h.shape[1]
+
+    hft = np.empty(h.shape[0], dtype=complex)
+    block = max(1, ST_BLOCK // n)
+
+    for k0 in range(0, h.shape[0], block):
+        hft[k0:k0+block] = np.sum(h[k0:k0+block], axis=1)
+
+    # Rows are computed from the shifted (conjugate) spectrum
+    hft[1:] = np.conj(hft[1:])
+
+    return np.fft.irfft(hft, n)
+
+def _st_output(out, nf, n, tstep):
+    """
+    Internal: check or allocate the output array.
+    """
+    shape = (nf, -(-n // tstep))
+
+    if out is None:
+        return np.empty(shape, dtype=complex)
+
+    if out.shape != shape:
+        raise ValueError('output shape must be {0}'.format(shape))
+
+    return out
+
+def _decimated_ifft(spec, tstep):
+    """
+    Internal: inverse FFT along the last axis, keeping every
+    tstep-th sample. If tstep divides the length, the spectrum is
+    folded and a shorter transform is used.
+    """
+    n = spec.shape[-1]
+
+    if tstep == 1:
+        return np.fft.ifft(spec, axis=-1)
+
+    if n % tstep == 0:
+        fold = spec.reshape(spec.shape[:-1] + (tstep, n // tstep))
+        return np.fft.ifft(fold.sum(axis=-2), axis=-1)/tstep
+
+    return np.fft.ifft(spec, axis=-1)[..., ::tstep]
+
+def frame_signal(data, nperseg, noverlap=None):
+    """
+    Overlapping frames of a signal, as a strided view
+    (..., n_frames, nperseg).
+
+    :return numpy.array frames, int step:
+        the frames and the number of samples between frames
+    """
+    noverlap = nperseg//2 if noverlap is None else noverlap
+    step = nperseg - noverlap
+
+    if step < 1:
+        raise ValueError('noverlap must be lower than nperseg')
+
+    if data.shape[-1] < nperseg:
+        raise ValueError('signal shorter than nperseg')
+
+    frames = sliding_window_view(data, nperseg, axis=-1)
+    return frames[..., ::step, :], step
+
+def log_average_matrix(f_lin, freq):
+    """
+    Matrix (n_freq, n_lin) averaging a linear spectrum over the
+    bands between the geometric midpoints of the output frequencies.
+    Bands without linear frequencies are interpolated.
+    """
+    f_lin = np.asarray(f_lin)
+    freq = np.asarray(freq, dtype=float)
+
+    edges = np.sqrt(freq[1:]*freq[:-1])
+    edges = np.concatenate(([freq[0]**2/edges[0] if len(edges) else 0.],
+                            edges,
+                            [freq[-1]**2/edges[-1] if len(edges) else np.inf]))
+
+    band = np.searchsorted(edges, f_lin, side='right') - 1
+    inside = (band >= 0) & (band < len(freq))
+
+    avg = np.zeros((len(freq), len(f_lin)))
+    avg[band[inside], np.nonzero(inside)[0]] = 1.
+
+    # Interpolation where bands are empty
+    empty = np.nonzero(avg.sum(axis=1) == 0.)[0]
+    for i in empty:
+        j = np.clip(np.searchsorted(f_lin, freq[i]), 1, len(f_lin) - 1)
+        w = (freq[i] - f_lin[j-1])/(f_lin[j] - f_lin[j-1])
+        avg[i, j-1] = 1. - np.clip(w, 0., 1.)
+        avg[i, j] = np.clip(w, 0., 1.)
+
+    return avg/avg.sum(axis=1, keepdims=True)
+
+def _frame_blocks(frames, win, detrend):
+    """
+    Internal: rfft of blocks of frames, as (block start, spectra).
+    """
+    nperseg = frames.shape[-1]
+    block = max(1, FRAME_BLOCK // (nperseg*max(1, frames[..., 0, 0].size)))
+
+    for i0 in range(0, frames.shape[-2], block):
+        seg = frames[..., i0:i0+block, :]
+        if detrend:
+            seg = seg - np.mean(seg, axis=-1, keepdims=True)
+        yield i0, np.fft.rfft(seg*win, axis=-1)
+
+def _get_window(window, nperseg):
+    """
+    Internal: window values.
+    """
+    if isinstance(window, str) or isinstance(window, tuple):
+        return signal.get_window(window, nperseg)
+    return np.asarray(window)
+
+def _psd_scale(win, delta, nperseg):
+    """
+    Internal: one-sided PSD scaling of the squared spectrum.
     """
-    pass
+    scale = np.full(nperseg//2 + 1, 2.*delta/np.sum(win**2))
+    scale[0] /= 2.
+    if nperseg % 2 == 0:
+        scale[-1] /= 2.
+    return scale
@@ -1,9 +1,15 @@
 from shakelab.site.cps.srfker96 import srfker96
-from shakelab.site.cps.surf96 import surf96
+from shakelab.site.cps.surf96 import (surf96, surf96_batch,
+                                       surf96_modes, surf96_throughput,
+                                       secular_function)
 from shakelab.site.cps.swegn96 import swegn96
 
 __all__ = [
     "srfker96",
     "surf96",
+    "surf96_batch",
+    "surf96_modes",
+    "surf96_throughput",
     "swegn96",
+    "secular_function",
 ]
@@ -1,5 +1,28 @@
+import os
+
 import numpy as np
 
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def jitted(function):
+    """
+    Compile a function with Numba in nopython mode, if available.
+
+    Compilation can be disabled by setting the SHAKELAB_NOJIT
+    environment variable; the pure Python function is then used.
+
+    """
+    if numba is None or os.environ.get("SHAKELAB_NOJIT"):
+        return function
+
+    return numba.njit(cache=True, nogil=True)(function)
+
+
+@jitted
 def normc(ee, nmat):
     """
     Normalize Haskell or Dunkin vectors.
@@ -19,16 +19,31 @@ The code has been adapted and optimized for Numba.
 
 """
 
+import time
+
 import numpy as np
 
-from shakelab.site.cps.common import normc
+from shakelab.site.cps.common import jitted, normc
+from shakelab.libutils.utils import run_jobs
+
+__all__ = ["surf96", "surf96_batch", "surf96_modes", "surf96_throughput",
+           "secular_function"]
+
+# Default number of models per job
+CHUNK_SIZE = 64
+
+# Maximum number of (period, velocity) pairs evaluated at once
+GRID_BLOCK = 2**18
 
-__all__ = ["surf96"]
+# Lowest mode solved on the velocity grid (see surf96_modes); lower
+# modes (and the fast delta matrix) use the sequential search of getc
+GRID_MODE = 1
 
 
 twopi = 2.0 * np.pi
 
 
+@jitted
 def dnka(wvno2, gam, gammk, rho, a0, cpcq, cpy, cpz, cqw, cqx, xy, xz, wy, wz, ca):
     """
     Dunkin's matrix.
@@ -81,6 +96,7 @@ def dnka(wvno2, gam, gammk, rho, a0, cpcq, cpy, cpz, cqw, cqx, xy, xz, wy, wz, c
     return ca
 
 
+@jitted
 def var(p, q, ra, rb, wvno, xka, xkb, dpth):
     """
     Find variables cosP, cosQ, sinP, sinQ...
@@ -147,6 +163,7 @@ def var(p, q, ra, rb, wvno, xka, xkb, dpth):
     return w, cosp, a0, cpcq, cpy, cpz, cqw, cqx, xy, xz, wy, wz
 
 
+@jitted
 def dltar1(wvno, omega, d, a, b, rho, llw):
     """
     Love-wave period equation.
@@ -199,6 +216,7 @@ def dltar1(wvno, omega, d, a, b, rho, llw):
     return e1
 
 
+@jitted
 def dltar4(wvno, omega, d, a, b, rho, llw, ca):
     """
     Rayleigh-wave period equation.
@@ -285,6 +303,7 @@ def dltar4(wvno, omega, d, a, b, rho, llw, ca):
     return dlt
 
 
+@jitted
 def fast_delta(wvno, omega, d, alpha, beta, rho, llw):
     """
     Fast delta matrix.
@@ -308,7 +327,7 @@ def fast_delta(wvno, omega, d, alpha, beta, rho, llw):
     mu0 = rho[0] * beta[0] ** 2.0
     t0 = 2.0 - c2 / beta[0] ** 2.0
 
-    X = np.zeros(5, dtype=np.complex_)
+    X = np.zeros(5, dtype=np.complex128)
     X[0] = 2.0 * t0
     X[1] = -t0 * t0
     X[4] = -4.0
@@ -439,6 +458,7 @@ def fast_delta(wvno, omega, d, alpha, beta, rho, llw):
     return np.real(X[1] + s * X[3] - r * (X[3] + s * X[4]))
 
 
+@jitted
 def dltar(wvno, omega, d, a, b, rho, ifunc, llw, ca):
     """
     Select Rayleigh or Love wave period equation.
@@ -451,6 +471,7 @@ def dltar(wvno, omega, d, a, b, rho, ifunc, llw, ca):
         return fast_delta(wvno, omega, d, a, b, rho, llw)
 
 
+@jitted
 def nevill(t, c1, c2, del1, del2, d, a, b, rho, ifunc, llw, ca):
     """
     Hybrid method for refining root once it has been bracketted.
@@ -545,6 +566,7 @@ def nevill(t, c1, c2, del1, del2, d, a, b, rho, ifunc, llw, ca):
     return c3
 
 
+@jitted
 def getsol(t1, c1, clow, dc, cm, betmx, ifirst, del1st, d, a, b, rho, ifunc, llw, ca):
     """
     Bracket dispersion curve and then refine it.
@@ -581,6 +603,7 @@ def getsol(t1, c1, clow, dc, cm, betmx, ifirst, del1st, d, a, b, rho, ifunc, llw
     return c1, del1st, iret
 
 
+@jitted
 def gtsolh(a, b):
     """
     Starting solution.
@@ -604,6 +627,7 @@ def gtsolh(a, b):
     return c
 
 
+@jitted
 def getc(t, d, a, b, rho, mode, ifunc, dc):
     """
     Get phase velocity dispersion curve.
@@ -721,7 +745,9 @@ def surf96(t, d, a, b, rho, mode=0, itype=0, ifunc=2, dc=0.005, dt=0.025):
     rho : array_like
         Layer density (in g/cm3).
     mode : int, optional, default 0
-        Mode number (0 if fundamental).
+        Mode number (0 if fundamental). Modes from GRID_MODE are
+        solved with surf96_modes, without the search of the lower
+        modes (except for ifunc 3, which is not available there).
     itype : int, optional, default 0
         Velocity type:
          - 0: phase velocity,
@@ -742,6 +768,14 @@ def surf96(t, d, a, b, rho, mode=0, itype=0, ifunc=2, dc=0.005, dt=0.025):
         Phase or group dispersion velocity.
 
     """
+    if mode >= GRID_MODE and ifunc != 3:
+        return surf96_modes(t, d, a, b, rho, mode + 1, itype, ifunc, dc,
+                            dt)[mode]
+
+    t = np.asarray(t, dtype=np.float64)
+    d, a, b, rho = [np.ascontiguousarray(x, dtype=np.float64)
+                    for x in (d, a, b, rho)]
+
     nt = len(t)
     t1 = np.empty(nt, dtype=np.float64)
 
@@ -772,3 +806,448 @@ def surf96(t, d, a, b, rho, mode=0, itype=0, ifunc=2, dc=0.005, dt=0.025):
                 c1[i] = 0.0
 
     return c1
+
+
+def surf96_modes(t, d, a, b, rho, nmode=1, itype=0, ifunc=2, dc=0.005,
+                 dt=0.025):
+    """
+    Get phase or group velocity dispersion curves of all the modes
+    at once.
+
+    The period equation is evaluated on a grid of phase velocities
+    (step dc) for all the periods in one pass (see secular_function);
+    all the sign changes are then refined together. The k-th root
+    of each period is the k-th mode, so higher modes do not require
+    a sequential search.
+
+    Parameters
+    ----------
+    t : array_like
+        Periods (in s).
+    d : array_like
+        Layer thickness (in km).
+    a : array_like
+        Layer P-wave velocity (in km/s).
+    b : array_like
+        Layer S-wave velocity (in km/s).
+    rho : array_like
+        Layer density (in g/cm3).
+    nmode : int, optional, default 1
+        Number of modes (fundamental included).
+    itype, ifunc, dc, dt
+        See surf96.
+
+    Returns
+    -------
+    array_like
+        Phase or group velocity as (nmode, n_periods); zero
+        where the mode does not exist.
+
+    """
+    t = np.asarray(t, dtype=np.float64)
+    d, a, b, rho = [np.asarray(x, dtype=np.float64) for x in (d, a, b, rho)]
+
+    if itype == 1:
+        t1 = t / (1.0 + dt)
+        t2 = t / (1.0 - dt)
+        c1 = _grid_modes(t1, d, a, b, rho, nmode, ifunc, dc)
+        c2 = _grid_modes(t2, d, a, b, rho, nmode, ifunc, dc)
+
+        valid = (c1 > 0.0) & (c2 > 0.0)
+        c1 = np.where(valid, c1, 1.0)
+        c2 = np.where(valid, c2, 1.0)
+
+        t1i = 1.0 / t1
+        t2i = 1.0 / t2
+        return np.where(valid, (t1i - t2i) / (t1i / c1 - t2i / c2), 0.0)
+
+    return _grid_modes(t, d, a, b, rho, nmode, ifunc, dc)
+
+
+def secular_function(t, c, d, a, b, rho, ifunc=2):
+    """
+    Evaluate the period equation for many periods and phase
+    velocities in one pass.
+
+    The layer recursion is vectorized over all the (t, c) pairs;
+    the determinant is normalized at each layer, so only its sign
+    (and its zeros) are meaningful.
+
+    Parameters
+    ----------
+    t : array_like
+        Periods (in s).
+    c : array_like
+        Phase velocities (in km/s), broadcast with t (e.g. t[:, None]
+        and c[None, :] for a grid).
+    d, a, b, rho : array_like
+        See surf96.
+    ifunc : int, optional, default 2
+        Select wave type:
+         - 1: Love-wave (Thomson-Haskell method),
+         - 2, 3: Rayleigh-wave (Dunkin's matrix).
+
+    Returns
+    -------
+    array_like
+        Period equation (normalized).
+
+    """
+    d, a, b, rho = [np.asarray(x, dtype=np.float64) for x in (d, a, b, rho)]
+
+    omega = twopi / np.asarray(t, dtype=np.float64)
+    wvno = omega / np.asarray(c, dtype=np.float64)
+    omega = np.broadcast_to(omega, wvno.shape)
+
+    llw = 0 if b[0] <= 0.0 else -1
+
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        if ifunc == 1:
+            return _dltar1_grid(wvno, omega, d, b, rho, llw)
+        else:
+            return _dltar4_grid(wvno, omega, d, a, b, rho, llw)
+
+
+def _grid_modes(t, d, a, b, rho, nmode, ifunc, dc):
+    """
+    Internal: phase velocity of the modes as (nmode, n_periods).
+    """
+    # Search limits as in getc
+    vel = np.where(b > 0.01, b, a)
+    jmn = np.argmin(vel)
+    if b[jmn] > 0.01:
+        cmin = 0.9 * gtsolh(a[jmn], b[jmn])
+    else:
+        cmin = 0.9 * vel[jmn]
+    cmax = np.max(b)
+
+    # The grid ends at cmax (roots above are discarded anyway)
+    c = cmin + dc * np.arange(int(np.ceil((cmax - cmin) / dc)))
+    c = np.append(c[c < cmax], cmax)
+
+    out = np.zeros((nmode, len(t)))
+    block = max(1, GRID_BLOCK // len(c))
+
+    for t0 in range(0, len(t), block):
+        tk = t[t0:t0 + block]
+        dlt = secular_function(tk[:, None], c[None, :], d, a, b, rho, ifunc)
+
+        # All the brackets at once
+        sign = np.sign(dlt)
+        k, j = np.nonzero(sign[:, :-1] * sign[:, 1:] < 0.0)
+
+        root = _refine_roots(tk[k], c[j], c[j + 1], dlt[k, j], dlt[k, j + 1],
+                             d, a, b, rho, ifunc)
+
+        # Rank of each root within its period (brackets are sorted)
+        first = np.searchsorted(k, k)
+        rank = np.arange(len(k)) - first
+        keep = (rank < nmode) & (root <= cmax)
+        out[rank[keep], t0 + k[keep]] = root[keep]
+
+    return out
+
+
+def _refine_roots(t, c1, c2, del1, del2, d, a, b, rho, ifunc, tol=1.0e-10):
+    """
+    Internal: refine bracketed roots by interval halving,
+    all the brackets together, with a final linear interpolation.
+    """
+    c1 = c1.copy()
+    c2 = c2.copy()
+    del1 = del1.copy()
+    del2 = del2.copy()
+
+    while len(c1) and np.any(c2 - c1 > tol * c1):
+        c3 = 0.5 * (c1 + c2)
+        del3 = secular_function(t, c3, d, a, b, rho, ifunc)
+
+        left = np.sign(del3) * np.sign(del1) < 0.0
+        c2 = np.where(left, c3, c2)
+        del2 = np.where(left, del3, del2)
+        c1 = np.where(left, c1, c3)
+        del1 = np.where(left, del1, del3)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        c3 = c1 - del1 * (c2 - c1) / (del2 - del1)
+
+    return np.where((c3 >= c1) & (c3 <= c2), c3, 0.5 * (c1 + c2))
+
+
+def _var_grid(p, ra, wvno, xk, dpth):
+    """
+    Internal: vectorized eigenfunctions of var, for one wave type
+    (cosine, sine / r, r * sine and exponent).
+    """
+    lt = wvno < xk
+    eq = wvno == xk
+
+    fac = np.where(p < 16.0, np.exp(-2.0 * np.minimum(p, 16.0)), 0.0)
+    sinh = (1.0 - fac) * 0.5
+
+    sinp = np.sin(p)
+    cosp = np.where(lt, np.cos(p), np.where(eq, 1.0, (1.0 + fac) * 0.5))
+    w = np.where(lt, sinp / ra, np.where(eq, dpth, sinh / ra))
+    x = np.where(lt, -ra * sinp, np.where(eq, 0.0, ra * sinh))
+    pex = np.where(lt | eq, 0.0, p)
+
+    return cosp, w, x, pex
+
+
+def _dltar1_grid(wvno, omega, d, b, rho, llw):
+    """
+    Internal: vectorized Love-wave period equation (see dltar1).
+    """
+    xkb = omega / b[-1]
+    rb = np.sqrt((wvno + xkb) * np.abs(wvno - xkb))
+    e1 = rho[-1] * rb
+    e2 = np.full(wvno.shape, 1.0 / (b[-1] * b[-1]))
+
+    for m in range(len(d) - 2, llw, -1):
+        xmu = rho[m] * b[m] * b[m]
+        xkb = omega / b[m]
+        rb = np.sqrt((wvno + xkb) * np.abs(wvno - xkb))
+
+        cosq, y, z, _ = _var_grid(rb * d[m], rb, wvno, xkb, d[m])
+
+        e10 = e1 * cosq + e2 * xmu * z
+        e20 = e1 * y / xmu + e2 * cosq
+
+        xnor = np.maximum(np.abs(e10), np.abs(e20))
+        xnor = np.where(xnor < 1.0e-40, 1.0, xnor)
+        e1 = e10 / xnor
+        e2 = e20 / xnor
+
+    return e1
+
+
+def _dltar4_grid(wvno, omega, d, a, b, rho, llw):
+    """
+    Internal: vectorized Rayleigh-wave period equation (see dltar4).
+    """
+    omega = np.maximum(omega, 1.0e-4)
+    wvno2 = wvno * wvno
+    xka = omega / a[-1]
+    xkb = omega / b[-1]
+    ra = np.sqrt((wvno + xka) * np.abs(wvno - xka))
+    rb = np.sqrt((wvno + xkb) * np.abs(wvno - xkb))
+    t = b[-1] / omega
+
+    # E vector for the bottom half-space
+    gammk = 2.0 * t * t
+    gam = gammk * wvno2
+    gamm1 = gam - 1.0
+    rho1 = rho[-1]
+    e = [rho1 * rho1 * (gamm1 * gamm1 - gam * gammk * ra * rb),
+         -rho1 * ra,
+         rho1 * (gamm1 - gammk * ra * rb),
+         rho1 * rb,
+         wvno2 - ra * rb]
+
+    # Matrix multiplication from bottom layer upward
+    for m in range(len(d) - 2, llw, -1):
+        xka = omega / a[m]
+        xkb = omega / b[m]
+        t = b[m] / omega
+        gammk = 2.0 * t * t
+        gam = gammk * wvno2
+        ra = np.sqrt((wvno + xka) * np.abs(wvno - xka))
+        rb = np.sqrt((wvno + xkb) * np.abs(wvno - xkb))
+
+        cosp, w, x, pex = _var_grid(ra * d[m], ra, wvno, xka, d[m])
+        cosq, y, z, sex = _var_grid(rb * d[m], rb, wvno, xkb, d[m])
+
+        exa = pex + sex
+        a0 = np.where(exa < 60.0, np.exp(-np.minimum(exa, 60.0)), 0.0)
+
+        ca = _dnka_grid(wvno2, gam, gammk, rho[m], a0,
+                        cosp * cosq, cosp * y, cosp * z, cosq * w, cosq * x,
+                        x * y, x * z, w * y, w * z)
+
+        ee = [sum(e[j] * ca[j][i] for j in range(5)) for i in range(5)]
+
+        t1 = np.max(np.abs(ee), axis=0)
+        t1 = np.where(t1 < 1.0e-40, 1.0, t1)
+        e = [ei / t1 for ei in ee]
+
+    if llw == 0:
+        xka = omega / a[0]
+        ra = np.sqrt((wvno + xka) * np.abs(wvno - xka))
+        cosp, w, _, _ = _var_grid(ra * d[0], ra, wvno, xka, d[0])
+        return cosp * e[0] - rho[0] * w * e[1]
+
+    return e[0]
+
+
+def _dnka_grid(wvno2, gam, gammk, rho, a0, cpcq, cpy, cpz, cqw, cqx,
+               xy, xz, wy, wz):
+    """
+    Internal: vectorized Dunkin's matrix (see dnka), as nested lists.
+    """
+    gamm1 = gam - 1.0
+    twgm1 = gam + gamm1
+    gmgmk = gam * gammk
+    gmgm1 = gam * gamm1
+    gm1sq = gamm1 * gamm1
+
+    rho2 = rho * rho
+    a0pq = a0 - cpcq
+    t = -2.0 * wvno2
+
+    ca = [[None] * 5 for _ in range(5)]
+
+    ca[0][0] = cpcq - 2.0 * gmgm1 * a0pq - gmgmk * xz - wvno2 * gm1sq * wy
+    ca[0][1] = (wvno2 * cpy - cqx) / rho
+    ca[0][2] = -(twgm1 * a0pq + gammk * xz + wvno2 * gamm1 * wy) / rho
+    ca[0][3] = (cpz - wvno2 * cqw) / rho
+    ca[0][4] = -(2.0 * wvno2 * a0pq + xz + wvno2 * wvno2 * wy) / rho2
+
+    ca[1][0] = (gmgmk * cpz - gm1sq * cqw) * rho
+    ca[1][1] = cpcq
+    ca[1][2] = gammk * cpz - gamm1 * cqw
+    ca[1][3] = -wz
+    ca[1][4] = ca[0][3]
+
+    ca[3][0] = (gm1sq * cpy - gmgmk * cqx) * rho
+    ca[3][1] = -xy
+    ca[3][2] = gamm1 * cpy - gammk * cqx
+    ca[3][3] = ca[1][1]
+    ca[3][4] = ca[0][1]
+
+    ca[4][0] = -(2.0 * gmgmk * gm1sq * a0pq + gmgmk * gmgmk * xz
+                 + gm1sq * gm1sq * wy) * rho2
+    ca[4][1] = ca[3][0]
+    ca[4][2] = -(gammk * gamm1 * twgm1 * a0pq + gam * gammk * gammk * xz
+                 + gamm1 * gm1sq * wy) * rho
+    ca[4][3] = ca[1][0]
+    ca[4][4] = ca[0][0]
+
+    ca[2][0] = t * ca[4][2]
+    ca[2][1] = t * ca[3][2]
+    ca[2][2] = a0 + 2.0 * (cpcq - ca[0][0])
+    ca[2][3] = t * ca[1][2]
+    ca[2][4] = t * ca[0][2]
+
+    return ca
+
+
+def surf96_batch(t, d, a, b, rho, mode=0, itype=0, ifunc=2, dc=0.005,
+                 dt=0.025, workers=None, chunk_size=CHUNK_SIZE):
+    """
+    Get phase or group velocity dispersion curves of many models.
+
+    Models are split in chunks of fixed size, solved serially or
+    in a process pool. The period equation is compiled with Numba
+    when available (see common.jitted), otherwise pure Python is used.
+
+    Parameters
+    ----------
+    t : array_like
+        Periods (in s), common to all models.
+    d : array_like
+        Layer thickness (in km) as (n_models, n_layers).
+    a : array_like
+        Layer P-wave velocity (in km/s) as (n_models, n_layers).
+    b : array_like
+        Layer S-wave velocity (in km/s) as (n_models, n_layers).
+    rho : array_like
+        Layer density (in g/cm3) as (n_models, n_layers).
+    mode, itype, ifunc, dc, dt
+        See surf96.
+    workers : int or None, optional, default None
+        Number of processes (serial if None).
+    chunk_size : int, optional, default 64
+        Number of models per job.
+
+    Returns
+    -------
+    array_like
+        Phase or group velocity as (n_models, n_periods); zero
+        where the mode does not exist.
+
+    Notes
+    -----
+    Models with a different number of layers can be given as lists
+    of 1D arrays.
+
+    """
+    t = np.asarray(t, dtype=np.float64)
+    d, a, b, rho = [_model_array(x) for x in (d, a, b, rho)]
+
+    model_num = len(d)
+    out = np.zeros((model_num, len(t)))
+
+    def jobs():
+        for m0 in range(0, model_num, chunk_size):
+            m1 = min(m0 + chunk_size, model_num)
+            yield (t, d[m0:m1], a[m0:m1], b[m0:m1], rho[m0:m1],
+                   mode, itype, ifunc, dc, dt)
+
+    bounds = range(0, model_num, chunk_size)
+    for m0, c in zip(bounds, run_jobs(_surf96_chunk, jobs(), workers)):
+        out[m0:m0 + len(c)] = c
+
+    return out
+
+
+def surf96_throughput(t, d, a, b, rho, repeat=1, **kwargs):
+    """
+    Benchmark of surf96_batch.
+
+    Parameters
+    ----------
+    t, d, a, b, rho
+        See surf96_batch.
+    repeat : int, optional, default 1
+        Number of timed runs (the fastest is used). A first
+        untimed run on one model triggers the JIT compilation.
+    **kwargs
+        Options of surf96_batch.
+
+    Returns
+    -------
+    scalar
+        Throughput (in models per second).
+
+    """
+    d, a, b, rho = [_model_array(x) for x in (d, a, b, rho)]
+
+    # Warm up (compilation)
+    surf96_batch(t, d[:1], a[:1], b[:1], rho[:1], **kwargs)
+
+    best = np.inf
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        surf96_batch(t, d, a, b, rho, **kwargs)
+        best = min(best, time.perf_counter() - t0)
+
+    return len(d) / best
+
+
+def _model_array(x):
+    """
+    Internal: models as a (n_models, n_layers) array, or as a list
+    of 1D arrays if the number of layers is not constant.
+    """
+    if isinstance(x, np.ndarray):
+        return np.atleast_2d(np.asarray(x, dtype=np.float64))
+
+    x = [np.asarray(xi, dtype=np.float64) for xi in x]
+    if len(set(len(xi) for xi in x)) == 1:
+        return np.array(x)
+
+    return x
+
+
+def _surf96_chunk(t, d, a, b, rho, mode, itype, ifunc, dc, dt):
+    """
+    Internal: dispersion curves of a chunk of models.
+    """
+    out = np.zeros((len(d), len(t)))
+
+    for i in range(len(d)):
+        out[i] = surf96(t, d[i], a[i], b[i], rho[i],
+                        mode, itype, ifunc, dc, dt)
+
+    return out
+
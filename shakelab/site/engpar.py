@@ -23,7 +23,6 @@ soil parameters, such as travel-time average velocity and site kappa.
 """
 
 import numpy as _np
-import scipy.optimize as _spo
 
 
 def depth_weighted_average(thickness, soil_param, depth):
@@ -31,33 +30,50 @@ def depth_weighted_average(thickness, soil_param, depth):
     Compute the weighted average of a soil property at
     arbitrary depth.
 
+    The integral of the property is accumulated at the layer
+    interfaces, so that many depths and many profiles are averaged
+    at once by searching the interface depths.
+
     :param numpy.array tickness:
-        array of layer's thicknesses in meters (half-space is 0.)
+        array of layer's thicknesses in meters (half-space is 0.);
+        multiple profiles with the same number of layers can be
+        given as (n_models, n_layers) arrays
 
     :param numpy.array soil_param:
         array of soil properties (e.g. slowness, density)
 
-    :param float depth:
-        averaging depth in meters
+    :param float or numpy.array depth:
+        averaging depth(s) in meters
 
-    :return float mean_param:
-        the weighted mean of the given soil property
+    :return float or numpy.array mean_param:
+        the weighted mean of the given soil property, with shape
+        (n_models, n_depths) for multiple profiles and depths
+        (single dimensions are dropped)
     """
 
-    mean_param = 0
-    total_depth = 0
+    single = _np.ndim(thickness) == 1
+    scalar = _np.ndim(depth) == 0
 
-    for tk, sp in zip(thickness[:-1], soil_param[:-1]):
-        if (tk + total_depth) < depth:
-            mean_param += tk*sp/depth
-        else:
-            mean_param += (depth - total_depth)*sp/depth
-            break
-        total_depth += tk
+    thickness = _np.atleast_2d(_np.asarray(thickness, dtype=float))
+    soil_param = _np.atleast_2d(_np.asarray(soil_param, dtype=float))
+    depth = _np.atleast_1d(_np.asarray(depth, dtype=float))
+
+    ztop = _cumulative_top(thickness, _np.ones_like(thickness))
+    ptop = _cumulative_top(thickness, soil_param)
+
+    depth = _np.broadcast_to(depth, (len(ztop), depth.shape[-1]))
 
-    # Check for the half-space
-    if total_depth == _np.sum(thickness[:-1]):
-        mean_param += (depth - total_depth)*soil_param[-1]/depth
+    # Layer containing each averaging depth
+    idx = _search_rows(ztop, depth)
+
+    mean_param = (_np.take_along_axis(ptop, idx, 1)
+                  + (depth - _np.take_along_axis(ztop, idx, 1))
+                  * _np.take_along_axis(soil_param, idx, 1))/depth
+
+    if scalar:
+        mean_param = mean_param[:, 0]
+    if single:
+        mean_param = mean_param[0]
 
     return mean_param
 
@@ -68,21 +84,23 @@ def traveltime_velocity(thickness, s_velocity, depth=30):
     velocity at arbitrary depth (e.g. the widespread Vs30).
 
     :param numpy.array tickness:
-        array of layer's thicknesses in meters (half-space is 0.)
+        array of layer's thicknesses in meters (half-space is 0.);
+        (n_models, n_layers) for multiple profiles
 
     :param numpy.array s_velocity:
         array of layer's shear-wave velocities in m/s
 
-    :param float depth:
-        averaging depth in meters; if depth is not specified,
+    :param float or numpy.array depth:
+        averaging depth(s) in meters; if depth is not specified,
         depth is fixed to 30m
 
-    :return float mean_velocity:
-        the average velocity in m/s
+    :return float or numpy.array mean_velocity:
+        the average velocity in m/s (see depth_weighted_average
+        for the shape)
     """
 
     # Converting velocity to slowness
-    slowness = 1./s_velocity
+    slowness = 1./_np.asarray(s_velocity, dtype=float)
 
     # Harmonic averaging is done in slowness
     mean_slowness = depth_weighted_average(thickness, slowness, depth)
@@ -99,7 +117,8 @@ def compute_site_kappa(thickness, s_velocity, s_quality, depth=None):
     for a given soil profile at arbitrary depth.
 
     :param numpy.array tickness:
-        array of layer's thicknesses in meters (half-space is 0.)
+        array of layer's thicknesses in meters (half-space is 0.);
+        (n_models, n_layers) for multiple profiles
 
     :param numpy.array s_velocity:
         array of layer's shear-wave velocities in m/s
@@ -107,23 +126,26 @@ def compute_site_kappa(thickness, s_velocity, s_quality, depth=None):
     :param numpy.array s_quality:
         array of layer's shear-wave quality factors (adimensional)
 
-    :param float depth:
-        averaging depth in meters; if depth is not specified,
-        the last layer interface is used instead
+    :param float or numpy.array depth:
+        averaging depth(s) in meters; if depth is not specified,
+        the last layer interface of each profile is used instead
 
-    :return float kappa0:
+    :return float or numpy.array kappa0:
         the site attenuation parameter kappa(0) in seconds
     """
 
+    thickness = _np.asarray(thickness, dtype=float)
+
+    # Kappa is the integral of 1/(Vs*Qs) over depth
+    layer_kappa = 1./(_np.asarray(s_velocity, dtype=float)
+                      * _np.asarray(s_quality, dtype=float))
+
     # If depth not given, using the whole profile
     if depth is None:
-        depth = _np.sum(thickness)
-
-    # Kappa vector
-    layer_kappa = depth/(s_velocity*s_quality)
+        return _np.sum(thickness*layer_kappa, axis=-1)
 
-    # Computing the average kappa of the profile
     kappa0 = depth_weighted_average(thickness, layer_kappa, depth)
+    kappa0 *= _np.asarray(depth, dtype=float)
 
     return kappa0
 
@@ -133,8 +155,17 @@ def quarter_wavelength_average(thickness, s_velocity, density, frequency):
     This function solves the quarter-wavelength problem (Boore 2003)
     and return the frequency-dependent average velocity and density
 
+    The quarter-wavelength depth is that where the travel time
+    equals 1/(4f). Travel time is piecewise linear with depth, so
+    the solution is exact: the layer containing the depth is found
+    by searching the cumulative travel time at the interfaces, and
+    the depth is then obtained by linear interpolation within
+    the layer.
+
     :param numpy.array tickness:
-        array of layer's thicknesses in meters (half-space is 0.)
+        array of layer's thicknesses in meters (half-space is 0.);
+        multiple profiles with the same number of layers can be
+        given as (n_models, n_layers) arrays
 
     :param numpy.array s_velocity:
         array of layer's shear-wave velocities in m/s
@@ -146,7 +177,7 @@ def quarter_wavelength_average(thickness, s_velocity, density, frequency):
         array of frequencies in Hz for the calculation
 
     :return numpy.array qwl_depth:
-        array of averaging depths
+        array of averaging depths, (n_freq,) or (n_models, n_freq)
 
     :return numpy.array qwl_velocity:
         array of quarter-wavelength average velocities
@@ -155,51 +186,84 @@ def quarter_wavelength_average(thickness, s_velocity, density, frequency):
         array of quarter-wavelength average dencities
     """
 
-    # Initialisation
-    freq_num = len(frequency)
-    slowness = 1./s_velocity
+    frequency = _np.asarray(frequency, dtype=float)
+    single = _np.ndim(thickness) == 1
 
-    qwl_depth = _np.zeros(freq_num)
-    qwl_velocity = _np.zeros(freq_num)
-    qwl_density = _np.zeros(freq_num)
+    thickness = _np.atleast_2d(_np.asarray(thickness, dtype=float))
+    s_velocity = _np.atleast_2d(_np.asarray(s_velocity, dtype=float))
+    density = _np.atleast_2d(_np.asarray(density, dtype=float))
 
-    for nf in range(freq_num):
+    # Depth, travel time and cumulative density at the layer tops
+    ztop, ttop = _interface_times(thickness, s_velocity)
+    dtop = _cumulative_top(thickness, density)
 
-        # Upper depth bound for the search
-        ubnd = _np.max(1./(4.*frequency[nf]*slowness))
+    # Target travel time
+    qwl_time = _np.broadcast_to(1./(4.*frequency),
+                                (len(ztop), len(frequency)))
 
-        # Input arguments for the search function
-        args = (thickness, slowness, frequency[nf])
+    # Layer containing the quarter-wavelength depth
+    idx = _search_rows(ttop, qwl_time)
 
-        # Compute the quarter-wavelength depth
-        qwl_depth[nf] = _spo.fminbound(_qwl_fit_func, 0., ubnd, args)
+    qwl_depth = (_np.take_along_axis(ztop, idx, 1)
+                 + (qwl_time - _np.take_along_axis(ttop, idx, 1))
+                 * _np.take_along_axis(s_velocity, idx, 1))
 
-        # Computing average soil property at the qwl-depth
-        qwl_velocity[nf] = 1./depth_weighted_average(thickness,
-                                                     slowness,
-                                                     qwl_depth[nf])
+    qwl_velocity = qwl_depth/qwl_time
 
-        # Computing average soil property at the qwl-depth
-        qwl_density[nf] = depth_weighted_average(thickness,
-                                                 density,
-                                                 qwl_depth[nf])
+    qwl_density = (_np.take_along_axis(dtop, idx, 1)
+                   + (qwl_depth - _np.take_along_axis(ztop, idx, 1))
+                   * _np.take_along_axis(density, idx, 1))/qwl_depth
+
+    if single:
+        return qwl_depth[0], qwl_velocity[0], qwl_density[0]
 
     return qwl_depth, qwl_velocity, qwl_density
 
 
-def _qwl_fit_func(search_depth, thickness, slowness, frequency):
+def _interface_times(thickness, s_velocity):
     """
-    Internal function to recursively search for the qwl depth.
+    Internal: depth and vertical travel time at the top of each
+    layer, as (n_models, n_layers) arrays.
     """
 
-    qwl_slowness = depth_weighted_average(thickness,
-                                          slowness,
-                                          search_depth)
+    ztop = _cumulative_top(thickness, _np.ones_like(thickness))
+    ttop = _cumulative_top(thickness, 1./s_velocity)
+
+    return ztop, ttop
+
+
+def _cumulative_top(thickness, soil_param):
+    """
+    Internal: integral of a soil property from the surface to the
+    top of each layer (the half-space thickness is ignored).
+    """
+
+    csum = _np.cumsum(thickness[:, :-1]*soil_param[:, :-1], axis=1)
+
+    return _np.concatenate((_np.zeros((len(thickness), 1)), csum), axis=1)
+
+
+def _search_rows(bounds, values):
+    """
+    Internal: for each row, index of the last (non-decreasing) bound
+    not greater than the values, i.e. a row-wise searchsorted
+    (side='right') minus one.
+    """
+
+    rows, cols = bounds.shape
+
+    # Undefined profiles (e.g. NaN) must not break the ordering
+    bounds = _np.maximum.accumulate(_np.nan_to_num(bounds), axis=1)
+
+    # Rows are shifted apart to be searched at once
+    span = _np.nanmax(_np.abs(bounds)) + _np.nanmax(_np.abs(values)) + 1.
+    offset = span*2.*_np.arange(rows)[:, None]
 
-    # Misfit is computed as a simple L1 norm
-    misfit = _np.abs(search_depth - (1./(4.*frequency*qwl_slowness)))
+    idx = _np.searchsorted((bounds + offset).ravel(),
+                           (values + offset).ravel(), side='right')
+    idx = idx.reshape(values.shape) - cols*_np.arange(rows)[:, None] - 1
 
-    return misfit
+    return _np.clip(idx, 0, cols - 1)
 
 
 def soil_class(vs30, code='EC8'):
@@ -4,8 +4,10 @@
 # This file is part of ShakeLab.
 # Last modified: 22/7/2022
 #
-# NOTE: this is a direct porting from the original fortran 77, therefore
-# little optimisation is done (e.g. no vectorisation)
+# NOTE: hassh and haspsv are a direct porting from the original fortran 77,
+# therefore little optimisation is done (e.g. no vectorisation).
+# hassh_batch and haspsv_batch are the equivalent solvers vectorised
+# over frequency, used by psvq_soil_response.
 # ****************************************************************************
 
 import numpy as np
@@ -16,38 +18,23 @@ def psvq_soil_response(freq, hl, vp, vs, dn, qp, qs, iwave='sh', iangle=0.):
     """
     Generic interface to PSVQ functions.
     """
-    lnum = len(hl)
-    fnum = len(freq)
-    
     if iwave == 'sh':
-        sh_h = np.zeros((lnum, fnum), dtype=complex)
-
-        for i in range(fnum):
-
-            oh = hassh(freq[i], hl, vs, dn, qs, iangle)
-            sh_h[:, i] = oh.conj()
+        oh = hassh_batch(freq, hl, vs, dn, qs, iangle)
+        sh_h = oh.T.conj()
 
         return sh_h
 
     elif iwave == 'p':
-        p_h = np.zeros((lnum, fnum), dtype=complex)
-        p_v = np.zeros((lnum, fnum), dtype=complex)
-
-        for i in range(fnum):
-            ov, oh = haspsv(freq[i], hl, vp, vs, dn, qp, qs, 1, iangle)
-            p_v[:, i] = ov.conj()
-            p_h[:, i] = oh.conj()
+        ov, oh = haspsv_batch(freq, hl, vp, vs, dn, qp, qs, 1, iangle)
+        p_v = ov.T.conj()
+        p_h = oh.T.conj()
 
         return p_v, p_h
 
     elif iwave == 'sv':
-        sv_h = np.zeros((lnum, fnum), dtype=complex)
-        sv_v = np.zeros((lnum, fnum), dtype=complex)
-
-        for i in range(fnum):
-            ov, oh = haspsv(freq[i], hl, vp, vs, dn, qp, qs, 2, iangle)
-            sv_v[:, i] = ov.conj()
-            sv_h[:, i] = oh.conj()
+        ov, oh = haspsv_batch(freq, hl, vp, vs, dn, qp, qs, 2, iangle)
+        sv_v = ov.T.conj()
+        sv_h = oh.T.conj()
 
         return sv_v, sv_h
 
@@ -378,4 +365,240 @@ def haspsv(FREQ, H, ALPHA, BETA, RHO, QP, QS, IWAVE='sh', GAMMA=0., POL=90., IDT
         DESF[2] = CAUX[2]
         DESF[3] = CAUX[3]
 
-    return US, WS
\ No newline at end of file
+    return US, WS
+
+def hassh_batch(FREQ, H, BETA, RHO, QS, GAMMA=0., POL=0., IDT=-1):
+    """
+    Same as hassh, but vectorised over an array of frequencies.
+    Layer matrices of all frequencies are stacked as (n_freq, 2, 2)
+    arrays and propagated with batched matrix products.
+
+    OUTPUT
+        VS : complex displacement as (n_freq, n_layers)
+    """
+    FREQ = np.atleast_1d(np.asarray(FREQ, dtype=float))
+    NE = len(BETA) - 1
+    NF = len(FREQ)
+
+    GAMMA = GAMMA*np.pi/180.
+    POL = POL*np.pi/180.
+    if np.abs(np.cos(POL)) < 0.001:
+        raise ValueError("Polarization angle too large")
+
+    OMEGA = np.maximum(FREQ*2.0*np.pi, 0.001)
+
+    AK = OMEGA/BETA[NE]*cm.sin(GAMMA)
+    ETHS = OMEGA/BETA[NE]*cm.cos(GAMMA)
+    CAMUHS = RHO[NE]*BETA[NE]**2
+
+    CBETA = _complex_velocity(BETA, QS, NE)
+    CAMUE = np.asarray(RHO[:NE], dtype=float)*CBETA**2
+    HL = np.asarray(H[:NE], dtype=float)[:, None]
+
+    # Layer matrices as (layer, freq, 2, 2)
+    ET = (OMEGA[None, :]/CBETA[:, None])**2 - AK[None, :]**2
+    ET = np.sqrt(ET.astype(complex))
+    ET = np.where(np.imag(ET) < 0, -ET, ET)
+    ET = ET*HL
+
+    PSH = np.empty((NE, NF, 2, 2), dtype=complex)
+    PSH[..., 0, 0] = np.cos(ET)
+    PSH[..., 0, 1] = np.sin(ET)/ET/CAMUE[:, None]*HL
+    PSH[..., 1, 0] = -np.sin(ET)*ET*CAMUE[:, None]/HL
+    PSH[..., 1, 1] = PSH[..., 0, 0]
+
+    A = _matrix_chain(PSH, NF, 2)
+
+    VS = np.zeros((NF, NE+1), dtype=complex)
+
+    if IDT == -1:
+        VS[:, 0] = 2.0/(A[:, 0, 0]+1j*A[:, 1, 0]/CAMUHS/ETHS)
+    if IDT == 1:
+        VS[:, 0] = 2.0/(A[:, 0, 0]-1j*A[:, 1, 0]/CAMUHS/ETHS)
+
+    VS[:, 0] *= cm.cos(POL)
+
+    # Downward propagation of (displacement, stress)
+    STATE = np.zeros((NF, 2), dtype=complex)
+    STATE[:, 0] = VS[:, 0]
+
+    for IE in range(NE):
+        STATE = np.einsum('fij,fj->fi', PSH[IE], STATE)
+        VS[:, IE+1] = STATE[:, 0]
+
+    return VS
+
+
+def haspsv_batch(FREQ, H, ALPHA, BETA, RHO, QP, QS, IWAVE=1, GAMMA=0.,
+                 POL=90., IDT=1):
+    """
+    Same as haspsv, but vectorised over an array of frequencies.
+    Layer matrices of all frequencies are stacked as (n_freq, 4, 4)
+    arrays and propagated with batched matrix products.
+
+    OUTPUT
+        US : complex HORIZONTAL displacement as (n_freq, n_layers)
+        WS : complex VERTICAL displacement as (n_freq, n_layers)
+    """
+    FREQ = np.atleast_1d(np.asarray(FREQ, dtype=float))
+    NE = len(BETA) - 1
+    NF = len(FREQ)
+
+    GAMMA = GAMMA*np.pi/180.
+    POL = POL*np.pi/180.
+    if np.abs(np.sin(POL)) < 0.001:
+        raise ValueError("Polarization angle too large")
+
+    OMEGA = np.maximum(FREQ*2.0*np.pi, 0.001)
+
+    OMEGA2 = OMEGA*OMEGA
+    CBETHS = BETA[NE]
+    CALFHS = ALPHA[NE]
+    CAMUHS = CBETHS*CBETHS*RHO[NE]
+
+    if IWAVE == 1:
+        K = OMEGA*cm.sin(GAMMA)/CALFHS
+    if IWAVE == 2:
+        K = OMEGA*cm.sin(GAMMA)/CBETHS
+    K2 = K*K
+
+    # Layer parameters as (layer, freq)
+    CALFE = _complex_velocity(ALPHA, QP, NE)[:, None]
+    CBETE = _complex_velocity(BETA, QS, NE)[:, None]
+    DN = np.asarray(RHO[:NE], dtype=float)[:, None]
+    HL = np.asarray(H[:NE], dtype=float)[:, None]
+
+    CAMU = DN*CBETE*CBETE
+    GAMA = np.sqrt(K2-OMEGA2/CALFE/CALFE)
+    NU = np.sqrt(K2-OMEGA2/CBETE/CBETE)
+    KMNU = K2+NU*NU
+    FAC1 = 1.0/(OMEGA2*DN)+0.0*1j
+    FAC2 = FAC1*CAMU
+    KAPA = GAMA*HL/2.0
+    SEN1 = ((np.exp(KAPA)-np.exp(-KAPA))/2.0)**2
+    PSI = NU*HL/2.0
+    SEN2 = ((np.exp(PSI)-np.exp(-PSI))/2.0)**2
+    KAPA = GAMA*HL
+    SEN3 = (np.exp(KAPA)-np.exp(-KAPA))/2.0
+    PSI = NU*HL
+    SEN4 = (np.exp(PSI)-np.exp(-PSI))/2.0
+
+    P = np.empty((NE, NF, 4, 4), dtype=complex)
+    P[..., 0, 0] = 1.0+2.0*FAC2*(2.0*K2*SEN1-KMNU*SEN2)
+    P[..., 0, 1] = K*FAC2*(KMNU*SEN3/GAMA-2.0*NU*SEN4)
+    P[..., 0, 2] = FAC1*(K2*SEN3/GAMA-NU*SEN4)
+    P[..., 0, 3] = 2.0*K*FAC1*(SEN1-SEN2)
+    P[..., 1, 0] = K*FAC2*(KMNU*SEN4/NU-2.0*GAMA*SEN3)
+    P[..., 1, 1] = 1.0+2.0*FAC2*(2.0*K2*SEN2-KMNU*SEN1)
+    P[..., 1, 2] = -P[..., 0, 3]
+    P[..., 1, 3] = FAC1*(K2*SEN4/NU-GAMA*SEN3)
+    P[..., 2, 0] = CAMU*FAC2*(4.0*K2*GAMA*SEN3-KMNU*KMNU*SEN4/NU)
+    P[..., 2, 1] = 2.0*CAMU*CAMU*KMNU*P[..., 0, 3]
+    P[..., 2, 2] = P[..., 0, 0]
+    P[..., 2, 3] = -P[..., 1, 0]
+    P[..., 3, 0] = -P[..., 2, 1]
+    P[..., 3, 1] = CAMU*FAC2*(4.0*K2*NU*SEN4-KMNU*KMNU*SEN3/GAMA)
+    P[..., 3, 2] = -P[..., 0, 1]
+    P[..., 3, 3] = P[..., 1, 1]
+
+    A = _matrix_chain(P, NF, 4)
+
+    # Half-space
+    if IWAVE == 1:
+        GAMA = -1j*OMEGA*cm.cos(GAMMA)/CALFHS
+        SENGAS = CBETHS*cm.sin(GAMMA)/CALFHS
+        SENGAS = cm.sqrt(1.0-SENGAS*SENGAS)
+        NU = -1j*OMEGA*SENGAS/CBETHS
+
+    if IWAVE == 2:
+        NU = -1j*OMEGA*cm.cos(GAMMA)/CBETHS
+        SENGAS = CALFHS*cm.sin(GAMMA)/CBETHS
+        SENGAS = cm.sqrt(1.0-SENGAS*SENGAS)
+        GAMA = -1j*OMEGA*SENGAS/CALFHS
+
+    KMNU = K2+NU*NU
+
+    FAC = CBETHS/(2.0*CALFHS*CAMUHS*GAMA*NU*OMEGA)
+
+    E = np.zeros((NF, 4, 4), dtype=complex)
+    E[:, 0, 0] = FAC
+    E[:, 1, 1] = -1j*FAC
+    E[:, 2, 2] = FAC
+    E[:, 3, 3] = -1j*FAC
+
+    F = np.empty((NF, 4, 4), dtype=complex)
+    F[:, 0, 0] = 2.0*CBETHS*CAMUHS*K*GAMA*NU
+    F[:, 0, 1] = -CBETHS*CAMUHS*NU*KMNU
+    F[:, 0, 2] = -CBETHS*K*NU
+    F[:, 0, 3] = CBETHS*GAMA*NU
+    F[:, 1, 0] = -CALFHS*CAMUHS*GAMA*KMNU
+    F[:, 1, 1] = 2.0*CALFHS*CAMUHS*K*GAMA*NU
+    F[:, 1, 2] = CALFHS*GAMA*NU
+    F[:, 1, 3] = -CALFHS*K*GAMA
+    F[:, 2, 0] = 2.0*CBETHS*CAMUHS*K*GAMA*NU
+    F[:, 2, 1] = CBETHS*CAMUHS*NU*KMNU
+    F[:, 2, 2] = CBETHS*K*NU
+    F[:, 2, 3] = CBETHS*GAMA*NU
+    F[:, 3, 0] = -CALFHS*CAMUHS*GAMA*KMNU
+    F[:, 3, 1] = -2.0*CALFHS*CAMUHS*K*GAMA*NU
+    F[:, 3, 2] = -CALFHS*GAMA*NU
+    F[:, 3, 3] = -CALFHS*K*GAMA
+
+    C = E @ F @ A
+
+    if IWAVE == 1:
+        DEN = C[:, 3, 0]*C[:, 2, 1]-C[:, 2, 0]*C[:, 3, 1]
+        UZ = -C[:, 3, 1]/DEN
+        WZ = C[:, 3, 0]*1j/DEN
+
+    if IWAVE == 2:
+        DEN = C[:, 3, 1]*C[:, 2, 0]-C[:, 3, 0]*C[:, 2, 1]
+        UZ = -C[:, 2, 1]/DEN
+        WZ = C[:, 2, 0]*1j/DEN
+
+    US = np.zeros((NF, NE+1), dtype=complex)
+    WS = np.zeros((NF, NE+1), dtype=complex)
+
+    US[:, 0] = UZ*cm.sin(POL)
+    WS[:, 0] = WZ*cm.sin(POL)
+
+    # Downward propagation of (displacements, stresses)
+    DESF = np.zeros((NF, 4), dtype=complex)
+    DESF[:, 0] = US[:, 0]
+    DESF[:, 1] = WS[:, 0]/1j
+
+    for IE in range(NE):
+        DESF = np.einsum('fij,fj->fi', P[IE], DESF)
+        US[:, IE+1] = DESF[:, 0]
+        WS[:, IE+1] = DESF[:, 1]*1j
+
+    return US, WS
+
+
+def _complex_velocity(V, Q, NE):
+    """
+    Internal: complex velocities of the layers (no attenuation
+    where the quality factor is not given).
+    """
+    CV = np.empty(NE, dtype=complex)
+
+    for J in range(NE):
+        if Q is None or Q[J] is None:
+            CV[J] = V[J]
+        else:
+            CV[J] = V[J]/(1.+0.5*1j/Q[J])
+
+    return CV
+
+
+def _matrix_chain(P, NF, NM):
+    """
+    Internal: product of the layer matrices from the bottom to the
+    top layer (P[NE-1] @ ... @ P[0]), for all frequencies at once.
+    """
+    A = np.broadcast_to(np.eye(NM, dtype=complex), (NF, NM, NM))
+
+    for N in range(len(P)-1, -1, -1):
+        A = A @ P[N]
+
+    return A
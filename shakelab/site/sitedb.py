@@ -22,14 +22,19 @@ Module containing the database classes to handle site information.
 """
 
 import numpy as _np
-import scipy as _scp
-import openquake.srtk.soil as _avg
-import openquake.srtk.response as _amp
-import openquake.srtk.utils as _ut
+import scipy.spatial as _spa
+import scipy.interpolate as _ipl
+import shakelab.site.engpar as _avg
+import shakelab.site.response as _amp
+import shakelab.signals.fourier as _fou
+import shakelab.libutils.utils as _ut
 
 # Precision for decimal rounding
 DECIMALS = 6
 
+# Number of grid nodes interpolated (or exported) at once
+GRID_CHUNK = 2**18
+
 # Parameters keys
 GEO_KEYS = ['hl', 'vp', 'vs', 'dn', 'qp', 'qs']
 ENG_KEYS = ['vsz', 'qwl', 'kappa', 'class', 'weight']
@@ -334,13 +339,21 @@ class Site1D(object):
         if not isinstance(depth, list):
             depth = [depth]
 
-        for mod in self.model:
+        # All models and depths at once (if same number of layers)
+        if self._same_layers():
+            vz_all = _avg.traveltime_velocity(self._geo_array('hl'),
+                                              self._geo_array('vs'),
+                                              depth)
+        else:
+            vz_all = [_avg.traveltime_velocity(mod.geo['hl'],
+                                               mod.geo['vs'],
+                                               depth)
+                      for mod in self.model]
+
+        for mod, vz_mod in zip(self.model, vz_all):
             mod.eng['vsz'] = {}
-            for z in depth:
-                vz = _avg.traveltime_velocity(mod.geo['hl'],
-                                              mod.geo['vs'],
-                                              depth=z)
-                mod.eng['vsz'][z] = _ut.a_round(vz, DECIMALS)
+            for z, vz in zip(depth, vz_mod):
+                mod.eng['vsz'][z] = _ut.a_round(float(vz), DECIMALS)
 
         # Perform statistics (log-normal)
         self.mean.eng['vsz'] = {}
@@ -350,6 +363,22 @@ class Site1D(object):
             self.mean.eng['vsz'][z] = (_ut.a_round(mn, DECIMALS),
                                        _ut.a_round(sd, DECIMALS))
 
+    def _same_layers(self):
+        """
+        Internal: check if all the models have the same number of
+        layers (and can then be processed as a single array)
+        """
+
+        return len(set(len(mod.geo['hl']) for mod in self.model)) == 1
+
+    def _geo_array(self, key):
+        """
+        Internal: soil parameter of all the models as
+        (n_models, n_layers) array
+        """
+
+        return _np.array([mod.geo[key] for mod in self.model], dtype=float)
+
     def compute_soil_class(self, code='EC8'):
         """
         Compute geotechnical classification according to specified
@@ -363,12 +392,12 @@ class Site1D(object):
         try:
             # Class from the mean Vs30 model
             vs30 = self.mean.eng['vsz'][30.][0]
-            self.mean.eng['class'] = _avg.gt_soil_class(vs30, code)
+            self.mean.eng['class'] = _avg.soil_class(vs30, code)
 
             # Class of each profile
             for mod in self.model:
                 vs30 = mod.eng['vsz'][30.]
-                mod.eng['class'] = _avg.gt_soil_class(vs30, code)
+                mod.eng['class'] = _avg.soil_class(vs30, code)
 
         except:
             print('Error: Vs30 must be calculated first')
@@ -392,7 +421,7 @@ class Site1D(object):
             (default is logarithmic)
         """
 
-        self.freq = _amp.frequency_axis(fmin, fmax, fnum, log)
+        self.freq = _fou.frequency_range(fmin, fmax, fnum, log)
 
     def _check_frequency(self):
         """
@@ -410,13 +439,25 @@ class Site1D(object):
 
         self._check_frequency()
 
-        for mod in self.model:
+        # Models with the same number of layers are solved at once
+        if self._same_layers():
+            qwl_all = _avg.quarter_wavelength_average(self._geo_array('hl'),
+                                                      self._geo_array('vs'),
+                                                      self._geo_array('dn'),
+                                                      self.freq)
+        else:
+            qwl_all = None
+
+        for i, mod in enumerate(self.model):
 
             # Compute average velocity
-            qwl_par = _avg.quarter_wavelength_average(mod.geo['hl'],
-                                                      mod.geo['vs'],
-                                                      mod.geo['dn'],
-                                                      self.freq)
+            if qwl_all is not None:
+                qwl_par = [par[i] for par in qwl_all]
+            else:
+                qwl_par = _avg.quarter_wavelength_average(mod.geo['hl'],
+                                                          mod.geo['vs'],
+                                                          mod.geo['dn'],
+                                                          self.freq)
 
             mod.eng['qwl'] = {}
             mod.eng['qwl']['z'] = _ut.a_round(qwl_par[0], DECIMALS)
@@ -452,16 +493,14 @@ class Site1D(object):
 
         for mod in self.model:
 
-            if _ut.is_empty(vs_ref):
-                vs_ref = mod.geo['vs'][-1]
-
-            if _ut.is_empty(dn_ref):
-                dn_ref = mod.geo['dn'][-1]
+            # Reference of each model (if not given)
+            mod_vs = mod.geo['vs'][-1] if _ut.is_empty(vs_ref) else vs_ref
+            mod_dn = mod.geo['dn'][-1] if _ut.is_empty(dn_ref) else dn_ref
 
             qwl_amp = _amp.impedance_amplification(mod.eng['qwl']['vs'],
                                                    mod.eng['qwl']['dn'],
-                                                   vs_ref,
-                                                   dn_ref,
+                                                   mod_vs,
+                                                   mod_dn,
                                                    inc_ang)
 
             mod.amp['qwl'] = _ut.a_round(qwl_amp, DECIMALS)
@@ -482,15 +521,24 @@ class Site1D(object):
             averaging depth in meters (optional)
         """
 
-        for mod in self.model:
+        if _ut.is_empty(depth):
+            depth = None
 
-            # Compute kappa attenuation
-            kappa = _avg.compute_site_kappa(mod.geo['hl'],
-                                            mod.geo['vs'],
-                                            mod.geo['qs'],
-                                            depth)
+        # Compute kappa attenuation (at once if same number of layers)
+        if self._same_layers():
+            kappa_all = _avg.compute_site_kappa(self._geo_array('hl'),
+                                                self._geo_array('vs'),
+                                                self._geo_array('qs'),
+                                                depth)
+        else:
+            kappa_all = [_avg.compute_site_kappa(mod.geo['hl'],
+                                                 mod.geo['vs'],
+                                                 mod.geo['qs'],
+                                                 depth)
+                         for mod in self.model]
 
-            mod.eng['kappa'] = _ut.a_round(kappa, DECIMALS)
+        for mod, kappa in zip(self.model, kappa_all):
+            mod.eng['kappa'] = _ut.a_round(float(kappa), DECIMALS)
 
         # Perform statistics (normal)
         data = [mod.eng['kappa'] for mod in self.model]
@@ -601,6 +649,7 @@ class Grid2D(object):
         self.gy = 0
         self.gz = 0.
 
+        self.data = None
         self._geo_init()
 
     def _geo_init(self):
@@ -630,46 +679,115 @@ class Grid2D(object):
         y = _np.arange(ylim[0], ylim[1]+dy, dy)
         self.gx, self.gy = _np.meshgrid(x, y)
 
-    def import_sites(self, site_list, method='cubic'):
+    def import_sites(self, site_list, method='cubic', memmap=None):
         """
         Import a list of 1D sites and perform inetrpolation
         of the (mean) models ober the 2D grid
         Note: All sites must have the same number of layers
 
+        The triangulation of the sites is computed once and shared
+        by topography and all the soil parameters, which are
+        interpolated together by chunks of grid rows. Parameters are
+        stored in a single float32 array (key, layer, ny, nx), also
+        accessible per key through the geo dictionary.
+
         :param list site_list:
             list of Site1D objects
 
         :param string method:
             interpolation method (default is cubic)
-        """
 
-        self._geo_init()
+        :param string memmap:
+            optional file name to store the parameter array
+            as a memory map
+        """
 
         # Extracting coordinates form know points
-        h_crd = []
-        v_crd = []
-        for site in site_list:
-            h_crd.append((site.head['x'], site.head['y']))
-            v_crd.append(site.head['z'])
-
-        # Interpolating topography
-        self.gz = _scp.interpolate.griddata(h_crd,
-                                            v_crd,
-                                            (self.gx, self.gy),
-                                            method=method,
-                                            rescale=True)
-
-        # Model interpolation
+        h_crd = _np.array([(site.head['x'], site.head['y'])
+                           for site in site_list], dtype=float)
+
+        # Values of all keys and layers as (n_sites, n_values)
+        values = [[site.head['z']] for site in site_list]
         for k in GEO_KEYS:
-            model = [s.mean.geo[k][0] for s in site_list]
+            for v, site in zip(values, site_list):
+                v.extend(site.mean.geo[k][0])
+        values = _np.array(values, dtype=float)
+
+        layer_num = (values.shape[1] - 1) // len(GEO_KEYS)
+        shape = (len(GEO_KEYS), layer_num) + _np.shape(self.gx)
+
+        if memmap is None:
+            self.data = _np.empty(shape, dtype=_np.float32)
+        else:
+            self.data = _np.lib.format.open_memmap(memmap, mode='w+',
+                                                   dtype=_np.float32,
+                                                   shape=shape)
+        self.gz = _np.empty(_np.shape(self.gx))
+
+        interp = _GridInterpolator(h_crd, values, method)
 
-            for layer in _np.array(model).T:
-                data = _scp.interpolate.griddata(h_crd,
-                                                 layer,
-                                                 (self.gx, self.gy),
-                                                 method=method,
-                                                 rescale=True)
-                self.geo[k].append(data)
+        ny = _np.shape(self.gx)[0]
+        step = max(1, GRID_CHUNK // max(_np.size(self.gx) // ny, 1))
+
+        for j0 in range(0, ny, step):
+            j1 = min(j0 + step, ny)
+            out = interp(self.gx[j0:j1], self.gy[j0:j1])
+
+            self.gz[j0:j1] = out[..., 0]
+            self.data[:, :, j0:j1] = _np.moveaxis(
+                out[..., 1:].reshape(out.shape[:2] + shape[:2]), (2, 3),
+                (0, 1))
+
+        self._geo_init()
+        for n, k in enumerate(GEO_KEYS):
+            self.geo[k] = self.data[n]
+
+    def traveltime_velocity(self, depth=30.):
+        """
+        Map of the travel-time average velocity at a given depth
+        (default is Vs30), computed for all the grid profiles at once.
+
+        :param float depth:
+            calculation depth
+
+        :return numpy.array vsz:
+            velocity map, with the shape of the grid
+        """
+
+        vsz = _avg.traveltime_velocity(self._grid_array('hl'),
+                                       self._grid_array('vs'),
+                                       depth)
+
+        return vsz.reshape(_np.shape(self.gx))
+
+    def site_kappa(self, depth=None):
+        """
+        Map of the site kappa (see Site1D.compute_site_kappa),
+        computed for all the grid profiles at once.
+
+        :param float depth:
+            averaging depth in meters (optional)
+
+        :return numpy.array kappa:
+            kappa map, with the shape of the grid
+        """
+
+        kappa = _avg.compute_site_kappa(self._grid_array('hl'),
+                                        self._grid_array('vs'),
+                                        self._grid_array('qs'),
+                                        depth)
+
+        return kappa.reshape(_np.shape(self.gx))
+
+    def _grid_array(self, key):
+        """
+        Internal: soil parameter of all the grid profiles as
+        (n_points, n_layers) array
+        """
+
+        data = _np.array(self.geo[key], dtype=float)
+
+        return data.reshape(len(data), -1).T
 
     def export_sites(self, ix=[], iy=[]):
         """
@@ -687,6 +805,14 @@ class Grid2D(object):
             list of Site1D objects
         """
 
+        return list(self.iter_sites(ix, iy))
+
+    def iter_sites(self, ix=[], iy=[]):
+        """
+        Same as export_sites, but sites are generated lazily
+        one at a time.
+        """
+
         # Convert to list if integer index
         if not isinstance(ix, list):
             ix = [ix]
@@ -700,7 +826,6 @@ class Grid2D(object):
             iy = range(0, self.gz.shape[0])
 
         # Extracting sites from indexes
-        sites = []
         for i in ix:
             for j in iy:
                 site = Site1D(x=self.gx[j, i],
@@ -708,9 +833,38 @@ class Grid2D(object):
                               z=self.gz[j, i])
                 site.add_model(self.extract_model(i, j))
                 site.model_average()
-                sites.append(site)
+                yield site
+
+    def iter_profiles(self, chunk_size=GRID_CHUNK, keys=GEO_KEYS):
+        """
+        Export the grid nodes in columnar batches (row-major order),
+        without creating site objects.
+
+        :param int chunk_size:
+            number of nodes per batch
+
+        :param list keys:
+            soil parameters to export
+
+        :return generator:
+            dictionaries with x, y, z arrays (n_nodes,) and one
+            (n_nodes, n_layers) array per soil parameter
+        """
+
+        size = _np.size(self.gx)
+
+        for n0 in range(0, size, chunk_size):
+            n1 = min(n0 + chunk_size, size)
 
-        return sites
+            batch = {'x': _np.ravel(self.gx)[n0:n1],
+                     'y': _np.ravel(self.gy)[n0:n1],
+                     'z': _np.ravel(self.gz)[n0:n1]}
+
+            for k in keys:
+                data = _np.asarray(self.geo[k])
+                batch[k] = data.reshape(len(data), -1)[:, n0:n1].T
+
+            yield batch
 
     def extract_model(self, ix, iy):
         """
@@ -766,3 +920,70 @@ class Grid2D(object):
 
                     f.write(','.join([str(d) for d in data]))
                     f.write('\n')
+
+
+class _GridInterpolator(object):
+    """
+    Internal: scattered data interpolation (as scipy griddata, with
+    rescaling) of many values at once. The triangulation and the
+    interpolant of all the values are built once and then evaluated
+    on any number of node chunks.
+    """
+
+    def __init__(self, points, values, method='cubic'):
+
+        self.offset = _np.min(points, axis=0)
+        self.scale = _np.ptp(points, axis=0)
+        self.scale[self.scale == 0] = 1.
+
+        self.points = (points - self.offset)/self.scale
+        self.values = _np.asarray(values, dtype=float)
+        self.method = method
+
+        if method == 'linear':
+            self.tri = _spa.Delaunay(self.points)
+        elif method == 'cubic':
+            self.tri = _spa.Delaunay(self.points)
+            self._interp = _ipl.CloughTocher2DInterpolator(self.tri,
+                                                           self.values)
+        elif method == 'nearest':
+            self._interp = _ipl.NearestNDInterpolator(self.points,
+                                                      self.values)
+        else:
+            raise ValueError('interpolation method not recognized')
+
+    def __call__(self, x, y):
+        """
+        Interpolate the values (n_points, n_values) at the nodes (x, y);
+        output has shape x.shape + (n_values,)
+        """
+
+        xi = _np.column_stack(((_np.ravel(x) - self.offset[0])/self.scale[0],
+                               (_np.ravel(y) - self.offset[1])/self.scale[1]))
+
+        if self.method == 'linear':
+            simplex, weight = self.weights(xi)
+            out = _np.einsum('nk,nkv->nv', weight, self.values[simplex])
+            out[simplex[:, 0] < 0] = _np.nan
+
+        else:
+            out = self._interp(xi)
+
+        return out.reshape(_np.shape(x) + (self.values.shape[1],))
+
+    def weights(self, xi):
+        """
+        Vertex indexes and barycentric weights of the nodes
+        (vertexes are -1 outside the convex hull).
+        """
+
+        simplex = self.tri.find_simplex(xi)
+        trans = self.tri.transform[simplex]
+
+        bary = _np.einsum('nij,nj->ni', trans[:, :2], xi - trans[:, 2])
+        weight = _np.column_stack((bary, 1. - _np.sum(bary, axis=1)))
+
+        vertex = self.tri.simplices[simplex]
+        vertex[simplex < 0] = -1
+
+        return vertex, weight
@@ -25,7 +25,10 @@ import numpy as np
 from shakelab.site import engpar
 from shakelab.site.cps.surf96 import surf96
 from shakelab.site.response import soil_response
-from shakelab.site.engpar import compute_site_kappa
+from shakelab.site.engpar import (depth_weighted_average,
+                                  traveltime_velocity,
+                                  compute_site_kappa,
+                                  quarter_wavelength_average)
 from shakelab.signals.fourier import frequency_axis, Spectrum
 from shakelab.libutils import utils
 
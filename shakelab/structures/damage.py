@@ -0,0 +1,208 @@
+# ****************************************************************************
+#
+# Copyright (C) 2019-2020, ShakeLab Developers.
+# This file is part of ShakeLab.
+#
+# ShakeLab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ShakeLab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+#
+# ****************************************************************************
+"""
+Scenario damage and loss calculator.
+
+The exposure is flattened into columnar arrays (one element per
+asset), joined with the ground-motion fields through the nearest
+site and with the fragility table through the taxonomy tree. Assets
+are processed in chunks, vectorized over the realizations.
+"""
+
+import numpy as np
+
+from shakelab.libutils.geodetic import WgsIndex
+from shakelab.libutils.utils import run_jobs
+from shakelab.structures.fragility import (ExposureDatabase,
+                                           FragilityCollection)
+
+# Default number of assets per chunk
+CHUNK_SIZE = 10000
+
+
+def scenario_damage(exposure, taxonomy_tree, fragility, gmf, latitude,
+                    longitude, consequence=None, cost_type='structural',
+                    chunk_size=CHUNK_SIZE, workers=None):
+    """
+    Compute damage-state distributions and losses of a scenario.
+
+    :param exposure:
+        ExposureDatabase, or its flattened arrays (see to_arrays)
+
+    :param TaxonomyTree taxonomy_tree:
+        weights of the fragility models of each taxonomy
+
+    :param fragility:
+        FragilityTable (or FragilityCollection, compiled on the fly);
+        damage states must be ordered by increasing severity
+
+    :param numpy.array gmf:
+        ground motion as (n_realizations, n_sites), in the units
+        of the fragility models
+
+    :param numpy.array latitude, longitude:
+        coordinates of the ground-motion sites; each asset takes the
+        ground motion of the nearest site
+
+    :param list consequence:
+        damage (loss) ratio of each damage state; if None,
+        losses are not computed
+
+    :param string cost_type:
+        exposure cost used for losses (total value of the asset)
+
+    :param int chunk_size:
+        number of assets processed at once
+
+    :param int workers:
+        number of processes (serial if None)
+
+    :return dict result:
+        'damage': mean number of buildings per damage state
+        (n_assets, n_ds + 1), first column is no damage;
+        'loss': mean loss per asset (n_assets,);
+        'aggregate_damage': buildings per damage state for each
+        realization (n_realizations, n_ds + 1);
+        'aggregate_loss': total loss for each realization
+    """
+    if isinstance(exposure, ExposureDatabase):
+        exposure = exposure.to_arrays()
+
+    if isinstance(fragility, FragilityCollection):
+        fragility = fragility.compile()
+
+    gmf = np.atleast_2d(gmf)
+
+    # Asset to site
+    index = WgsIndex(latitude, longitude)
+    site = index.query_nearest(exposure['Latitude'],
+                               exposure['Longitude'])[1][:, 0]
+
+    # Asset to (model, weight) branches
+    model, weight = taxonomy_branches(taxonomy_tree, fragility)
+    taxonomy = _taxonomy_index(exposure['Taxonomy'], taxonomy_tree)
+
+    if consequence is not None:
+        consequence = np.asarray(consequence, dtype=float)
+        cost = exposure['Cost_' + cost_type]
+    else:
+        cost = np.zeros(len(site))
+
+    asset_num = len(site)
+    ds_num = len(fragility.damage_state) + 1
+    real_num = gmf.shape[0]
+
+    result = {'damage': np.empty((asset_num, ds_num)),
+              'loss': np.empty(asset_num),
+              'aggregate_damage': np.zeros((real_num, ds_num)),
+              'aggregate_loss': np.zeros(real_num)}
+
+    def jobs():
+        for a0 in range(0, asset_num, chunk_size):
+            a1 = min(a0 + chunk_size, asset_num)
+            tax = taxonomy[a0:a1]
+            yield (gmf[:, site[a0:a1]].T, model[tax], weight[tax],
+                   exposure['Buildings'][a0:a1], cost[a0:a1],
+                   fragility, consequence)
+
+    bounds = range(0, asset_num, chunk_size)
+    for a0, out in zip(bounds, run_jobs(_damage_chunk, jobs(), workers)):
+        a1 = min(a0 + chunk_size, asset_num)
+        result['damage'][a0:a1] = out[0]
+        result['loss'][a0:a1] = out[1]
+        result['aggregate_damage'] += out[2]
+        result['aggregate_loss'] += out[3]
+
+    return result
+
+
+def taxonomy_branches(taxonomy_tree, fragility):
+    """
+    Fragility model indexes and weights of each taxonomy of the
+    tree, as (n_taxonomies, n_branches) arrays padded with zero
+    weights.
+    """
+    size = max([len(ti.branch) for ti in taxonomy_tree.tree] + [1])
+
+    model = np.zeros((len(taxonomy_tree.tree), size), dtype=int)
+    weight = np.zeros((len(taxonomy_tree.tree), size))
+
+    for i, ti in enumerate(taxonomy_tree.tree):
+        for k, (id, w) in enumerate(ti.branch.items()):
+            model[i, k] = fragility.get_index(id)
+            weight[i, k] = w
+
+    return model, weight
+
+
+def damage_distribution(poes):
+    """
+    Probability of each damage state (no damage first) from the
+    probabilities of exceedance of ordered damage states (first axis).
+    """
+    poes = np.asarray(poes)
+    upper = np.concatenate((np.ones((1,) + poes.shape[1:]), poes))
+    lower = np.concatenate((poes, np.zeros((1,) + poes.shape[1:])))
+
+    return np.clip(upper - lower, 0., 1.)
+
+
+def _taxonomy_index(taxonomy, taxonomy_tree):
+    """
+    Internal: index of the taxonomy of each asset in the tree.
+    """
+    ids = np.array([ti.id for ti in taxonomy_tree.tree], dtype=str)
+    order = np.argsort(ids)
+
+    pos = np.searchsorted(ids[order], taxonomy)
+    pos = np.minimum(pos, len(ids) - 1)
+    found = ids[order][pos] == taxonomy
+
+    if not np.all(found):
+        missing = np.unique(np.asarray(taxonomy)[~found])
+        raise ValueError('taxonomy not in tree: {0}'.format(missing))
+
+    return order[pos]
+
+
+def _damage_chunk(gm, model, weight, buildings, cost, fragility,
+                  consequence):
+    """
+    Internal: damage and loss of a chunk of assets.
+    gm is (n_assets, n_realizations); model and weight are
+    (n_assets, n_branches).
+    """
+    poes = 0.
+    for k in range(model.shape[1]):
+        poes = poes + weight[:, k, None]*fragility.get_poes(
+                                                gm, model[:, k, None])
+
+    # Damage state probabilities (ds, asset, realization)
+    prob = damage_distribution(poes)
+    damage = prob*buildings[:, None]
+
+    if consequence is not None:
+        ratio = np.einsum('d,dar->ar', consequence, prob[1:])
+        loss = ratio*cost[:, None]
+    else:
+        loss = np.zeros(gm.shape)
+
+    return (np.moveaxis(damage.mean(axis=-1), 0, -1), loss.mean(axis=-1),
+            np.sum(damage, axis=1).T, np.sum(loss, axis=0))
@@ -24,6 +24,7 @@ import json as _json
 import numpy as _np
 import scipy.stats as _stat
 import scipy.interpolate as _ipol
+from scipy.special import ndtr as _ndtr
 
 import matplotlib.pyplot as plt
 from abc import ABCMeta, abstractmethod
@@ -41,6 +42,7 @@ class FragilityModel(metaclass=ABCMeta):
         self.gmt = gmi_type
         self.bounds = bounds
         self.damage_state = {}
+        self._cache = {}
 
     @abstractmethod
     def get_poes(self, dsl, gmi):
@@ -73,11 +75,11 @@ class FragilityModelParametric(FragilityModel):
 
     def get_poes(self, dsl, gmi):
         """
+        Lognormal CDF, evaluated for arrays of any shape.
         """
         beta, teta = normal_to_lognormal(self.damage_state[dsl][0],
                                          self.damage_state[dsl][1])
-        poes = _stat.lognorm.cdf(gmi, beta, scale=teta)
-        return poes
+        return lognormal_cdf(gmi, beta, teta)
 
     def to_discrete(self, gmi=GMI_DEFAULT):
         """
@@ -98,14 +100,22 @@ class FragilityModelDiscrete(FragilityModel):
 
     def add_damage_state(self, dsl, poes):
         self.damage_state[dsl] = _np.array(poes)
+        self._cache = {}
 
     def get_poes(self, dsl, gmi, sampling='lin'):
+        """
+        Interpolators are built once per damage state and sampling.
+        """
         if sampling == 'lin':
             scale = lambda x: x
         if sampling == 'log':
             scale = lambda x: _np.log(x)
-        fi = _ipol.interp1d(scale(self.gmi), self.damage_state[dsl])
-        return fi(scale(gmi))
+
+        key = (dsl, sampling)
+        if key not in self._cache:
+            self._cache[key] = _ipol.interp1d(scale(self.gmi),
+                                              self.damage_state[dsl])
+        return self._cache[key](scale(gmi))
 
 
 def normal_to_lognormal(mean, stdv):
@@ -118,6 +128,16 @@ def normal_to_lognormal(mean, stdv):
     return beta, teta
 
 
+def lognormal_cdf(gmi, beta, teta):
+    """
+    Vectorized lognormal CDF (same as scipy lognorm.cdf with
+    shape beta and scale teta); zero for non-positive intensities.
+    """
+    gmi = _np.asarray(gmi, dtype=float)
+    with _np.errstate(divide='ignore'):
+        return _ndtr((_np.log(gmi) - _np.log(teta))/beta)
+
+
 def plot_fragility_model(fm, gmi, file=None):
     """
     """
@@ -203,6 +223,146 @@ class FragilityCollection(object):
                 fc.add_model(fm.to_discrete(gmi))
         return fc
 
+    def compile(self, damage_states=None, sampling='lin'):
+        """
+        Compile all the models of the collection into a single
+        FragilityTable for vectorized evaluation.
+        """
+        return FragilityTable(self.model, damage_states, sampling)
+
+
+class FragilityTable(object):
+    """
+    Compiled fragility models. Parametric models are stored as
+    lognormal parameters (n_models, n_ds); discrete models as PoE
+    values (n_models, n_ds, n_iml) on a common intensity grid,
+    given by the union of the grids of the models. Damage states
+    missing in a model have zero probability.
+    """
+    def __init__(self, models, damage_states=None, sampling='lin'):
+
+        self.id = [fm.id for fm in models]
+        self.sampling = sampling
+
+        if damage_states is None:
+            damage_states = []
+            for fm in models:
+                for dsl in fm.damage_state:
+                    if dsl not in damage_states:
+                        damage_states.append(dsl)
+        self.damage_state = list(damage_states)
+
+        nm = len(models)
+        nd = len(self.damage_state)
+
+        self.parametric = _np.array([isinstance(fm, FragilityModelParametric)
+                                     for fm in models], dtype=bool)
+
+        # Lognormal parameters (inf median for missing states)
+        self.beta = _np.ones((nm, nd))
+        self.teta = _np.full((nm, nd), _np.inf)
+
+        # Common grid for discrete models
+        grids = [fm.gmi for fm in models
+                 if isinstance(fm, FragilityModelDiscrete)]
+        self.gmi = (_np.unique(_np.concatenate(grids)) if grids
+                    else _np.array([0., 1.]))
+        self.poes = _np.zeros((nm, nd, len(self.gmi)))
+
+        for m, fm in enumerate(models):
+            for d, dsl in enumerate(self.damage_state):
+                if dsl not in fm.damage_state:
+                    continue
+
+                if self.parametric[m]:
+                    mean, stdv = fm.damage_state[dsl]
+                    self.beta[m, d], self.teta[m, d] = \
+                        normal_to_lognormal(mean, stdv)
+                else:
+                    self.poes[m, d] = _np.interp(self._scale(self.gmi),
+                                                 self._scale(fm.gmi),
+                                                 fm.damage_state[dsl])
+
+    def __len__(self):
+        return len(self.id)
+
+    def get_index(self, id):
+        """
+        Index of a model from its id.
+        """
+        return self.id.index(id)
+
+    def get_poes(self, gmi, model=None):
+        """
+        Probabilities of exceedance of all damage states.
+
+        :param numpy.array gmi:
+            ground motion intensities, any shape
+            (e.g. (n_sites, n_realizations))
+
+        :param numpy.array model:
+            model indexes, broadcastable with gmi; if None, all the
+            models are evaluated
+
+        :return numpy.array poes:
+            (n_models, n_ds) + gmi.shape if model is None,
+            otherwise (n_ds,) + broadcast shape of gmi and model
+        """
+        gmi = _np.asarray(gmi, dtype=float)
+
+        if model is None:
+            # Models are evaluated by type, on the same intensities
+            poes = _np.empty((len(self), len(self.damage_state))
+                             + gmi.shape)
+            idx = (Ellipsis,) + (None,)*gmi.ndim
+
+            par = _np.nonzero(self.parametric)[0]
+            if len(par):
+                poes[par] = lognormal_cdf(gmi, self.beta[par][idx],
+                                          self.teta[par][idx])
+
+            dis = _np.nonzero(~self.parametric)[0]
+            if len(dis):
+                i1, w = self._weights(gmi)
+                p0 = self.poes[dis][..., i1 - 1]
+                p1 = self.poes[dis][..., i1]
+                poes[dis] = p0 + w*(p1 - p0)
+
+            return poes
+
+        # Index arrays for (damage state, model, intensity)
+        model = _np.asarray(model, dtype=int)
+        ndim = max(gmi.ndim, model.ndim)
+        m = model[None]
+        d = _np.arange(len(self.damage_state)).reshape((-1,) + (1,)*ndim)
+
+        poes = lognormal_cdf(gmi, self.beta[m, d], self.teta[m, d])
+
+        if not _np.all(self.parametric):
+            i1, w = self._weights(gmi)
+            p0 = self.poes[m, d, i1 - 1]
+            p1 = self.poes[m, d, i1]
+            poes = _np.where(self.parametric[m], poes, p0 + w*(p1 - p0))
+
+        return poes
+
+    def _weights(self, gmi):
+        """
+        Interpolation indexes and weights on the common grid
+        (values are clamped to the grid bounds).
+        """
+        grid = self._scale(self.gmi)
+        xi = _np.clip(self._scale(gmi), grid[0], grid[-1])
+        i1 = _np.clip(_np.searchsorted(grid, xi), 1, len(grid) - 1)
+        w = (xi - grid[i1-1])/(grid[i1] - grid[i1-1])
+        return i1, w
+
+    def _scale(self, x):
+        if self.sampling == 'log':
+            with _np.errstate(divide='ignore'):
+                return _np.log(x)
+        return x
+
 
 class TreeItem(object):
     """
@@ -307,3 +467,41 @@ class ExposureDatabase(object):
             for exp in data['exposure']:
                 self.add_from_dict(exp)
 
+    def to_arrays(self):
+        """
+        Flatten the exposure into columnar arrays, with one element
+        per asset (location and taxonomy pair). Missing values are NaN.
+
+        :return dict data:
+            Location (index), Latitude, Longitude, Taxonomy (id),
+            Buildings, Cost_<type> and Occupants_<period> arrays
+        """
+        data = {'Location': [], 'Latitude': [], 'Longitude': [],
+                'Taxonomy': [], 'Buildings': []}
+        cost = {k: [] for k in TaxonomyItem().cost}
+        occupants = {k: [] for k in TaxonomyItem().occupants}
+
+        for i, li in enumerate(self.location):
+            for ti in li.taxonomy:
+                data['Location'].append(i)
+                data['Latitude'].append(li.latitude)
+                data['Longitude'].append(li.longitude)
+                data['Taxonomy'].append(ti.id)
+                data['Buildings'].append(ti.number_of_buildings)
+                for key in cost:
+                    cost[key].append(ti.cost.get(key))
+                for key in occupants:
+                    occupants[key].append(ti.occupants.get(key))
+
+        data.update({'Cost_' + k: v for k, v in cost.items()})
+        data.update({'Occupants_' + k: v for k, v in occupants.items()})
+
+        for key, value in data.items():
+            if key == 'Taxonomy':
+                data[key] = _np.array(value, dtype=str)
+            elif key == 'Location':
+                data[key] = _np.array(value, dtype=int)
+            else:
+                data[key] = _np.array([_np.nan if v is None else v
+                                       for v in value], dtype=float)
+        return data
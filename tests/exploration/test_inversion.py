@@ -0,0 +1,133 @@
+# ****************************************************************************
+#
+# Copyright (C) 2019-2022, ShakeLab Developers.
+# This file is part of ShakeLab.
+#
+# ShakeLab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ShakeLab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+#
+# ****************************************************************************
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import numpy.testing as npt
+
+from shakelab.exploration.inversion import (ParameterSpace, HvsrCurve,
+                                            Inversion)
+from shakelab.libutils.columnar import ColumnStore
+
+
+def synthetic_inversion(**kwargs):
+    """
+    Two layers over a half-space, fitted to the synthetic HVSR
+    of a known model (a point of the parameter grid); the
+    half-space is fixed, since HVSR only constrains h/Vs
+    """
+    space = ParameterSpace()
+    space.add_layer(hl=(2., 20., 0.5), vs=(100., 400., 5.), qs=20.)
+    space.add_layer(hl=(5., 40., 0.5), vs=(200., 800., 5.), qs=30.)
+    space.add_layer(vs=1000., vpvs=1.8, dn=2300., qs=100.)
+
+    true = np.array([8., 200., 20., 450.])
+    freq = np.logspace(np.log10(0.5), np.log10(20.), 30)
+
+    curve = HvsrCurve(freq, np.ones(len(freq)))
+    curve.data = curve.forward(space.to_arrays(true))[0]
+    curve.sigma = curve.data
+
+    return Inversion(space, curve, **kwargs), true
+
+
+# =============================================================================
+
+class InversionTestCase(unittest.TestCase):
+    """
+    Sampling inversion of a synthetic profile
+    """
+
+    def test_recovery(self):
+        inv, true = synthetic_inversion(seed=0)
+        inv.neighbourhood(200, 30, 100, 10)
+
+        x, mis = inv.best()
+        npt.assert_allclose(x[0], true)
+        self.assertAlmostEqual(mis[0], 0.)
+
+        info = inv.progress()
+        self.assertEqual(info['Models'], 3200)
+        self.assertEqual(info['Iteration'], 30)
+        self.assertEqual(info['Evaluated'] + info['Cached'], 3200)
+        self.assertEqual(info['Misfit'], mis[0])
+
+    def test_cache(self):
+        inv, true = synthetic_inversion(seed=1)
+        inv.monte_carlo(20)
+        x = inv.x[:5].copy()
+
+        mis = inv.evaluate(np.concatenate((x, x)), iteration=1)
+        npt.assert_array_equal(mis, np.tile(inv.misfit[:5], 2))
+        self.assertEqual(inv.evaluated, 20)
+        self.assertEqual(inv.cached, 10)
+
+    def test_workers(self):
+        serial, _ = synthetic_inversion(seed=2, chunk_size=7)
+        serial.monte_carlo(30)
+
+        pool, _ = synthetic_inversion(seed=2, chunk_size=7, workers=2)
+        pool.monte_carlo(30)
+
+        npt.assert_array_equal(serial.x, pool.x)
+        npt.assert_allclose(serial.misfit, pool.misfit)
+
+
+# =============================================================================
+
+class StoreTestCase(unittest.TestCase):
+    """
+    Streaming of the ensemble to a column store
+    """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.store = os.path.join(self.path, 'ensemble')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_store(self):
+        inv, _ = synthetic_inversion(seed=0, store=self.store)
+        inv.monte_carlo(25, batch_size=10)
+
+        table = ColumnStore(self.store).read('model', mmap=False)
+        npt.assert_array_equal(table['Misfit'], inv.misfit)
+        for k, name in enumerate(inv.space.names):
+            npt.assert_array_equal(table[name], inv.x[:, k])
+
+    def test_overwrite(self):
+        inv, _ = synthetic_inversion(seed=0, store=self.store)
+        inv.monte_carlo(5)
+
+        with self.assertRaises(ValueError):
+            synthetic_inversion(store=self.store)
+
+        inv, _ = synthetic_inversion(seed=0, store=self.store,
+                                     overwrite=True)
+        inv.monte_carlo(3)
+        self.assertEqual(ColumnStore(self.store).size('model'), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+# ****************************************************************************
+#
+# Copyright (C) 2019-2022, ShakeLab Developers.
+# This file is part of ShakeLab.
+#
+# ShakeLab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ShakeLab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+#
+# ****************************************************************************
+
+import unittest
+import numpy as np
+import numpy.testing as npt
+from scipy.constants import g
+
+from shakelab.gmpe.atkinson_2015 import Atkinson2015
+from shakelab.gmpe.bragato_slejko_2005 import (BragatoSlejko2005,
+                                               BragatoSlejko2005JB)
+
+
+def atkinson_2015(C, imt, mag, dist):
+    """
+    Reference scalar implementation of Atkinson (2015).
+    """
+    heff = max(1., 10.**(-1.72+0.43*mag))
+    mean = C['c0'] + C['c1']*mag + C['c2']*(mag**2.)
+    mean += C['c3']*np.log10(np.sqrt(dist**2. + heff**2.))
+    mean *= np.log(10.)
+    stdv = C['phi']*np.log(10.)
+
+    if imt == 'PGV':
+        mean -= np.log(100.)
+    else:
+        mean -= np.log(100.*g)
+
+    return mean, stdv
+
+
+def bragato_slejko_2005(C, imt, mag, dist):
+    """
+    Reference scalar implementation of Bragato and Slejko (2005).
+    """
+    r = np.sqrt(dist**2 + C['h']**2)
+    mean = C['a'] + (C['b'] + C['c']*mag)*mag
+    mean += (C['d'] + C['e']*mag**3)*np.log10(r)
+    mean *= np.log(10.)
+    stdv = C['s']*np.log(10.)
+
+    if imt == 'PGV':
+        mean -= np.log(100.)
+
+    return mean, stdv
+
+
+# =============================================================================
+
+class GroundMotionTableTestCase(unittest.TestCase):
+    """
+    Vectorized evaluation over IMTs, magnitudes and distances
+    must reproduce the scalar models
+    """
+
+    def setUp(self):
+        self.mag = np.array([2.5, 3.5, 4.5, 5.5, 6.5])
+        self.dist = np.array([1., 5., 20., 80., 200.])
+
+    def check_model(self, gmpe, reference, imts):
+        mag = self.mag[:, None]
+        dist = self.dist[None, :]
+
+        mean, stdv = gmpe.ground_motion_table(imts, mag, dist)
+        shape = (len(imts), len(self.mag), len(self.dist))
+        self.assertEqual(mean.shape, shape)
+        self.assertEqual(stdv.shape, shape)
+
+        for i, imt in enumerate(imts):
+            C = gmpe.get_coefficients(imt)
+            for j, m in enumerate(self.mag):
+                for k, d in enumerate(self.dist):
+                    ref = reference(C, imt, m, d)
+                    npt.assert_allclose(mean[i, j, k], ref[0], rtol=1e-12)
+                    npt.assert_allclose(stdv[i, j, k], ref[1], rtol=1e-12)
+
+                    out = gmpe.ground_motion(imt, m, d)
+                    self.assertIsInstance(out[0], float)
+                    npt.assert_allclose(out, ref, rtol=1e-12)
+
+    def test_atkinson_2015(self):
+        self.check_model(Atkinson2015(), atkinson_2015, ['PGA', 'PGV'])
+
+    def test_bragato_slejko_2005(self):
+        for model in [BragatoSlejko2005(), BragatoSlejko2005JB()]:
+            imts = ['PGA', 'PGV', 'SA-0.20', 'SA-1.00']
+            self.check_model(model, bragato_slejko_2005, imts)
+
+    def test_all_imts(self):
+        gmpe = BragatoSlejko2005()
+        mean, stdv = gmpe.ground_motion_table(None, 5., self.dist)
+        self.assertEqual(mean.shape, (len(gmpe.imts), len(self.dist)))
+
+        mean1, _ = gmpe.ground_motion('SA-0.50', 5., self.dist)
+        npt.assert_allclose(mean1, mean[gmpe.imts.index('SA-0.50')])
+
+        with self.assertRaises(KeyError):
+            gmpe.ground_motion_table(['SA-9.99'], 5., 10.)
+
+
+if __name__ == '__main__':
+    unittest.main()
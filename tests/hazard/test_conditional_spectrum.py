@@ -0,0 +1,123 @@
+# ****************************************************************************
+#
+# Copyright (C) 2019-2022, ShakeLab Developers.
+# This file is part of ShakeLab.
+#
+# ShakeLab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ShakeLab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+#
+# ****************************************************************************
+
+import unittest
+import numpy as np
+import numpy.testing as npt
+
+from shakelab.hazard.correlation import baker_jayaram, baker_jayaram_matrix
+from shakelab.hazard import conditional_spectrum as cs
+from shakelab.gmpe.bragato_slejko_2005 import BragatoSlejko2005
+
+
+# =============================================================================
+
+class BakerJayaramTestCase(unittest.TestCase):
+    """
+    The correlation matrix must match the scalar model
+    """
+
+    def test_matrix(self):
+        period = np.array([0.01, 0.05, 0.1, 0.109, 0.15, 0.2,
+                           0.5, 1., 2., 5., 10.])
+
+        rho = baker_jayaram_matrix(period)
+        self.assertEqual(rho.shape, (len(period), len(period)))
+        self.assertFalse(rho.flags.writeable)
+
+        for i, t1 in enumerate(period):
+            for j, t2 in enumerate(period):
+                npt.assert_allclose(rho[i, j], baker_jayaram(t1, t2),
+                                    rtol=1e-12)
+
+        npt.assert_allclose(np.diag(rho), 1.)
+        npt.assert_allclose(rho, rho.T)
+        self.assertTrue(np.min(np.linalg.eigvalsh(rho)) > -1e-8)
+
+        rho2 = baker_jayaram_matrix(period, [0.2, 1.])
+        npt.assert_allclose(rho2, rho[:, [5, 7]])
+
+
+class ConditionalSpectrumTestCase(unittest.TestCase):
+    """
+    Conditional mean, covariance and simulated spectra
+    """
+
+    def setUp(self):
+        self.period = np.array([0.05, 0.1, 0.2, 0.5, 1., 2.])
+        self.mean = np.log([0.2, 0.3, 0.25, 0.1, 0.05, 0.02])
+        self.stdv = np.array([0.6, 0.62, 0.65, 0.7, 0.72, 0.75])
+
+    def test_mean(self):
+        cms_mean, cms_stdv = cs.conditional_mean_spectrum(
+            self.period, self.mean, self.stdv, 0.5, 1.5)
+
+        rho = np.array([baker_jayaram(t, 0.5) for t in self.period])
+        npt.assert_allclose(cms_mean, self.mean + 1.5*rho*self.stdv)
+        npt.assert_allclose(cms_stdv, self.stdv*np.sqrt(1. - rho**2),
+                            atol=1e-7)
+        npt.assert_allclose(cms_stdv[3], 0., atol=1e-7)
+
+    def test_simulation(self):
+        spectra = cs.conditional_spectrum(self.period, self.mean,
+                                          self.stdv, 0.5, 1.5,
+                                          spectrum_num=20000, seed=42)
+        self.assertEqual(spectra.shape, (20000, len(self.period)))
+
+        cms_mean, cms_stdv = cs.conditional_mean_spectrum(
+            self.period, self.mean, self.stdv, 0.5, 1.5)
+        cov = cs.conditional_covariance(self.period, self.stdv, 0.5)
+
+        npt.assert_allclose(np.mean(spectra, axis=0), cms_mean, atol=0.02)
+        npt.assert_allclose(np.cov(spectra.T), cov, atol=0.02)
+        npt.assert_allclose(spectra[:, 3], cms_mean[3], atol=1e-6)
+
+    def test_gmpe(self):
+        gmpe = BragatoSlejko2005()
+        imts = ['SA-0.10', 'SA-0.20', 'SA-0.50', 'SA-1.00']
+
+        period, cms_mean, cms_stdv = cs.gmpe_conditional_spectrum(
+            gmpe, 5., 20., 0.5, 1., imts)
+
+        mean = [gmpe.ground_motion(imt, 5., 20.)[0] for imt in imts]
+        stdv = [gmpe.ground_motion(imt, 5., 20.)[1] for imt in imts]
+        ref = cs.conditional_mean_spectrum(period, mean, stdv, 0.5, 1.)
+
+        npt.assert_allclose(period, [0.1, 0.2, 0.5, 1.])
+        npt.assert_allclose(cms_mean, ref[0])
+        npt.assert_allclose(cms_stdv, ref[1])
+
+    def test_ranking(self):
+        target = self.mean
+        spectra = np.array([target + 0.5, target + [0., 0.1, 0.,
+                                                    0., 0.2, 0.], target])
+
+        order, misfit, scale = cs.rank_records(spectra, target)
+        npt.assert_array_equal(order, [2, 1, 0])
+
+        # Scaling at the conditioning period removes the offset
+        order, misfit, scale = cs.rank_records(spectra, target,
+                                               self.period, 0.5)
+        npt.assert_allclose(misfit[0], 0., atol=1e-12)
+        npt.assert_allclose(scale, np.exp([-0.5, 0., 0.]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+# ****************************************************************************
+#
+# Copyright (C) 2019-2022, ShakeLab Developers.
+# This file is part of ShakeLab.
+#
+# ShakeLab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ShakeLab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+#
+# ****************************************************************************
+
+import os
+import tempfile
+import unittest
+import numpy as np
+import numpy.testing as npt
+
+from shakelab.hazard import event_based as eb
+from shakelab.hazard.psha import PointSource, AreaSource, hazard_curves
+from shakelab.hazard.magnitude_frequency_distribution import (
+    BoundedGutembergRichter)
+from shakelab.gmpe.bragato_slejko_2005 import BragatoSlejko2005
+from shakelab.libutils.columnar import ColumnStore
+from shakelab.libutils.geodetic import WgsMesh, WgsPoint, WgsPolygon
+
+
+# =============================================================================
+
+class EventSetTestCase(unittest.TestCase):
+    """
+    Stochastic event sets must be reproducible
+    """
+
+    def setUp(self):
+        mfd = BoundedGutembergRichter(3., 1., 4., 6.5)
+        polygon = WgsPolygon([(45.9, 12.6), (46.3, 12.6),
+                              (46.3, 13.2), (45.9, 13.2)])
+        self.sources = [PointSource(46., 13., 10., mfd),
+                        AreaSource(polygon, 8., mfd)]
+
+    def test_workers(self):
+        ref = list(eb.stochastic_event_set(self.sources, 1000.,
+                                           chunk_size=30, seed=42))
+        out = list(eb.stochastic_event_set(self.sources, 1000.,
+                                           chunk_size=30, seed=42,
+                                           workers=2))
+        self.assertEqual(len(out), len(ref))
+        for c1, c2 in zip(out, ref):
+            for key in eb.RUPTURE_KEYS:
+                npt.assert_array_equal(c1[key], c2[key])
+
+        area = np.concatenate([c['Source'] for c in ref]) == 1
+        lat = np.concatenate([c['Latitude'] for c in ref])[area]
+        self.assertTrue(np.all((lat >= 45.9) & (lat <= 46.3)))
+
+    def test_store(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'ses')
+            eb.stochastic_event_set(self.sources, 1000., chunk_size=30,
+                                    seed=42, store=path)
+            ref = list(eb.stochastic_event_set(self.sources, 1000.,
+                                               chunk_size=30, seed=42))
+
+            self.assertEqual(ColumnStore(path, 'r').size('rupture'),
+                             sum(len(c['Time']) for c in ref))
+
+            out = list(eb.read_ruptures(path, chunk_size=50))
+            for key in eb.RUPTURE_KEYS:
+                npt.assert_array_equal(
+                    np.concatenate([c[key] for c in out]),
+                    np.concatenate([c[key] for c in ref]))
+
+    def test_global_seed(self):
+        mfd = self.sources[0].mfd
+
+        np.random.seed(7)
+        ref = mfd.inverse_sampling(5)
+        np.random.seed(7)
+        npt.assert_array_equal(mfd.inverse_sampling(5), ref)
+
+        npt.assert_array_equal(mfd.inverse_sampling(5, seed=3),
+                               mfd.inverse_sampling(5, seed=3))
+
+
+class EventBasedHazardTestCase(unittest.TestCase):
+    """
+    Empirical hazard curves must approach the classical ones
+    """
+
+    def setUp(self):
+        self.mesh = WgsMesh()
+        for la, lo in [(46.0, 13.0), (46.1, 13.2), (46.3, 12.8)]:
+            self.mesh.add(WgsPoint(la, lo))
+
+        mfd = BoundedGutembergRichter(3., 1., 4., 6.5)
+        self.sources = [PointSource(46., 13., 10., mfd)]
+        self.gmpe = BragatoSlejko2005()
+        self.imts = ['PGA', 'SA-0.20']
+        self.imls = np.array([0.005, 0.01, 0.02])
+
+    def test_curves(self):
+        ref = hazard_curves(self.mesh, self.sources, self.gmpe,
+                            self.imts, self.imls, 1.)
+
+        ruptures = eb.stochastic_event_set(self.sources, 1e5, seed=1)
+        out = eb.event_based_hazard(ruptures, self.mesh, self.gmpe,
+                                    self.imts, self.imls, 1e5, 1.,
+                                    between_std=0.3, seed=2)
+
+        npt.assert_allclose(out, ref, rtol=0.1)
+
+    def test_correlation(self):
+        ruptures = list(eb.stochastic_event_set(self.sources, 5000.,
+                                                seed=1))
+
+        rho = np.array([[1., 0.6], [0.6, 1.]])
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'gmf')
+            out = eb.event_based_hazard(ruptures, self.mesh, self.gmpe,
+                                        self.imts, [1e-12], 5000., 1.,
+                                        between_std=0.3,
+                                        correlation_range=10.,
+                                        imt_correlation=rho, seed=2,
+                                        store=path)
+            gmf = ColumnStore(path, 'r').read('gmf', mmap=False)
+
+        # Residual correlation between the IMTs at the first site
+        site = gmf['Site'] == 0
+        rup = gmf['Rupture'][site]
+        mag = np.concatenate([c['Magnitude'] for c in ruptures])[rup]
+        dist = eb._distance(np.array([46.]), np.array([13.]),
+                            np.array([10.]), np.array([46.]),
+                            np.array([13.]), 'epicentral')[0, 0]
+
+        res = []
+        for imt in self.imts:
+            mean, stdv = self.gmpe.ground_motion(imt, mag, dist)
+            res.append((np.log(gmf[imt][site]) - mean)/stdv)
+        self.assertTrue(abs(np.corrcoef(res)[0, 1] - 0.6) < 0.05)
+
+        with self.assertRaises(ValueError):
+            eb.event_based_hazard(ruptures, self.mesh, self.gmpe,
+                                  self.imts, self.imls, 5000.,
+                                  imt_correlation=np.eye(3))
+
+
+if __name__ == '__main__':
+    unittest.main()
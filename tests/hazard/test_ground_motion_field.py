@@ -0,0 +1,119 @@
+# ****************************************************************************
+#
+# Copyright (C) 2019-2022, ShakeLab Developers.
+# This file is part of ShakeLab.
+#
+# ShakeLab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ShakeLab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+#
+# ****************************************************************************
+
+import unittest
+import numpy as np
+import numpy.testing as npt
+
+from shakelab.hazard import ground_motion_field as gmf
+from shakelab.hazard.correlation import jayaram_baker, jayaram_baker_range
+from shakelab.gmpe.bragato_slejko_2005 import BragatoSlejko2005
+from shakelab.seismicity.catalogue import Event
+from shakelab.libutils.geodetic import (WgsMesh, WgsPoint,
+                                        xy_to_wgs_sinproj)
+
+
+def grid_sites(nx, ny, spacing):
+    """
+    Sites on a regular grid (km) of the sinusoidal projection.
+    """
+    x, y = np.meshgrid(np.arange(nx)*spacing, np.arange(ny)*spacing,
+                       indexing='ij')
+    x = 1300. + x.ravel()
+    y = 5000. + y.ravel()
+    lat, lon = xy_to_wgs_sinproj(x*1e3, y*1e3)
+    return lat, lon, x, y
+
+
+# =============================================================================
+
+class SpatialCorrelationTestCase(unittest.TestCase):
+    """
+    Residuals must reproduce the exponential correlation model
+    """
+
+    def setUp(self):
+        self.lat, self.lon, x, y = grid_sites(6, 5, 2.)
+        dist = np.hypot(x[:, None] - x[None, :], y[:, None] - y[None, :])
+        self.corr = jayaram_baker(dist, 0.)
+
+    def test_model(self):
+        npt.assert_allclose(jayaram_baker_range([0., 0.5, 2.]),
+                            [8.5, 17.1, 29.4])
+        npt.assert_allclose(jayaram_baker_range([0., 2.], clustered=True),
+                            [40.7, 29.4])
+        npt.assert_allclose(jayaram_baker(8.5/3., 0.), np.exp(-1.))
+
+    def check_sampling(self, method):
+        eps = gmf.correlated_residuals(self.lat, self.lon, 8.5, 4000,
+                                       method=method, seed=0)
+        self.assertEqual(eps.shape, (4000, len(self.lat)))
+
+        npt.assert_allclose(np.mean(eps, axis=0), 0., atol=0.06)
+        npt.assert_allclose(np.std(eps, axis=0), 1., atol=0.05)
+        npt.assert_allclose(np.corrcoef(eps.T), self.corr, atol=0.06)
+
+    def test_cholesky(self):
+        self.check_sampling('cholesky')
+
+    def test_fft(self):
+        self.check_sampling('fft')
+
+    def test_seed(self):
+        for method in ['cholesky', 'fft']:
+            eps1 = gmf.correlated_residuals(self.lat, self.lon, 8.5, 3,
+                                            method=method, seed=1)
+            eps2 = gmf.correlated_residuals(self.lat, self.lon, 8.5, 3,
+                                            method=method, seed=1)
+            npt.assert_array_equal(eps1, eps2)
+
+
+class GroundMotionFieldTestCase(unittest.TestCase):
+    """
+    Field realizations must be centred on the GMPE median
+    """
+
+    def test_field(self):
+        mesh = WgsMesh()
+        lat, lon, _, _ = grid_sites(5, 4, 5.)
+        for la, lo in zip(lat, lon):
+            mesh.add(WgsPoint(la, lo))
+
+        event = Event('E1')
+        event.location.add({'Latitude': float(lat[7]),
+                            'Longitude': float(lon[7]),
+                            'Depth': 10.})
+        event.magnitude.add({'MagSize': 5.5})
+
+        gmpe = BragatoSlejko2005()
+        out = gmf.ground_motion_field(mesh, event, gmpe, 'PGA',
+                                      realizations=2000, between_std=0.3,
+                                      seed=42)
+        self.assertEqual(out.shape, (2000, len(lat)))
+
+        dist = gmf.site_distance(lat, lon, lat[7], lon[7])
+        mean, stdv = gmpe.ground_motion('PGA', 5.5, dist)
+
+        npt.assert_allclose(np.mean(np.log(out), axis=0), mean, atol=0.1)
+        npt.assert_allclose(np.std(np.log(out), axis=0), stdv, rtol=0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
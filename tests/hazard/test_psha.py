@@ -0,0 +1,176 @@
+# ****************************************************************************
+#
+# Copyright (C) 2019-2022, ShakeLab Developers.
+# This file is part of ShakeLab.
+#
+# ShakeLab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ShakeLab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+#
+# ****************************************************************************
+
+import unittest
+import numpy as np
+import numpy.testing as npt
+from scipy.stats import norm
+
+from shakelab.hazard import psha
+from shakelab.hazard.magnitude_frequency_distribution import (
+    BoundedGutembergRichter)
+from shakelab.gmpe.atkinson_2015 import Atkinson2015
+from shakelab.gmpe.bragato_slejko_2005 import BragatoSlejko2005
+from shakelab.libutils.geodetic import (WgsMesh, WgsPoint, WgsPolygon,
+                                        circle_distance)
+
+
+def reference_hazard(lat, lon, sources, gmpe, imts, imls, time,
+                     truncation=None, max_distance=300.):
+    """
+    Hazard curves by explicit loops over ruptures, sites and levels.
+    """
+    rate = np.zeros((len(imts), len(lat), len(imls)))
+
+    for src in sources:
+        (slat, slon, sdep, mag, mrate) = src.get_ruptures()
+
+        for p in range(len(slat)):
+            for s in range(len(lat)):
+                dist = circle_distance(slat[p], slon[p], lat[s], lon[s])/1e3
+                if gmpe.DISTANCE_METRIC == 'hypocentral':
+                    dist = np.sqrt(dist**2 + sdep[p]**2)
+                if dist > max_distance:
+                    continue
+
+                for m in range(len(mag)):
+                    for i, imt in enumerate(imts):
+                        mean, stdv = gmpe.ground_motion(imt, mag[m], dist)
+                        z = (np.log(imls) - mean)/stdv
+                        if truncation is None:
+                            poe = norm.sf(z)
+                        else:
+                            a = norm.cdf(-truncation)
+                            poe = (norm.sf(z) - a)/(1. - 2.*a)
+                            poe = np.clip(poe, 0., 1.)
+                        rate[i, s] += mrate[m, p]*poe
+
+    return 1. - np.exp(-rate*time)
+
+
+# =============================================================================
+
+class HazardCurvesTestCase(unittest.TestCase):
+    """
+    Vectorized hazard curves must match the explicit loop
+    """
+
+    def setUp(self):
+        self.mesh = WgsMesh()
+        self.lat = np.array([45.5, 45.8, 46.2, 46.5, 47.5])
+        self.lon = np.array([12.5, 13.1, 13.0, 12.4, 13.5])
+        for la, lo in zip(self.lat, self.lon):
+            self.mesh.add(WgsPoint(la, lo))
+
+        mfd = BoundedGutembergRichter(3., 1., 4., 6.5)
+        polygon = WgsPolygon([(45.9, 12.6), (46.3, 12.6),
+                              (46.3, 13.2), (45.9, 13.2)])
+
+        self.sources = [psha.PointSource(46., 13., 10., mfd, 0.25),
+                        psha.AreaSource(polygon, 8., mfd, 10., 0.5)]
+        self.imls = np.logspace(-3, 0, 10)
+
+    def test_curves(self):
+        for gmpe, imts in [(BragatoSlejko2005(), ['PGA', 'SA-0.20']),
+                           (Atkinson2015(), ['PGA'])]:
+            for truncation in [None, 2.]:
+                out = psha.hazard_curves(self.mesh, self.sources, gmpe,
+                                         imts, self.imls, 50.,
+                                         truncation=truncation,
+                                         max_distance=100.)
+                ref = reference_hazard(self.lat, self.lon, self.sources,
+                                       gmpe, imts, self.imls, 50.,
+                                       truncation, 100.)
+
+                self.assertEqual(out.shape,
+                                 (len(imts), len(self.lat), len(self.imls)))
+                npt.assert_allclose(out, ref, rtol=1e-8, atol=1e-10)
+
+        # Site beyond the integration distance
+        npt.assert_array_equal(out[:, -1], 0.)
+
+    def test_blocks(self):
+        gmpe = BragatoSlejko2005()
+        ref = psha.hazard_curves(self.mesh, self.sources, gmpe,
+                                 ['PGA'], self.imls)
+
+        max_elements = psha.MAX_ELEMENTS
+        try:
+            psha.MAX_ELEMENTS = 1
+            out = psha.hazard_curves(self.mesh, self.sources, gmpe,
+                                     ['PGA'], self.imls)
+        finally:
+            psha.MAX_ELEMENTS = max_elements
+        npt.assert_allclose(out, ref)
+
+        out = psha.hazard_curves(self.mesh, self.sources, gmpe,
+                                 ['PGA'], self.imls, workers=2)
+        npt.assert_allclose(out, ref)
+
+    def test_source_blocks(self):
+        gmpe = BragatoSlejko2005()
+        imts = ['PGA', 'SA-0.20']
+        ref = psha.hazard_curves(self.mesh, self.sources, gmpe,
+                                 imts, self.imls)
+
+        # The tensor of a single site already exceeds the cap
+        sizes = []
+        exceedance = psha._exceedance
+
+        def recorder(z, truncation=None):
+            sizes.append(z.size)
+            return exceedance(z, truncation)
+
+        max_elements = psha.MAX_ELEMENTS
+        try:
+            psha._exceedance = recorder
+            for cap in [40, 100, 1000]:
+                psha.MAX_ELEMENTS = cap
+                del sizes[:]
+                out = psha.hazard_curves(self.mesh, self.sources, gmpe,
+                                         imts, self.imls)
+                npt.assert_allclose(out, ref, rtol=1e-12)
+                self.assertLessEqual(max(sizes), cap)
+        finally:
+            psha._exceedance = exceedance
+            psha.MAX_ELEMENTS = max_elements
+
+    def test_uhs(self):
+        gmpe = BragatoSlejko2005()
+        imts = ['PGA', 'SA-0.20']
+        poe = psha.hazard_curves(self.mesh, self.sources, gmpe,
+                                 imts, self.imls)
+
+        uhs = psha.uniform_hazard_spectrum(self.imls, poe, 0.1)
+
+        for i in range(len(imts)):
+            for s in range(len(self.lat)):
+                curve = poe[i, s]
+                if curve[0] < 0.1:
+                    self.assertTrue(np.isnan(uhs[i, s]))
+                    continue
+                ref = np.exp(np.interp(np.log(0.1),
+                                       np.log(curve[::-1]),
+                                       np.log(self.imls[::-1])))
+                npt.assert_allclose(uhs[i, s], ref)
+
+
+if __name__ == '__main__':
+    unittest.main()
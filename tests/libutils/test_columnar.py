@@ -0,0 +1,109 @@
+# ****************************************************************************
+#
+# Copyright (C) 2019-2022, ShakeLab Developers.
+# This file is part of ShakeLab.
+#
+# ShakeLab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ShakeLab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+#
+# ****************************************************************************
+
+import os
+import tempfile
+import unittest
+import numpy as np
+import numpy.testing as npt
+
+from shakelab.libutils.columnar import ColumnStore, is_store
+
+
+# =============================================================================
+
+class ColumnStoreTestCase(unittest.TestCase):
+    """
+    Tables must be read back as written and appended rows
+    must follow the existing ones
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'store')
+        self.data = {'A': np.arange(10, dtype=np.int32),
+                     'B': np.linspace(0., 1., 10),
+                     'C': np.array(['ab', 'cd'] * 5)}
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_round_trip(self):
+        store = ColumnStore(self.path, 'w')
+        store.write('table', self.data)
+        store.set_attributes({'Name': 'test'})
+
+        self.assertTrue(is_store(self.path))
+
+        store = ColumnStore(self.path, 'r')
+        self.assertEqual(store.size('table'), 10)
+        self.assertEqual(store.attributes['Name'], 'test')
+
+        for mmap in [True, False]:
+            out = store.read('table', mmap=mmap)
+            for key, value in self.data.items():
+                npt.assert_array_equal(out[key], value)
+                self.assertEqual(out[key].dtype, value.dtype)
+
+        out = store.read('table', columns=['B'])
+        self.assertEqual(list(out), ['B'])
+
+        with self.assertRaises(ValueError):
+            store.write('table', self.data)
+
+    def test_append(self):
+        store = ColumnStore(self.path, 'w')
+        store.append('table', self.data)
+
+        # Wider strings and floats in an integer column
+        new = {'A': np.array([1.5, 2.5]),
+               'B': np.array([2., 3.]),
+               'C': np.array(['longer', 'x'])}
+        store.append('table', new)
+
+        out = ColumnStore(self.path, 'r').read('table')
+        for key in self.data:
+            ref = np.concatenate((self.data[key], new[key]))
+            npt.assert_array_equal(out[key], ref)
+
+        with self.assertRaises(ValueError):
+            store.append('table', {'A': [1]})
+
+    def test_interrupted_append(self):
+        store = ColumnStore(self.path, 'w')
+        store.write('table', self.data)
+
+        # Rows written to one column but not recorded in the header
+        file = os.path.join(self.path, 'table.B.bin')
+        with open(file, 'ab') as f:
+            np.ones(3).tofile(f)
+
+        store = ColumnStore(self.path, 'a')
+        store.append('table', {k: v[:2] for k, v in self.data.items()})
+
+        out = ColumnStore(self.path, 'r').read('table', mmap=False)
+        for key, value in self.data.items():
+            npt.assert_array_equal(out[key],
+                                   np.concatenate((value, value[:2])))
+        self.assertEqual(os.path.getsize(file), 12*8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,370 @@
+# ****************************************************************************
+#
+# Copyright (C) 2019-2022, ShakeLab Developers.
+# This file is part of ShakeLab.
+#
+# ShakeLab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ShakeLab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+#
+# ****************************************************************************
+
+import unittest
+import numpy as np
+import numpy.testing as npt
+
+from shakelab.libutils import geodetic as geo
+from shakelab.libutils.geodetic import WgsIndex, circle_distance
+
+
+# =============================================================================
+
+class WgsIndexTestCase(unittest.TestCase):
+    """
+    Radius and nearest-neighbour queries must match a brute-force
+    search based on the haversine distance
+    """
+
+    def setUp(self):
+        rng = np.random.default_rng(42)
+        self.lat = rng.uniform(40., 48., 500)
+        self.lon = rng.uniform(6., 19., 500)
+        self.qlat = rng.uniform(40., 48., 10)
+        self.qlon = rng.uniform(6., 19., 10)
+
+    def check_radius(self, index, lat, lon, radius):
+        for la, lo in zip(self.qlat, self.qlon):
+            dst = circle_distance(la, lo, lat, lon)
+            ref = np.flatnonzero(dst <= radius)
+            npt.assert_array_equal(index.query_radius(la, lo, radius), ref)
+
+    def check_nearest(self, index, lat, lon, k):
+        dst, idx = index.query_nearest(self.qlat, self.qlon, k)
+        self.assertEqual(idx.shape, (len(self.qlat), k))
+
+        for i, (la, lo) in enumerate(zip(self.qlat, self.qlon)):
+            ref = circle_distance(la, lo, lat, lon)
+            order = np.argsort(ref)[:k]
+            npt.assert_array_equal(idx[i], order)
+            npt.assert_allclose(dst[i], ref[order], atol=1e-3)
+
+    def test_query(self):
+        index = WgsIndex(self.lat, self.lon)
+        self.check_radius(index, self.lat, self.lon, 50e3)
+        self.check_nearest(index, self.lat, self.lon, 5)
+
+    def test_add_remove(self):
+        index = WgsIndex(self.lat[:400], self.lon[:400])
+        index.rebuild()
+
+        # New points are searched in the pending buffer
+        index.add(self.lat[400:], self.lon[400:])
+        self.check_radius(index, self.lat, self.lon, 50e3)
+        self.check_nearest(index, self.lat, self.lon, 5)
+
+        remove = [3, 250, 410]
+        lat = np.delete(self.lat, remove)
+        lon = np.delete(self.lon, remove)
+
+        index.remove(remove)
+        self.assertEqual(len(index), len(lat))
+        self.check_radius(index, lat, lon, 50e3)
+        self.check_nearest(index, lat, lon, 5)
+
+    def test_missing(self):
+        lat = self.lat.copy()
+        lat[::7] = np.nan
+
+        index = WgsIndex(lat, self.lon)
+        valid = np.isfinite(lat)
+
+        for la, lo in zip(self.qlat, self.qlon):
+            idx = index.query_radius(la, lo, 100e3)
+            self.assertTrue(np.all(valid[idx]))
+
+        dst, idx = index.query_nearest(self.qlat, self.qlon, 3)
+        self.assertTrue(np.all(valid[idx]))
+
+
+class DistanceMatrixTestCase(unittest.TestCase):
+    """
+    Blocked distance matrices must match the point-wise distances
+    """
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.lat1 = rng.uniform(-60., 60., 30)
+        self.lon1 = rng.uniform(-180., 180., 30)
+        self.ele1 = rng.uniform(-30e3, 0., 30)
+        self.lat2 = rng.uniform(-60., 60., 40)
+        self.lon2 = rng.uniform(-180., 180., 40)
+        self.ele2 = rng.uniform(0., 2e3, 40)
+
+    def test_circle(self):
+        ref = circle_distance(self.lat1[:, None], self.lon1[:, None],
+                              self.lat2[None, :], self.lon2[None, :])
+
+        for block in [geo.DISTANCE_BLOCK, 100, 1]:
+            out = geo.circle_distance_matrix(self.lat1, self.lon1,
+                                             self.lat2, self.lon2,
+                                             block=block)
+            self.assertEqual(out.shape, (30, 40))
+            npt.assert_allclose(out, ref, atol=1e-3)
+
+        out = np.zeros((30, 40), dtype=np.float32)
+        geo.circle_distance_matrix(self.lat1, self.lon1, self.lat2,
+                                   self.lon2, dtype=np.float32, out=out)
+        npt.assert_allclose(out, ref, rtol=1e-5)
+
+        # Coincident points
+        out = geo.circle_distance_matrix(self.lat1, self.lon1,
+                                         self.lat1, self.lon1)
+        npt.assert_allclose(np.diag(out), 0., atol=1e-6)
+
+    def test_tunnel(self):
+        ref = geo.tunnel_distance_sphere(self.lat1[:, None],
+                                         self.lon1[:, None],
+                                         self.ele1[:, None],
+                                         self.lat2[None, :],
+                                         self.lon2[None, :],
+                                         self.ele2[None, :])
+
+        for block in [geo.DISTANCE_BLOCK, 50]:
+            out = geo.tunnel_distance_matrix(self.lat1, self.lon1,
+                                             self.ele1, self.lat2,
+                                             self.lon2, self.ele2,
+                                             block=block)
+            npt.assert_allclose(out, ref, atol=1e-3)
+
+        # Vertical distance for coincident epicentres
+        out = geo.tunnel_distance_matrix(self.lat1, self.lon1, -10e3,
+                                         self.lat1, self.lon1, 0.)
+        npt.assert_allclose(np.diag(out), 10e3, rtol=1e-9)
+
+    def test_mesh_index(self):
+        mesh = geo.WgsMesh()
+        for la, lo in zip(self.lat2, self.lon2):
+            mesh.add(geo.WgsPoint(la, lo))
+
+        dst = circle_distance(self.lat1[0], self.lon1[0],
+                              self.lat2, self.lon2)
+        radius = np.sort(dst)[5]
+
+        idx = mesh.query_radius(self.lat1[0], self.lon1[0], radius)
+        npt.assert_array_equal(idx, np.flatnonzero(dst <= radius))
+
+        d, idx = mesh.query_nearest(self.lat1[0], self.lon1[0], 3)
+        npt.assert_array_equal(idx[0], np.argsort(dst)[:3])
+
+        # The index follows the mesh changes
+        mesh.add(geo.WgsPoint(self.lat1[0], self.lon1[0]))
+        d, idx = mesh.query_nearest(self.lat1[0], self.lon1[0])
+        self.assertEqual(idx[0, 0], 40)
+
+
+def star_polygon(x0, y0, radius, num, seed=0):
+    """
+    Star-shaped (non-convex) ring with random radii.
+    """
+    rng = np.random.default_rng(seed)
+    angle = np.linspace(0., 2*np.pi, num, endpoint=False)
+    r = radius*rng.uniform(0.4, 1., num)
+    return x0 + r*np.cos(angle), y0 + r*np.sin(angle)
+
+
+class ContainsTestCase(unittest.TestCase):
+    """
+    Vectorized point-in-polygon must match the scalar test,
+    with holes and multi-polygons as additional rings
+    """
+
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        self.x = rng.uniform(-2., 12., 800)
+        self.y = rng.uniform(-2., 12., 800)
+
+        self.outer = star_polygon(4., 4., 4., 300, seed=2)
+        self.hole = star_polygon(4., 4., 1.5, 12, seed=3)
+        self.other = star_polygon(10., 10., 1.5, 7, seed=4)
+
+    def reference(self, rings):
+        inside = np.zeros(len(self.x), dtype=bool)
+        for rx, ry in rings:
+            inside ^= [geo.contains(rx, ry, x, y)
+                       for x, y in zip(self.x, self.y)]
+        return inside
+
+    def test_rings(self):
+        for rings in [[self.outer], [self.outer, self.hole],
+                      [self.outer, self.hole, self.other]]:
+            ref = self.reference(rings)
+
+            for prefilter in [True, False]:
+                for index in [None, 1, 8]:
+                    out = geo.contains_points(rings, self.x, self.y,
+                                              prefilter, index, block=1000)
+                    npt.assert_array_equal(out, ref)
+
+        self.assertTrue(np.any(ref) and not np.all(ref))
+
+    def test_shape(self):
+        rings = [self.outer]
+        out = geo.contains_points(rings, self.x.reshape(20, 40),
+                                  self.y.reshape(20, 40))
+        self.assertEqual(out.shape, (20, 40))
+
+        # Scalars, vertices and missing values
+        self.assertTrue(geo.contains_points(rings, 4., 4.))
+        self.assertFalse(geo.contains_points(rings, np.nan, 4.))
+        self.assertFalse(np.any(geo.contains_points([], self.x, self.y)))
+
+        vx, vy = [0., 1., 1., 0.], [0., 0., 1., 1.]
+        out = geo.contains_points([(vx, vy)], vx, vy)
+        ref = [geo.contains(vx, vy, x, y) for x, y in zip(vx, vy)]
+        npt.assert_array_equal(out, ref)
+
+    def test_polygon(self):
+        poly = geo.WgsPolygon()
+        poly.from_array(self.outer[1], self.outer[0])
+        hole = geo.WgsPolygon()
+        hole.from_array(self.hole[1], self.hole[0])
+        poly.add_hole(hole)
+
+        ref = self.reference([self.outer, self.hole])
+        npt.assert_array_equal(poly.contains_array(self.y, self.x), ref)
+        self.assertEqual(poly.contains(geo.WgsPoint(self.y[0], self.x[0])),
+                         ref[0])
+
+        # Mesh intersection with a multi-polygon
+        other = geo.WgsPolygon()
+        other.from_array(self.other[1], self.other[0])
+
+        mesh = geo.WgsMesh()
+        for la, lo in zip(self.y, self.x):
+            mesh.add(geo.WgsPoint(la, lo))
+        mesh.intersect([poly, other])
+
+        ref = (self.reference([self.outer, self.hole]) |
+               self.reference([self.other]))
+        lat, lon = mesh.to_array()
+        npt.assert_array_equal(lat, self.y[ref])
+        npt.assert_array_equal(lon, self.x[ref])
+
+    def test_overlapping_polygons(self):
+        polygons = []
+        for x0 in [0., 1.]:
+            poly = geo.WgsPolygon()
+            poly.from_array([x0, x0, x0 + 2., x0 + 2.],
+                            [x0, x0 + 2., x0 + 2., x0])
+            polygons.append(poly)
+
+        mesh = geo.WgsMesh()
+        for la, lo in [(1.5, 1.5), (0.5, 0.5), (2.5, 2.5), (0.5, 2.5)]:
+            mesh.add(geo.WgsPoint(la, lo))
+        mesh.intersect(polygons)
+
+        lat, lon = mesh.to_array()
+        npt.assert_array_equal(lat, [1.5, 0.5, 2.5])
+        npt.assert_array_equal(lon, [1.5, 0.5, 2.5])
+
+
+def reference_cartesian_mesh(delta, meters=False, latlim=(-90, 90),
+                             lonlim=(-180, 180)):
+    """
+    Row-by-row cartesian mesh (the original implementation).
+    """
+    if not meters:
+        delta *= geo.DEG_TO_M
+
+    r = geo.MEAN_EARTH_RADIUS
+    xmax = np.pi*r - (np.pi*r % delta)
+    ymax = np.pi*r/2 - (np.pi*r/2 % delta)
+
+    xrng = np.arange(-xmax, xmax, delta)
+    yrng = np.arange(-ymax, ymax, delta)
+
+    ylim = np.radians(latlim)*r
+    ysel = yrng[(yrng >= ylim[0]) & (yrng <= ylim[1])]
+
+    lat = np.array([])
+    lon = np.array([])
+    for ys in ysel:
+        xlim = np.radians(lonlim)*r*np.cos(ys/r)
+        xsel = xrng[(xrng >= xlim[0]) & (xrng <= xlim[1])]
+        lat0, lon0 = geo.xy_to_wgs_sinproj(xsel, ys*np.ones(len(xsel)))
+        lat = np.append(lat, lat0)
+        lon = np.append(lon, lon0)
+
+    return np.round(lat, geo.NDIGITS), np.round(lon, geo.NDIGITS)
+
+
+def reference_spherical_mesh(delta, latlim=(-90, 90), lonlim=(-180, 180)):
+    """
+    Full golden spiral mesh, then selected (the original implementation).
+    """
+    num_pts = np.rint(4*np.pi/np.radians(delta)**2)
+    indices = np.arange(0, num_pts, dtype=float) + 0.5
+
+    lat = np.degrees(np.arccos(1 - 2*(indices/num_pts))) - 90.
+    lon = np.degrees(geo.unwrap(np.pi*(1 + 5**0.5)*indices))
+
+    i = (lat >= latlim[0]) & (lat <= latlim[1])
+    j = (lon >= lonlim[0]) & (lon <= lonlim[1])
+
+    return np.round(lat[i & j], geo.NDIGITS), np.round(lon[i & j],
+                                                      geo.NDIGITS)
+
+
+class MeshTestCase(unittest.TestCase):
+    """
+    Chunked mesh generators must reproduce the whole meshes,
+    independently of the chunk size
+    """
+
+    def test_cartesian(self):
+        for args in [(0.5, False, (40., 48.), (5., 20.)),
+                     (20e3, True, (-10., 10.), (170., 180.)),
+                     (5., False, (-90., 90.), (-180., 180.))]:
+            ref = reference_cartesian_mesh(*args)
+            out = geo.cartesian_mesh(*args)
+            npt.assert_allclose(out, ref, atol=1e-4)
+
+            for chunk_size in [1, 7, 100]:
+                chunks = list(geo.iter_cartesian_mesh(*args,
+                                                      chunk_size=chunk_size))
+                npt.assert_array_equal(geo._collect(chunks), out)
+
+                # Whole rows, within the size where possible
+                for la, lo in chunks:
+                    self.assertTrue(len(la) <= chunk_size or
+                                    len(np.unique(la)) == 1)
+
+    def test_spherical(self):
+        for args in [(1., (40., 48.), (5., 20.)),
+                     (5., (-90., 90.), (-180., 180.)),
+                     (2., (-30., -10.), (-180., 0.))]:
+            ref = reference_spherical_mesh(*args)
+            out = geo.spherical_mesh(args[0], False, *args[1:])
+            npt.assert_array_equal(out, ref)
+
+            chunks = geo.iter_spherical_mesh(args[0], False, *args[1:],
+                                             chunk_size=50)
+            npt.assert_array_equal(geo._collect(chunks), out)
+
+    def test_empty(self):
+        lat, lon = geo.cartesian_mesh(1., latlim=(10., 10.1))
+        self.assertEqual(len(lat), 0)
+        self.assertEqual(len(lon), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+# ****************************************************************************
+#
+# Copyright (C) 2019-2022, ShakeLab Developers.
+# This file is part of ShakeLab.
+#
+# ShakeLab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ShakeLab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+#
+# ****************************************************************************
+
+import os
+import tempfile
+import unittest
+import numpy as np
+import numpy.testing as npt
+
+import shakelab.seismicity.catalogue as cat
+
+
+def synthetic_database(number, seed=42):
+    """
+    Database with one or two locations and magnitudes per event,
+    with some missing values.
+    """
+    rng = np.random.default_rng(seed)
+
+    edb = cat.EqDatabase()
+    for i in range(number):
+        event = cat.Event('E{0}'.format(i))
+
+        for j in range(1 + i % 2):
+            event.location.add({'Year': 1990 + i, 'Month': 1 + i % 12,
+                                'Second': rng.uniform(0, 60),
+                                'Latitude': rng.uniform(-90, 90),
+                                'Longitude': rng.uniform(-180, 180),
+                                'Depth': None if i % 3 else 10.,
+                                'LocCode': 'AUTH{0}'.format(j)})
+            event.magnitude.add({'MagSize': rng.uniform(2, 7),
+                                 'MagType': 'Mw', 'MagPrime': j == 0})
+
+        edb.event.append(event)
+
+    return edb
+
+
+# =============================================================================
+
+class ColumnarTestCase(unittest.TestCase):
+    """
+    Columnar and pickle dump and load must preserve all the solutions
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'catalogue')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def assertDatabaseEqual(self, edb, ref):
+        self.assertEqual(len(edb), len(ref))
+
+        for ev, er in zip(edb.event, ref.event):
+            self.assertEqual(ev.id, er.id)
+            for prop in ['location', 'magnitude']:
+                sol = [s.get() for s in getattr(ev, prop).solution]
+                ref_sol = [s.get() for s in getattr(er, prop).solution]
+                self.assertEqual(sol, ref_sol)
+
+    def test_dump_load(self):
+        ref = synthetic_database(20)
+        ref.dump(self.path, format='columnar')
+
+        edb = cat.EqDatabase()
+        edb.load(self.path)
+        self.assertDatabaseEqual(edb, ref)
+
+    def test_pickle(self):
+        ref = synthetic_database(20)
+        ref.dump(self.path)
+        self.assertTrue(os.path.isfile(self.path))
+
+        edb = cat.EqDatabase()
+        edb.load(self.path)
+        self.assertDatabaseEqual(edb, ref)
+
+        with self.assertRaises(ValueError):
+            ref.dump(self.path, append=True)
+
+    def test_append(self):
+        ref = synthetic_database(20)
+        ref.select(range(12)).dump(self.path, format='columnar')
+        ref.select(range(12, 20)).dump(self.path, format='columnar',
+                                       append=True)
+
+        edb = cat.EqDatabase()
+        edb.load(self.path)
+        self.assertDatabaseEqual(edb, ref)
+
+        data = cat.read_columns(self.path, 'location', ['Event', 'Year'])
+        index = np.repeat(np.arange(20), [1 + i % 2 for i in range(20)])
+        npt.assert_array_equal(data['Event'], index)
+        npt.assert_array_equal(data['Year'], 1990 + index)
+
+
+if __name__ == '__main__':
+    unittest.main()
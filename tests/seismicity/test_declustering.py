@@ -0,0 +1,174 @@
+# ****************************************************************************
+#
+# Copyright (C) 2019-2022, ShakeLab Developers.
+# This file is part of ShakeLab.
+#
+# ShakeLab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ShakeLab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+#
+# ****************************************************************************
+
+import unittest
+import numpy as np
+import numpy.testing as npt
+
+from shakelab.seismicity import declustering as dc
+from shakelab.libutils.geodetic import circle_distance
+
+
+def synthetic_catalogue(seed=42):
+    """
+    Background seismicity with three aftershock sequences
+    (delays growing geometrically, as for an Omori decay). Time in seconds;
+    the first event of each sequence is the mainshock.
+    """
+    rng = np.random.default_rng(seed)
+
+    nb = 200
+    time = rng.uniform(0., 20*365*dc.DAY_SEC, nb)
+    lat = rng.uniform(35., 47., nb)
+    lon = rng.uniform(6., 19., nb)
+    mag = rng.uniform(2., 4., nb)
+    group = np.zeros(nb, dtype=int)
+
+    for k, (t0, la, lo) in enumerate([(2e8, 42., 13.), (4e8, 38., 15.),
+                                      (5e8, 45., 8.)]):
+        na = 20
+        time = np.r_[time, t0, t0 + 1e-3*1.5**np.arange(na)*dc.DAY_SEC]
+        lat = np.r_[lat, la, la + rng.normal(0., 0.05, na)]
+        lon = np.r_[lon, lo, lo + rng.normal(0., 0.05, na)]
+        mag = np.r_[mag, 6., rng.uniform(2., 4.5, na)]
+        group = np.r_[group, np.full(na + 1, k + 1)]
+
+    return time, lat, lon, mag, group
+
+
+def reference_gardner_knopoff(time, lat, lon, mag, foreshock_ratio=0.):
+    """
+    Brute-force window search on the unsorted catalogue.
+    """
+    wdist, wtime = dc.gardner_knopoff_window(mag)
+    wtime = wtime*dc.DAY_SEC
+    label = np.zeros(len(time), dtype=int)
+
+    order = np.lexsort((time, -mag))
+    for i in order:
+        if label[i]:
+            continue
+        label[i] = i + 1
+
+        dist = circle_distance(lat[i], lon[i], lat, lon)
+        inside = ((time >= time[i] - foreshock_ratio*wtime[i]) &
+                  (time <= time[i] + wtime[i]) &
+                  (dist <= wdist[i]*1e3) & (label == 0))
+        label[inside] = i + 1
+
+    size = np.bincount(label)
+    label[size[label] < 2] = 0
+
+    return label
+
+
+def same_partition(label1, label2):
+    """
+    Check that two labellings define the same clusters.
+    """
+    if np.any((label1 == 0) != (label2 == 0)):
+        return False
+    pair1 = label1[:, None] == label1[None, :]
+    pair2 = label2[:, None] == label2[None, :]
+    return np.array_equal(pair1, pair2)
+
+
+# =============================================================================
+
+class GardnerKnopoffTestCase(unittest.TestCase):
+    """
+    Window declustering must match a brute-force search
+    """
+
+    def setUp(self):
+        self.data = synthetic_catalogue()
+
+    def test_labels(self):
+        time, lat, lon, mag, group = self.data
+
+        for ratio in [0., 0.5]:
+            ref = reference_gardner_knopoff(time, lat, lon, mag, ratio)
+            cluster, mainshock = dc.gardner_knopoff(time, lat, lon, mag,
+                                                    foreshock_ratio=ratio)
+            self.assertTrue(same_partition(cluster, ref))
+
+        # Each sequence is a cluster led by its mainshock
+        for k in range(1, 4):
+            idx = np.flatnonzero(group == k)
+            self.assertEqual(len(np.unique(cluster[idx])), 1)
+            self.assertTrue(cluster[idx[0]] > 0)
+            npt.assert_array_equal(mainshock[idx], idx == idx[0])
+
+        # Independent events and mainshocks are flagged
+        npt.assert_array_equal(mainshock[cluster == 0], True)
+        self.assertEqual(np.sum(mainshock[cluster > 0]),
+                         len(np.unique(cluster[cluster > 0])))
+
+    def test_index(self):
+        time, lat, lon, mag, _ = self.data
+        ref = dc.gardner_knopoff(time, lat, lon, mag)
+
+        threshold = dc.INDEX_THRESHOLD
+        try:
+            dc.INDEX_THRESHOLD = 0
+            out = dc.gardner_knopoff(time, lat, lon, mag)
+        finally:
+            dc.INDEX_THRESHOLD = threshold
+
+        npt.assert_array_equal(out[0], ref[0])
+        npt.assert_array_equal(out[1], ref[1])
+
+    def test_missing(self):
+        time, lat, lon, mag, _ = self.data
+        mag = mag.copy()
+        mag[::10] = np.nan
+
+        cluster, mainshock = dc.gardner_knopoff(time, lat, lon, mag)
+        npt.assert_array_equal(cluster[::10], 0)
+
+
+class ReasenbergTestCase(unittest.TestCase):
+    """
+    Cluster linking must recover the aftershock sequences and
+    not depend on the input order
+    """
+
+    def test_labels(self):
+        time, lat, lon, mag, group = synthetic_catalogue()
+        cluster, mainshock = dc.reasenberg(time, lat, lon, mag)
+
+        for k in range(1, 4):
+            idx = np.flatnonzero(group == k)
+            self.assertTrue(np.all(cluster[idx] == cluster[idx[0]]))
+            self.assertTrue(cluster[idx[0]] > 0)
+            self.assertTrue(mainshock[idx[0]])
+
+        # Labels are numbered in time order
+        first = [time[cluster == c].min() for c in range(1, cluster.max()+1)]
+        self.assertTrue(np.all(np.diff(first) > 0))
+
+        order = np.random.default_rng(0).permutation(len(time))
+        out = dc.reasenberg(time[order], lat[order], lon[order], mag[order])
+        npt.assert_array_equal(out[0], cluster[order])
+        npt.assert_array_equal(out[1], mainshock[order])
+
+
+if __name__ == '__main__':
+    unittest.main()
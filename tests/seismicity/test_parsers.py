@@ -0,0 +1,204 @@
+# ****************************************************************************
+#
+# Copyright (C) 2019-2022, ShakeLab Developers.
+# This file is part of ShakeLab.
+#
+# ShakeLab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ShakeLab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+#
+# ****************************************************************************
+
+import os
+import tempfile
+import unittest
+import numpy as np
+
+import shakelab.seismicity.catalogue as cat
+from shakelab.seismicity.parsers import read_isf, iter_isf
+
+
+def write_bulletin(isf_file, number=60, seed=42):
+    """
+    Write a synthetic ISC bulletin with two location solutions
+    (random prime) and two magnitudes for each event.
+    """
+    rng = np.random.default_rng(seed)
+
+    loc_header = ('   Date       Time        Err   RMS Latitude Longitude'
+                  '  Smaj  Smin  Az Depth   Err Ndef Nsta Gap  mdist  Mdist'
+                  ' Qual   Author      OrigID\n')
+
+    with open(isf_file, 'w') as fid:
+        fid.write('DATA_TYPE EVENT IMS1.0\nISC Bulletin\n\n')
+
+        for i in range(number):
+            fid.write('Event {0:8d} Some Region\n\n'.format(600000 + i))
+            fid.write(loc_header)
+
+            prime = rng.integers(3)
+            for j in range(2):
+                line = '{0:04d}/{1:02d}/{2:02d} {3:02d}:{4:02d}:{5:05.2f}'
+                line = line.format(1980 + i % 40, 1 + i % 12, 1 + i % 28,
+                                   i % 24, i % 60, rng.uniform(0, 59))
+                line = line.ljust(36)
+                line += '{0:8.4f} {1:9.4f}'.format(rng.uniform(-90, 90),
+                                                   rng.uniform(-180, 180))
+                line = line.ljust(71)
+                line += '{0:5.1f}'.format(rng.uniform(0, 50))
+                line = line.ljust(118)
+                line += 'AUTH{0}'.format(j).ljust(10)
+                line += '{0:8d}'.format(1000*i + j)
+                fid.write(line + '\n')
+                if prime == j:
+                    fid.write(' (#PRIME)\n')
+
+            fid.write('\nMagnitude  Err Nsta Author      OrigID\n')
+            for mtype in ['mb', 'MS']:
+                fid.write('{0:5s} {1:4.1f} 0.1   10 ISC       1\n'.format(
+                          mtype, rng.uniform(2, 7)))
+            fid.write('\n')
+
+
+def legacy_read_isf(isf_file):
+    """
+    Reference line-by-line reader (the original read_isf).
+    """
+    def create_location_solution(line):
+        loc = cat.LocationSolution()
+        loc['Year'] = line[0:4].strip(' ')
+        loc['Month'] = line[5:7].strip(' ')
+        loc['Day'] = line[8:10].strip(' ')
+        loc['Hour'] = line[10:13].strip(' ')
+        loc['Minute'] = line[14:16].strip(' ')
+        loc['Second'] = line[17:22].strip(' ')
+        loc['Latitude'] = line[36:44].strip(' ')
+        loc['Longitude'] = line[45:54].strip(' ')
+        loc['Depth'] = line[71:76].strip(' ')
+        loc['SecError'] = line[24:29].strip(' ')
+        loc['DepError'] = line[78:82].strip(' ')
+        loc['LocCode'] = line[118:127].strip(' ')
+        loc['LocPrime'] = False
+        return loc
+
+    def create_magnitude_solution(line):
+        mag = cat.MagnitudeSolution()
+        mag['MagType'] = line[0:5].strip(' ')
+        mag['MagSize'] = line[6:10].strip(' ')
+        mag['MagError'] = line[11:14].strip(' ')
+        mag['MagCode'] = line[20:29].strip(' ')
+        mag['MagPrime'] = False
+        return mag
+
+    events = []
+    with open(isf_file, 'r') as fid:
+        fid.readline()
+        fid.readline()
+
+        while True:
+            line = fid.readline()
+
+            if 'Event' in line:
+                events.append(cat.Event(line[6:14].strip()))
+
+            elif 'Date' in line:
+                while True:
+                    line2 = fid.readline()
+                    if not line2.strip():
+                        break
+                    if 'PRIME' in line2:
+                        events[-1].location[-1].prime = True
+                    elif 'CENTROID' not in line2:
+                        events[-1].location.add(
+                            create_location_solution(line2))
+
+            elif 'Magnitude' in line:
+                while True:
+                    line2 = fid.readline()
+                    if not line2.strip():
+                        break
+                    events[-1].magnitude.add(
+                        create_magnitude_solution(line2))
+
+            if not line:
+                break
+
+    return events
+
+
+# =============================================================================
+
+class IsfTestCase(unittest.TestCase):
+    """
+    The streaming reader must reproduce the original line-by-line
+    parser, also when the file is parsed in parallel chunks
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.tmp.name, 'bulletin.isf')
+        write_bulletin(self.file)
+        self.ref = legacy_read_isf(self.file)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def assertEventsEqual(self, events, ref):
+        self.assertEqual(len(events), len(ref))
+
+        for ev, er in zip(events, ref):
+            self.assertEqual(ev.id, er.id)
+
+            for prop in ['location', 'magnitude']:
+                sol = getattr(ev, prop).solution
+                ref_sol = getattr(er, prop).solution
+                self.assertEqual(len(sol), len(ref_sol))
+
+                for s, r in zip(sol, ref_sol):
+                    self.assertEqual(s.get(), r.get())
+
+    def test_read(self):
+        self.assertEventsEqual(read_isf(self.file).event, self.ref)
+
+    def test_stream(self):
+        self.assertEventsEqual(list(iter_isf(self.file)), self.ref)
+
+        batches = list(iter_isf(self.file, batch_size=25))
+        self.assertEqual([len(b) for b in batches], [25, 25, 10])
+        events = [ev for b in batches for ev in b.event]
+        self.assertEventsEqual(events, self.ref)
+
+    def test_parallel(self):
+        events = list(iter_isf(self.file, workers=2, chunk_size=2000))
+        self.assertEventsEqual(events, self.ref)
+
+    def test_filter(self):
+        events = list(iter_isf(self.file, mag_range=(4., 6.),
+                               bbox=((-45., 45.), (-90., 90.)),
+                               time_range=('1990-01-01T00:00:00', None)))
+
+        ref = []
+        for ev in self.ref:
+            loc = ev.location.prime
+            mag = ev.magnitude.prime
+            if (4. <= mag.size <= 6. and
+                    -45. <= loc.latitude <= 45. and
+                    -90. <= loc.longitude <= 90. and
+                    loc.year >= 1990):
+                ref.append(ev)
+
+        self.assertTrue(len(ref) > 0)
+        self.assertEventsEqual(events, ref)
+
+
+if __name__ == '__main__':
+    unittest.main()
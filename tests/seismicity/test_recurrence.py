@@ -0,0 +1,119 @@
+# ****************************************************************************
+#
+# Copyright (C) 2019-2022, ShakeLab Developers.
+# This file is part of ShakeLab.
+#
+# ShakeLab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ShakeLab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+#
+# ****************************************************************************
+
+import unittest
+import numpy as np
+import numpy.testing as npt
+
+from shakelab.seismicity import recurrence as rec
+
+
+def gutenberg_richter(number, b_value=1., mmin=2., dm=0.1, seed=42):
+    """
+    Binned magnitudes of a Gutenberg-Richter distribution,
+    complete from the bin centred at mmin.
+    """
+    rng = np.random.default_rng(seed)
+    beta = b_value*np.log(10.)
+    mag = (mmin - dm/2.) + rng.exponential(1./beta, number)
+    return np.round(mag/dm)*dm
+
+
+# =============================================================================
+
+class AkiUtsuTestCase(unittest.TestCase):
+    """
+    Maximum-likelihood estimators on synthetic Gutenberg-Richter data
+    """
+
+    def setUp(self):
+        self.mag = gutenberg_richter(20000)
+
+    def test_b_value(self):
+        a_value, b_value, sigma_b = rec.aki_utsu(self.mag, 2.)
+
+        self.assertTrue(abs(b_value - 1.) < 3.*sigma_b)
+        self.assertTrue(0.005 < sigma_b < 0.01)
+        npt.assert_allclose(a_value, np.log10(len(self.mag)) + 2.*b_value)
+
+        # Events below completeness are ignored
+        b_high = rec.aki_utsu(self.mag, 3.)[1]
+        self.assertTrue(abs(b_high - 1.) < 0.05)
+
+        a_rate = rec.aki_utsu(self.mag, 2., duration=10.)[0]
+        npt.assert_allclose(a_rate, a_value - 1.)
+
+    def test_samples(self):
+        samples = rec.bootstrap_samples(self.mag, 5, seed=0)
+        mc = np.array([2., 2., 2.5, 3., 3.])
+
+        out = rec.aki_utsu(samples, mc)
+        for i in range(5):
+            ref = rec.aki_utsu(samples[i], mc[i])
+            npt.assert_allclose([o[i] for o in out], ref)
+
+    def test_completeness(self):
+        # Detection probability decreasing below magnitude 3
+        rng = np.random.default_rng(1)
+        prob = np.minimum(10.**(2.*(self.mag - 3.)), 1.)
+        mag = self.mag[rng.uniform(size=len(self.mag)) < prob]
+
+        mc = rec.mc_maximum_curvature(mag)
+        self.assertTrue(abs(mc - 3.) < 0.15)
+
+        mc = rec.mc_goodness_of_fit(mag, level=90.)[0]
+        self.assertTrue(2.8 < mc < 3.3)
+
+        b_value, mc = rec.bootstrap_b_value(mag, sample_num=50, seed=0)
+        self.assertEqual(b_value.shape, (50,))
+        self.assertTrue(abs(np.median(b_value) - 1.) < 0.1)
+
+
+class WeichertTestCase(unittest.TestCase):
+    """
+    Weichert estimator with variable completeness periods
+    """
+
+    def test_b_value(self):
+        rng = np.random.default_rng(3)
+
+        # 100 events per year above 1.95 over 120 years
+        mag = gutenberg_richter(12000, b_value=1.)
+        time = rng.uniform(1900., 2020., len(mag))
+
+        completeness = np.array([[1990., 2.], [1960., 3.], [1900., 4.]])
+        start = np.select([mag >= 4., mag >= 3.], [1900., 1960.], 1990.)
+        keep = time >= start
+
+        a_value, b_value, sigma_b = rec.weichert(mag[keep], time[keep],
+                                                 completeness,
+                                                 end_time=2020.)
+
+        self.assertTrue(abs(b_value - 1.) < 3.*sigma_b)
+        self.assertTrue(abs(a_value - np.log10(100.) - 1.95) < 0.05)
+
+        # Single period reduces to the Aki-Utsu estimate
+        b_ref = rec.aki_utsu(mag, 2.)[1]
+        b_one = rec.weichert(mag, time, [[1900., 2.]], end_time=2020.)[1]
+        self.assertTrue(abs(b_one - b_ref) < 0.02)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+# ****************************************************************************
+#
+# Copyright (C) 2019-2022, ShakeLab Developers.
+# This file is part of ShakeLab.
+#
+# ShakeLab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ShakeLab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+#
+# ****************************************************************************
+
+import os
+import tempfile
+import unittest
+import numpy as np
+import numpy.testing as npt
+
+from shakelab.signals.base import Record
+from shakelab.signals.psd import PPSD
+from shakelab.signals import response
+from shakelab.libutils.time import Date
+
+
+def noise_record(time, seconds=3600., sigma=1e-5, seed=0):
+    """
+    White noise record (acceleration)
+    """
+    rng = np.random.default_rng(seed)
+    rec = Record(delta=0.01,
+                 data=sigma*rng.standard_normal(int(seconds/0.01)))
+    rec.head.time = Date(time)
+    rec.head.sid = 'X'
+    return rec
+
+
+def flat_response(gain, units='M/S**2'):
+    """
+    Stage record with flat response (pole and zero cancel out)
+    """
+    srec = response.StageRecord('2019-01-01T00:00:00')
+    srec.append(response.StagePoleZero(input_units=units,
+                                       normalization_factor=1.,
+                                       poles=[-0.01], zeros=[-0.01]))
+    srec.append(response.StageGain(sensitivity=gain))
+    return srec
+
+
+# =============================================================================
+
+class PPSDTestCase(unittest.TestCase):
+    """
+    Incremental PPSD of synthetic white noise
+    """
+
+    def setUp(self):
+        self.rec1 = noise_record('2020-01-01T00:00:00')
+        self.rec2 = noise_record('2020-01-01T02:00:00', seed=1)
+
+    def ppsd(self):
+        return PPSD(0.01, segment_length=600.)
+
+    def test_noise_level(self):
+        ppsd = self.ppsd()
+        ppsd.add(self.rec1)
+
+        # Segments of 600 s with 50% overlap
+        self.assertEqual(ppsd.count, 11)
+        npt.assert_array_equal(ppsd.hist.sum(axis=1), 11)
+
+        level = 10.*np.log10(2.*0.01*1e-10)
+        # Long-period bands average few frequencies (larger scatter)
+        for est in [ppsd.mode(), ppsd.percentile(50), ppsd.mean()]:
+            npt.assert_allclose(est, level, atol=3.)
+            npt.assert_allclose(np.median(est), level, atol=1.)
+        npt.assert_allclose(np.sum(ppsd.pdf(), axis=1), 1.)
+
+    def test_add(self):
+        ppsd = self.ppsd()
+        ppsd.add([self.rec1, self.rec2])
+        hist = ppsd.hist.copy()
+
+        # Segments already included are skipped
+        ppsd.add(self.rec1)
+        npt.assert_array_equal(ppsd.hist, hist)
+        self.assertEqual(ppsd.count, 22)
+
+        single = self.ppsd()
+        single.add(self.rec2)
+        single.add(self.rec1)
+        npt.assert_array_equal(single.hist, hist)
+
+        with self.assertRaises(ValueError):
+            ppsd.add(Record(delta=0.02, data=np.zeros(100000)))
+
+    def test_response(self):
+        raw = self.ppsd()
+        raw.add(self.rec1)
+
+        rec = noise_record('2020-01-01T00:00:00')
+        rec.data *= 1e3
+
+        # Stage record, stream and collection of responses
+        srec = flat_response(1e3)
+        stream = response.StreamResponse('X')
+        stream.append(srec)
+        coll = response.ResponseCollection()
+        coll.append(stream)
+
+        for resp in [srec, stream, coll]:
+            ppsd = self.ppsd()
+            ppsd.add(rec, resp)
+            npt.assert_array_equal(ppsd.hist, raw.hist)
+
+    def test_units(self):
+        acc = self.ppsd()
+        acc.add(self.rec1, flat_response(1.))
+
+        vel = self.ppsd()
+        vel.add(self.rec1, flat_response(1., 'M/S'))
+
+        # Differentiation of white noise
+        shift = 20.*np.log10(2.*np.pi/vel.period)
+        npt.assert_allclose(vel.mean() - acc.mean(), shift, atol=1.5)
+
+        with self.assertRaises(ValueError):
+            self.ppsd().add(self.rec1, flat_response(1., 'COUNTS'))
+
+    def test_merge(self):
+        ppsd1 = self.ppsd()
+        ppsd1.add(self.rec1)
+        ppsd2 = self.ppsd()
+        ppsd2.add(self.rec2)
+
+        ppsd1.merge(ppsd2)
+
+        ref = self.ppsd()
+        ref.add([self.rec1, self.rec2])
+        npt.assert_array_equal(ppsd1.hist, ref.hist)
+        npt.assert_array_equal(ppsd1.times, ref.times)
+
+        with self.assertRaises(ValueError):
+            ppsd1.merge(ppsd2)
+
+        with self.assertRaises(ValueError):
+            ppsd1.merge(PPSD(0.01, segment_length=600., db_step=2.))
+
+    def test_write_read(self):
+        ppsd = self.ppsd()
+        ppsd.add(self.rec1)
+
+        with tempfile.TemporaryDirectory() as path:
+            file = os.path.join(path, 'ppsd.npz')
+            ppsd.write(file)
+            copy = PPSD(file=file)
+
+        npt.assert_array_equal(copy.hist, ppsd.hist)
+        npt.assert_array_equal(copy.times, ppsd.times)
+        npt.assert_array_equal(copy.period, ppsd.period)
+        npt.assert_array_equal(copy.db, ppsd.db)
+        self.assertEqual(copy.nperseg, ppsd.nperseg)
+
+        # The state can be updated after reading
+        copy.add(self.rec2)
+        ppsd.add(self.rec2)
+        npt.assert_array_equal(copy.hist, ppsd.hist)
+
+
+if __name__ == '__main__':
+    unittest.main()
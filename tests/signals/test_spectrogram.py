@@ -0,0 +1,221 @@
+# ****************************************************************************
+#
+# Copyright (C) 2019-2022, ShakeLab Developers.
+# This file is part of ShakeLab.
+#
+# ShakeLab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ShakeLab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+#
+# ****************************************************************************
+
+import unittest
+import numpy as np
+import numpy.testing as npt
+from scipy.linalg import toeplitz
+from scipy import signal
+
+from shakelab.signals import spectrogram as sp
+
+
+def stransform_reference(data, delta):
+    """
+    Former (full matrix) S-transform, with the Toeplitz matrix
+    of the shifted spectrum
+    """
+    n = len(data)
+    nhaf = n//2
+
+    f_l = np.arange(0, nhaf + 1)/(delta*n)
+    f = np.fft.fftfreq(n, delta)
+    hft = np.fft.fft(data)
+
+    w = 2*np.pi*f[None, :]/f[1:nhaf+1, None]
+    gw = np.exp(-w**2/2)
+    hw = toeplitz(np.conj(hft[:nhaf+1]), hft)[1:]
+
+    st = np.concatenate((np.full((1, n), np.mean(data)),
+                         np.fft.ifft(hw*gw)))
+
+    return f_l, st
+
+
+def cwt_reference(data, delta, freq, omega0=6):
+    """
+    Morlet transform by time-domain convolution (as the former
+    scipy.signal.cwt, with symmetric wavelets)
+    """
+    out = []
+    for f in freq:
+        s = omega0/(2*np.pi*delta*f)
+        t = np.arange(-int(5*s), int(5*s) + 1)
+        wav = (np.pi**-0.25*np.exp(1j*omega0*t/s)
+               * np.exp(-0.5*(t/s)**2)/np.sqrt(s))
+        out.append(np.convolve(data, np.conj(wav)[::-1], mode='same'))
+    return np.array(out)
+
+
+# =============================================================================
+
+class StransformTestCase(unittest.TestCase):
+    """
+    Block-wise S-transform against the full-matrix calculation,
+    and the inverse transform
+    """
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.delta = 0.01
+        self.data = {n: rng.standard_normal(n) + 0.5 for n in [256, 301]}
+
+    def test_reference(self):
+        block = sp.ST_BLOCK
+        sp.ST_BLOCK = 1000
+        try:
+            for data in self.data.values():
+                f, st = sp.stransform(data, self.delta)
+                f_ref, st_ref = stransform_reference(data, self.delta)
+                npt.assert_allclose(f, f_ref)
+                npt.assert_allclose(st, st_ref, atol=1e-12)
+        finally:
+            sp.ST_BLOCK = block
+
+    def test_round_trip(self):
+        for data in self.data.values():
+            _, st = sp.stransform(data, self.delta)
+            npt.assert_allclose(sp.istransform(st, self.delta), data,
+                                atol=1e-12)
+
+    def test_round_trip_blocks(self):
+        data = self.data[301]
+        block = sp.ST_BLOCK
+        sp.ST_BLOCK = 1000
+        try:
+            _, st = sp.stransform(data, self.delta)
+            rec = sp.istransform(st, self.delta)
+        finally:
+            sp.ST_BLOCK = block
+        npt.assert_allclose(rec, data, atol=1e-12)
+
+    def test_decimation(self):
+        for data in self.data.values():
+            f, st = sp.stransform(data, self.delta)
+            for tstep in [1, 4, 7]:
+                fd, std = sp.stransform(data, self.delta, flim=[5., 30.],
+                                        fstep=3, tstep=tstep)
+                keep = np.nonzero((f >= 5.) & (f <= 30.))[0][::3]
+                npt.assert_allclose(fd, f[keep])
+                npt.assert_allclose(std, st[keep, ::tstep], atol=1e-12)
+
+    def test_output(self):
+        data = self.data[256]
+        out = np.zeros((129, 64), dtype=complex)
+        _, st = sp.stransform(data, self.delta, tstep=4, out=out)
+        self.assertIs(st, out)
+
+        with self.assertRaises(ValueError):
+            sp.stransform(data, self.delta, out=out)
+
+
+# =============================================================================
+
+class SpectrogramTestCase(unittest.TestCase):
+    """
+    Strided spectrogram and running PSD against scipy
+    """
+
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        self.delta = 0.01
+        self.data = rng.standard_normal((3, 5000)) + 2.
+
+    def test_spectrogram(self):
+        for nperseg, noverlap in [(256, None), (200, 150), (101, 0)]:
+            time, freq, psd = sp.spectrogram(self.data[0], self.delta,
+                                             nperseg, noverlap)
+
+            # Default overlap of scipy is nperseg/8
+            if noverlap is None:
+                noverlap = nperseg//2
+
+            f_ref, t_ref, p_ref = signal.spectrogram(
+                    self.data[0], 1./self.delta, window='hann',
+                    nperseg=nperseg, noverlap=noverlap,
+                    detrend='constant', scaling='density')
+
+            npt.assert_allclose(freq, f_ref)
+            npt.assert_allclose(time, t_ref)
+            npt.assert_allclose(psd, p_ref, rtol=1e-10)
+
+    def test_blocks(self):
+        frame = sp.FRAME_BLOCK
+        sp.FRAME_BLOCK = 3000
+        try:
+            _, _, psd = sp.spectrogram(self.data, self.delta)
+        finally:
+            sp.FRAME_BLOCK = frame
+
+        for data, p in zip(self.data, psd):
+            _, _, p_ref = sp.spectrogram(data, self.delta)
+            npt.assert_allclose(p, p_ref, rtol=1e-12)
+
+    def test_log_frequency(self):
+        freq = np.logspace(0., np.log10(40.), 15)
+        _, f, psd = sp.spectrogram(self.data[0], self.delta, freq=freq)
+        _, f_lin, p_lin = sp.spectrogram(self.data[0], self.delta)
+
+        avg = sp.log_average_matrix(f_lin, freq)
+        npt.assert_allclose(avg.sum(axis=1), 1.)
+        npt.assert_allclose(psd, avg @ p_lin, rtol=1e-12)
+
+    def test_running_psd(self):
+        run = sp.RunningPSD(self.delta, nperseg=256)
+        for i0, i1 in [(0, 100), (100, 1234), (1234, 1300), (1300, 5000)]:
+            run.update(self.data[:, i0:i1])
+
+        f_ref, p_ref = signal.welch(self.data, 1./self.delta,
+                                    window='hann', nperseg=256,
+                                    detrend='constant', scaling='density')
+
+        npt.assert_allclose(run.frequency, f_ref)
+        npt.assert_allclose(run.mean, p_ref, rtol=1e-10)
+
+        run.reset()
+        self.assertEqual(run.count, 0)
+
+
+# =============================================================================
+
+class CwtTestCase(unittest.TestCase):
+    """
+    Frequency-domain Morlet transform against time-domain convolution
+    """
+
+    def test_reference(self):
+        rng = np.random.default_rng(2)
+        data = rng.standard_normal((2, 2000))
+        freq = np.array([2., 5., 10., 20.])
+
+        block = sp.ST_BLOCK
+        sp.ST_BLOCK = 10000
+        try:
+            out = sp.cwt(data, 0.01, freq)
+        finally:
+            sp.ST_BLOCK = block
+
+        for o, d in zip(out, data):
+            ref = cwt_reference(d, 0.01, freq)
+            npt.assert_allclose(o, ref, atol=1e-5*np.max(np.abs(ref)))
+
+
+if __name__ == '__main__':
+    unittest.main()
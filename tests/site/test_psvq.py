@@ -0,0 +1,82 @@
+# ****************************************************************************
+#
+# Copyright (C) 2019-2022, ShakeLab Developers.
+# This file is part of ShakeLab.
+#
+# ShakeLab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ShakeLab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+#
+# ****************************************************************************
+
+import unittest
+import numpy as np
+import numpy.testing as npt
+
+from shakelab.site.psvq.psvqlib import (hassh, haspsv,
+                                        hassh_batch, haspsv_batch)
+
+
+# =============================================================================
+
+class BatchSolverTestCase(unittest.TestCase):
+    """
+    The frequency-vectorised solvers must reproduce the
+    single-frequency PSVQ porting
+    """
+
+    def setUp(self):
+        self.freq = np.linspace(0.1, 20., 64)
+        self.hl = np.array([10., 25., 40., 0.])
+        self.vs = np.array([180., 400., 800., 1500.])
+        self.vp = np.array([400., 900., 1600., 2800.])
+        self.dn = np.array([1800., 1950., 2100., 2400.])
+        self.qs = np.array([10., 20., 50., 100.])
+        self.qp = np.array([20., 40., 100., 200.])
+
+    def test_sh(self):
+        for angle in [0., 30.]:
+            ref = [hassh(f, self.hl, self.vs, self.dn, self.qs, angle)
+                   for f in self.freq]
+
+            out = hassh_batch(self.freq, self.hl, self.vs, self.dn,
+                              self.qs, angle)
+
+            npt.assert_allclose(out, np.array(ref), rtol=1e-10)
+
+    def test_psv(self):
+        for iwave in [1, 2]:
+            for angle in [0., 30.]:
+                ref = [haspsv(f, self.hl, self.vp, self.vs, self.dn,
+                              self.qp, self.qs, iwave, angle)
+                       for f in self.freq]
+
+                us, ws = haspsv_batch(self.freq, self.hl, self.vp,
+                                      self.vs, self.dn, self.qp, self.qs,
+                                      iwave, angle)
+
+                npt.assert_allclose(us, np.array([r[0] for r in ref]),
+                                    rtol=1e-10, atol=1e-20)
+                npt.assert_allclose(ws, np.array([r[1] for r in ref]),
+                                    rtol=1e-10, atol=1e-20)
+
+    def test_elastic(self):
+        ref = [hassh(f, self.hl, self.vs, self.dn, None)
+               for f in self.freq]
+
+        out = hassh_batch(self.freq, self.hl, self.vs, self.dn, None)
+
+        npt.assert_allclose(out, np.array(ref), rtol=1e-10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,315 @@
+# ****************************************************************************
+#
+# Copyright (C) 2019-2022, ShakeLab Developers.
+# This file is part of ShakeLab.
+#
+# ShakeLab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ShakeLab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+#
+# ****************************************************************************
+
+import unittest
+import numpy as np
+import numpy.testing as npt
+from scipy.optimize import brentq
+from scipy.interpolate import griddata
+
+from shakelab.site import sitedb
+from shakelab.site.sitedb import Model, Site1D, Grid2D, GEO_KEYS
+from shakelab.site import engpar, response
+
+
+def random_models(model_num, layer_num, seed=0):
+    """
+    Random soil models with the same number of layers
+    """
+    rng = np.random.default_rng(seed)
+
+    models = []
+    for i in range(model_num):
+        mod = Model()
+        hl = np.append(rng.uniform(5., 50., layer_num - 1), 0.)
+        vs = np.sort(rng.uniform(150., 1500., layer_num))
+        mod.geo['hl'] = hl
+        mod.geo['vs'] = vs
+        mod.geo['vp'] = 2.*vs
+        mod.geo['dn'] = rng.uniform(1700., 2500., layer_num)
+        mod.geo['qs'] = rng.uniform(10., 100., layer_num)
+        mod.geo['qp'] = 2.*mod.geo['qs']
+        models.append(mod)
+
+    return models
+
+
+def build_site(models):
+    site = Site1D()
+    for mod in models:
+        site.add_model(mod)
+    site.frequency_axis(0.5, 20., 30)
+    return site
+
+
+def depth_average(hl, par, depth):
+    """
+    Layer-by-layer weighted average down to depth
+    """
+    ztop = 0.
+    total = 0.
+    for h, p in zip(hl, par):
+        if h == 0. or ztop + h >= depth:
+            return (total + (depth - ztop)*p)/depth
+        total += h*p
+        ztop += h
+
+
+def qwl_reference(hl, vs, dn, freq):
+    """
+    Quarter-wavelength depth by root finding of the travel time
+    """
+    qwl = []
+    for f in freq:
+        def misfit(z):
+            return z*depth_average(hl, 1./vs, z) - 1./(4.*f)
+        z = brentq(misfit, 1e-6, 1e6, xtol=1e-9)
+        qwl.append((z, 4.*f*z, depth_average(hl, dn, z)))
+    return np.array(qwl).T
+
+
+# =============================================================================
+
+class QuarterWavelengthTestCase(unittest.TestCase):
+    """
+    Quarter-wavelength parameters of Site1D are solved for all
+    the models at once; they must match the per-model solution
+    """
+
+    def test_batch_average(self):
+        models = random_models(6, 5)
+        site = build_site(models)
+        site.quarter_wavelength_average()
+
+        for mod in models:
+            single = build_site([mod])
+            single.quarter_wavelength_average()
+            for key in ['z', 'vs', 'dn']:
+                npt.assert_allclose(mod.eng['qwl'][key],
+                                    single.model[0].eng['qwl'][key])
+
+    def test_reference_average(self):
+        models = random_models(3, 4, seed=1)
+        site = build_site(models)
+        site.quarter_wavelength_average()
+
+        for mod in models:
+            ref = qwl_reference(mod.geo['hl'], mod.geo['vs'],
+                                mod.geo['dn'], site.freq)
+            for key, val in zip(['z', 'vs', 'dn'], ref):
+                npt.assert_allclose(mod.eng['qwl'][key], val, rtol=1e-6)
+
+    def test_mixed_layers(self):
+        models = random_models(3, 4) + random_models(2, 6, seed=2)
+        site = build_site(models)
+        site.quarter_wavelength_average()
+
+        for mod in models:
+            single = build_site([mod])
+            single.quarter_wavelength_average()
+            npt.assert_allclose(mod.eng['qwl']['vs'],
+                                single.model[0].eng['qwl']['vs'])
+
+    def test_amplification(self):
+        models = random_models(4, 5)
+        site = build_site(models)
+        site.quarter_wavelength_average()
+        site.quarter_wavelength_amplification(inc_ang=10.)
+
+        for mod in models:
+            amp = response.impedance_amplification(mod.eng['qwl']['vs'],
+                                                   mod.eng['qwl']['dn'],
+                                                   mod.geo['vs'][-1],
+                                                   mod.geo['dn'][-1],
+                                                   10.)
+            npt.assert_allclose(mod.amp['qwl'], amp, atol=1e-6)
+
+        mn = np.exp(np.mean(np.log([m.amp['qwl'] for m in models]), axis=0))
+        npt.assert_allclose(site.mean.amp['qwl'][0], mn, rtol=1e-5)
+
+
+# =============================================================================
+
+class DepthAverageTestCase(unittest.TestCase):
+    """
+    Vs(z) and kappa of Site1D are computed for all the models
+    at once; they must match the per-model calculation
+    """
+
+    def test_traveltime_velocity(self):
+        depth = [5., 30., 100., 500.]
+        models = random_models(6, 5)
+        site = build_site(models)
+        site.traveltime_velocity(depth)
+
+        for mod in models:
+            single = build_site([mod])
+            single.traveltime_velocity(depth)
+            for z in depth:
+                ref = 1./depth_average(mod.geo['hl'], 1./mod.geo['vs'], z)
+                self.assertAlmostEqual(mod.eng['vsz'][z],
+                                       single.model[0].eng['vsz'][z])
+                self.assertAlmostEqual(mod.eng['vsz'][z], ref, places=5)
+
+    def test_site_kappa(self):
+        models = random_models(5, 4) + random_models(2, 6, seed=3)
+        site = build_site(models)
+        site.compute_site_kappa()
+
+        for mod in models:
+            ref = np.sum(mod.geo['hl']/(mod.geo['vs']*mod.geo['qs']))
+            self.assertAlmostEqual(mod.eng['kappa'], ref, places=6)
+
+        kappa = [mod.eng['kappa'] for mod in models]
+        self.assertAlmostEqual(site.mean.eng['kappa'][0], np.mean(kappa),
+                               places=5)
+
+    def test_site_kappa_depth(self):
+        models = random_models(5, 4)
+        site = build_site(models)
+        site.compute_site_kappa(depth=60.)
+
+        for mod in models:
+            layer = 1./(mod.geo['vs']*mod.geo['qs'])
+            ref = 60.*depth_average(mod.geo['hl'], layer, 60.)
+            self.assertAlmostEqual(mod.eng['kappa'], ref, places=6)
+
+    def test_undefined_profiles(self):
+        hl = np.array([[10., 20., 0.], [np.nan]*3, [5., 40., 0.]])
+        vs = np.array([[200., 400., 800.], [np.nan]*3, [300., 500., 900.]])
+        depth = [5., 30., 60.]
+
+        vsz = engpar.traveltime_velocity(hl, vs, depth)
+        self.assertTrue(np.all(np.isnan(vsz[1])))
+        for i in [0, 2]:
+            npt.assert_allclose(vsz[i],
+                                engpar.traveltime_velocity(hl[i], vs[i],
+                                                           depth))
+
+
+# =============================================================================
+
+class Grid2DTestCase(unittest.TestCase):
+    """
+    Grid interpolation shares one interpolant by chunks of rows;
+    it must match scipy griddata on each parameter and layer
+    """
+
+    def setUp(self):
+        rng = np.random.default_rng(4)
+
+        self.sites = []
+        for mod in random_models(25, 4, seed=5):
+            site = Site1D(x=rng.uniform(0., 1000.),
+                          y=rng.uniform(0., 200.),
+                          z=rng.uniform(100., 300.))
+            site.add_model(mod)
+            site.model_average()
+            self.sites.append(site)
+
+        self.grid = Grid2D()
+        self.grid.set_grid([0., 1000.], [0., 200.], 50., 10.)
+
+    def reference(self, values, method):
+        points = [(s.head['x'], s.head['y']) for s in self.sites]
+        return griddata(points, values, (self.grid.gx, self.grid.gy),
+                        method=method, rescale=True)
+
+    def check_import(self, method):
+        chunk = sitedb.GRID_CHUNK
+        sitedb.GRID_CHUNK = 50
+        try:
+            self.grid.import_sites(self.sites, method=method)
+        finally:
+            sitedb.GRID_CHUNK = chunk
+
+        npt.assert_allclose(self.grid.gz,
+                            self.reference([s.head['z'] for s in self.sites],
+                                           method))
+
+        for k in GEO_KEYS:
+            layers = np.array([s.mean.geo[k][0] for s in self.sites]).T
+            for data, layer in zip(self.grid.geo[k], layers):
+                npt.assert_allclose(data, self.reference(layer, method),
+                                    rtol=1e-6)
+
+    def test_cubic(self):
+        self.check_import('cubic')
+
+    def test_linear(self):
+        self.check_import('linear')
+
+    def test_nearest(self):
+        self.check_import('nearest')
+
+    def test_iter_sites(self):
+        self.grid.import_sites(self.sites)
+
+        n = 0
+        for site in self.grid.iter_sites():
+            j, i = np.unravel_index(n, self.grid.gx.shape, order='F')
+            self.assertEqual(site.head['x'], self.grid.gx[j, i])
+            self.assertEqual(site.head['y'], self.grid.gy[j, i])
+            for k in GEO_KEYS:
+                npt.assert_array_equal(site.model[0].geo[k],
+                                       self.grid.geo[k][:, j, i])
+            n += 1
+
+        self.assertEqual(n, self.grid.gx.size)
+
+    def test_iter_profiles(self):
+        self.grid.import_sites(self.sites)
+
+        batches = list(self.grid.iter_profiles(chunk_size=40))
+        self.assertEqual(len(batches), int(np.ceil(self.grid.gx.size/40)))
+
+        npt.assert_array_equal(np.concatenate([b['x'] for b in batches]),
+                               self.grid.gx.ravel())
+        npt.assert_array_equal(np.concatenate([b['z'] for b in batches]),
+                               self.grid.gz.ravel())
+
+        for k in GEO_KEYS:
+            data = np.concatenate([b[k] for b in batches])
+            npt.assert_array_equal(data,
+                                   self.grid.geo[k].reshape(4, -1).T)
+
+    def test_maps(self):
+        self.grid.import_sites(self.sites, method='linear')
+        vs30 = self.grid.traveltime_velocity(30.)
+        kappa = self.grid.site_kappa()
+
+        for site in self.grid.iter_sites():
+            mod = site.model[0]
+            j, i = np.argwhere((self.grid.gx == site.head['x']) &
+                               (self.grid.gy == site.head['y']))[0]
+            npt.assert_allclose(vs30[j, i],
+                                engpar.traveltime_velocity(mod.geo['hl'],
+                                                           mod.geo['vs'],
+                                                           30.))
+            npt.assert_allclose(kappa[j, i],
+                                engpar.compute_site_kappa(mod.geo['hl'],
+                                                          mod.geo['vs'],
+                                                          mod.geo['qs']))
+
+
+# =============================================================================
+
+if __name__ == '__main__':
+    unittest.main()
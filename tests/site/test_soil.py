@@ -222,7 +222,7 @@ class QuarterWavelengthTestCase(unittest.TestCase):
         Testing the frequency range 0.1-100Hz
         """
 
-        expected_result = [[2.36000001e+03,
+        expected_result = [[2.36000000e+03,
                             3.60000002e+02,
                             1.10000002e+02,
                             2.49999899e+00,
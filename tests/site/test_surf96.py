@@ -0,0 +1,83 @@
+# ****************************************************************************
+#
+# Copyright (C) 2019-2022, ShakeLab Developers.
+# This file is part of ShakeLab.
+#
+# ShakeLab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ShakeLab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+#
+# ****************************************************************************
+
+import unittest
+import numpy as np
+import numpy.testing as npt
+
+from shakelab.site.cps import surf96, surf96_batch, surf96_modes
+from shakelab.site.cps.surf96 import getc
+
+
+# =============================================================================
+
+class DispersionTestCase(unittest.TestCase):
+    """
+    The all-modes solver must reproduce the
+    sequential mode search of surf96
+    """
+
+    def setUp(self):
+        self.t = np.linspace(0.02, 0.5, 12)
+        self.d = np.array([0.01, 0.02, 0.03, 0.05, 0.])
+        self.b = np.array([0.2, 0.35, 0.5, 0.8, 1.2])
+        self.a = np.array([0.5, 0.77, 1.0, 1.52, 2.16])
+        self.rho = np.array([1.8, 1.9, 2.0, 2.1, 2.3])
+
+    def test_modes(self):
+        for ifunc in [1, 2]:
+            ref = [surf96(self.t, self.d, self.a, self.b, self.rho,
+                          mode=k, ifunc=ifunc, dc=0.001) for k in range(3)]
+
+            out = surf96_modes(self.t, self.d, self.a, self.b, self.rho,
+                               nmode=3, ifunc=ifunc, dc=0.001)
+
+            npt.assert_allclose(out, np.array(ref), rtol=1e-5)
+
+    def test_dispatch(self):
+        t = np.linspace(0.02, 0.5, 30)
+        model = (self.d, self.a, self.b, self.rho)
+
+        for ifunc in [1, 2]:
+            for mode in [1, 2, 3]:
+                ref = getc(t, *model, mode, ifunc, 0.001)
+                out = surf96(t, *model, mode=mode, ifunc=ifunc, dc=0.001)
+                npt.assert_allclose(out, ref, rtol=1e-5)
+
+                # Group velocity, against the sequential search
+                t1, t2 = t/1.025, t/0.975
+                c1 = getc(t1, *model, mode, ifunc, 0.001)
+                c2 = getc(t2, *model, mode, ifunc, 0.001)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    ref = (1/t1 - 1/t2)/(1/(t1*c1) - 1/(t2*c2))
+                ref[(c1 == 0.) | (c2 == 0.)] = 0.
+
+                out = surf96_batch(t, *[[x] for x in model], mode=mode,
+                                   itype=1, ifunc=ifunc, dc=0.001)
+                npt.assert_allclose(out[0], ref, rtol=1e-4)
+
+        # Fast delta matrix is not dispatched
+        ref = getc(t, *model, 1, 3, 0.001)
+        npt.assert_array_equal(surf96(t, *model, mode=1, ifunc=3,
+                                      dc=0.001), ref)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# ****************************************************************************
+#
+# Copyright (C) 2019-2022, ShakeLab Developers.
+# This file is part of ShakeLab.
+#
+# ShakeLab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ShakeLab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+#
+# ****************************************************************************
+
+import unittest
+import numpy as np
+import numpy.testing as npt
+
+from shakelab.site.cps import surf96, surf96_batch
+
+
+# =============================================================================
+
+class BatchTestCase(unittest.TestCase):
+    """
+    Batched forward modelling must reproduce surf96
+    model by model
+    """
+
+    def setUp(self):
+        self.t = np.linspace(0.02, 0.5, 12)
+        self.d = np.array([0.01, 0.02, 0.03, 0.05, 0.])
+        self.b = np.array([0.2, 0.35, 0.5, 0.8, 1.2])
+        self.a = np.array([0.5, 0.77, 1.0, 1.52, 2.16])
+        self.rho = np.array([1.8, 1.9, 2.0, 2.1, 2.3])
+
+    def reference(self, models, **kwargs):
+        return [surf96(self.t, *[x[i] for x in models], **kwargs)
+                for i in range(len(models[0]))]
+
+    def test_batch(self):
+        models = [np.tile(x, (3, 1))
+                  for x in (self.d, self.a, self.b, self.rho)]
+        models[2][1] *= 1.1
+
+        out = surf96_batch(self.t, *models, itype=1)
+
+        for o, ref in zip(out, self.reference(models, itype=1)):
+            npt.assert_allclose(o, ref)
+
+    def test_layer_number(self):
+        models = [[x, x[1:]] for x in (self.d, self.a, self.b, self.rho)]
+
+        out = surf96_batch(self.t, *models, chunk_size=1)
+
+        for o, ref in zip(out, self.reference(models)):
+            npt.assert_allclose(o, ref)
+
+    def test_workers(self):
+        models = [np.tile(x, (4, 1))
+                  for x in (self.d, self.a, self.b, self.rho)]
+        models[2] *= np.linspace(1., 1.2, 4)[:, None]
+
+        out = surf96_batch(self.t, *models, chunk_size=1, workers=2)
+
+        for o, ref in zip(out, self.reference(models)):
+            npt.assert_allclose(o, ref)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+# ****************************************************************************
+#
+# Copyright (C) 2019-2022, ShakeLab Developers.
+# This file is part of ShakeLab.
+#
+# ShakeLab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ShakeLab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+#
+# ****************************************************************************
+
+import unittest
+import numpy as np
+import numpy.testing as npt
+
+from shakelab.structures import damage as dmg
+from shakelab.structures.fragility import ExposureDatabase, TaxonomyTree
+from shakelab.libutils.geodetic import circle_distance
+from tests.structures.test_fragility import fragility_collection
+
+
+def exposure_database(seed=42):
+    """
+    Exposure of 12 locations with one or two taxonomies each.
+    """
+    rng = np.random.default_rng(seed)
+    edb = ExposureDatabase()
+
+    for i in range(12):
+        taxonomy = []
+        for tax in (['T1', 'T3'] if i % 2 else ['T2']):
+            taxonomy.append({'id': tax,
+                             'number_of_buildings': str(rng.integers(1, 50)),
+                             'occupants': {'day': '10', 'night': '20'},
+                             'cost': {'structural': str(rng.uniform(1e5,
+                                                                    1e6))}})
+        edb.add_from_dict({'id': 'L{0}'.format(i), 'code': 'C',
+                           'latitude': str(46. + 0.01*i),
+                           'longitude': str(13. + 0.02*(i % 4)),
+                           'area': '1.', 'taxonomy': taxonomy})
+    return edb
+
+
+def taxonomy_tree():
+    tree = TaxonomyTree()
+    for id, branch in [('T1', {'P1': 0.7, 'D1': 0.3}),
+                       ('T2', {'P2': 1.0}),
+                       ('T3', {'D2': 0.5, 'P1': 0.25, 'D1': 0.25})]:
+        tree.add_from_dict({'id': id, 'fragility': [
+            {'id': k, 'weight': str(w)} for k, w in branch.items()]})
+    return tree
+
+
+def reference_damage(exposure, tree, fc, gmf, lat, lon, consequence):
+    """
+    Damage and loss by explicit loops over assets and realizations.
+    """
+    table = fc.compile()
+    ds = table.damage_state
+
+    damage = []
+    loss = []
+    for li in exposure.location:
+        site = np.argmin(circle_distance(li.latitude, li.longitude,
+                                         lat, lon))
+        for ti in li.taxonomy:
+            branch = tree.get_element(ti.id).branch
+
+            prob = np.zeros((gmf.shape[0], len(ds) + 1))
+            for r in range(gmf.shape[0]):
+                poes = np.zeros(len(ds))
+                for id, w in branch.items():
+                    fm = fc.model[table.get_index(id)]
+                    for d, dsl in enumerate(ds):
+                        if dsl in fm.damage_state:
+                            poes[d] += w*fm.get_poes(dsl, gmf[r, site])
+                poes = np.r_[1., poes, 0.]
+                prob[r] = poes[:-1] - poes[1:]
+
+            damage.append(prob*ti.number_of_buildings)
+            loss.append(prob[:, 1:] @ consequence *
+                        ti.cost['structural'])
+
+    return np.array(damage), np.array(loss)
+
+
+# =============================================================================
+
+class ScenarioDamageTestCase(unittest.TestCase):
+    """
+    Vectorized scenario damage must match the per-asset loop
+    """
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.exposure = exposure_database()
+        self.tree = taxonomy_tree()
+        self.fc = fragility_collection()
+
+        self.lat = np.array([46., 46.05, 46.1])
+        self.lon = np.array([13., 13.05, 13.])
+        self.gmf = rng.uniform(0.05, 1.6, (20, 3))
+        self.consequence = [0.05, 0.3, 1.]
+
+    def test_damage(self):
+        ref_damage, ref_loss = reference_damage(
+            self.exposure, self.tree, self.fc, self.gmf,
+            self.lat, self.lon, self.consequence)
+
+        for chunk_size, workers in [(10000, None), (4, None), (5, 2)]:
+            out = dmg.scenario_damage(self.exposure, self.tree, self.fc,
+                                      self.gmf, self.lat, self.lon,
+                                      self.consequence,
+                                      chunk_size=chunk_size,
+                                      workers=workers)
+
+            npt.assert_allclose(out['damage'], ref_damage.mean(axis=1))
+            npt.assert_allclose(out['loss'], ref_loss.mean(axis=1))
+            npt.assert_allclose(out['aggregate_damage'],
+                                ref_damage.sum(axis=0))
+            npt.assert_allclose(out['aggregate_loss'],
+                                ref_loss.sum(axis=0))
+
+        # Buildings are preserved
+        npt.assert_allclose(out['damage'].sum(axis=1),
+                            self.exposure.to_arrays()['Buildings'])
+
+        out = dmg.scenario_damage(self.exposure, self.tree, self.fc,
+                                  self.gmf, self.lat, self.lon)
+        npt.assert_array_equal(out['loss'], 0.)
+
+    def test_missing_ground_motion(self):
+        gmf = self.gmf.copy()
+        gmf[3, 1] = np.nan
+
+        out = dmg.scenario_damage(self.exposure, self.tree, self.fc,
+                                  gmf, self.lat, self.lon,
+                                  self.consequence, chunk_size=4)
+
+        # Missing values propagate to assets and aggregates alike
+        nan_asset = np.isnan(out['loss'])
+        self.assertTrue(np.any(nan_asset))
+        self.assertTrue(np.all(np.isnan(out['damage'][nan_asset])))
+        self.assertTrue(np.isnan(out['aggregate_loss'][3]))
+        self.assertTrue(np.all(np.isnan(out['aggregate_damage'][3])))
+        self.assertFalse(np.any(np.isnan(np.delete(out['aggregate_loss'],
+                                                   3))))
+
+    def test_taxonomy(self):
+        table = self.fc.compile()
+        model, weight = dmg.taxonomy_branches(self.tree, table)
+        self.assertEqual(model.shape, (3, 3))
+
+        for i, ti in enumerate(self.tree.tree):
+            for k, (id, w) in enumerate(ti.branch.items()):
+                self.assertEqual(model[i, k], table.get_index(id))
+                self.assertEqual(weight[i, k], w)
+        npt.assert_allclose(weight.sum(axis=1), 1.)
+
+        idx = dmg._taxonomy_index(np.array(['T3', 'T1', 'T2', 'T3']),
+                                  self.tree)
+        npt.assert_array_equal(idx, [2, 0, 1, 2])
+
+        with self.assertRaises(ValueError):
+            dmg._taxonomy_index(np.array(['T1', 'T9']), self.tree)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+# ****************************************************************************
+#
+# Copyright (C) 2019-2022, ShakeLab Developers.
+# This file is part of ShakeLab.
+#
+# ShakeLab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ShakeLab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+#
+# ****************************************************************************
+
+import unittest
+import numpy as np
+import numpy.testing as npt
+
+from shakelab.structures.fragility import (FragilityCollection,
+                                           FragilityModelDiscrete)
+
+
+def fragility_collection():
+    """
+    Two parametric and two discrete models (on different grids),
+    one of them missing the last damage state.
+    """
+    fc = FragilityCollection()
+
+    for id, means in [('P1', [0.1, 0.3, 0.6]), ('P2', [0.2, 0.5, 0.9])]:
+        fc.add_from_dict({'id': id, 'format': 'parametric', 'gmt': 'PGA',
+                          'bounds': {'min': '0.', 'max': '2.'},
+                          'damage_states': [{'id': 'DS{0}'.format(k + 1),
+                                             'mean': str(m),
+                                             'stdv': str(0.6*m)}
+                                            for k, m in enumerate(means)]})
+
+    grid1 = [0.05, 0.1, 0.2, 0.4, 0.8, 1.6]
+    grid2 = [0.05, 0.15, 0.3, 0.6, 1.2, 1.6]
+    poes = [[0.1, 0.3, 0.6, 0.85, 0.97, 1.],
+            [0.02, 0.1, 0.3, 0.6, 0.85, 0.95],
+            [0., 0.02, 0.1, 0.3, 0.6, 0.8]]
+
+    for id, grid, ds_num in [('D1', grid1, 3), ('D2', grid2, 2)]:
+        fc.add_from_dict({'id': id, 'format': 'discrete', 'gmt': 'PGA',
+                          'bounds': {'min': '0.', 'max': '2.'},
+                          'intensity': [str(g) for g in grid],
+                          'damage_states': [{'id': 'DS{0}'.format(k + 1),
+                                             'poes': [str(p) for p in
+                                                      poes[k]]}
+                                            for k in range(ds_num)]})
+    return fc
+
+
+def model_poes(fm, dsl, gmi, sampling='lin'):
+    """
+    Scalar model evaluation (zero for missing damage states).
+    """
+    if dsl not in fm.damage_state:
+        return np.zeros(np.shape(gmi))
+    if isinstance(fm, FragilityModelDiscrete):
+        return fm.get_poes(dsl, gmi, sampling)
+    return fm.get_poes(dsl, gmi)
+
+
+# =============================================================================
+
+class FragilityTableTestCase(unittest.TestCase):
+    """
+    The compiled table must reproduce each fragility model
+    """
+
+    def setUp(self):
+        self.fc = fragility_collection()
+        self.gmi = np.array([[0.05, 0.08, 0.12], [0.3, 0.75, 1.6]])
+
+    def test_all_models(self):
+        for sampling in ['lin', 'log']:
+            table = self.fc.compile(sampling=sampling)
+            self.assertEqual(table.damage_state, ['DS1', 'DS2', 'DS3'])
+
+            poes = table.get_poes(self.gmi)
+            self.assertEqual(poes.shape, (4, 3) + self.gmi.shape)
+
+            for m, fm in enumerate(self.fc.model):
+                self.assertEqual(table.get_index(fm.id), m)
+                for d, dsl in enumerate(table.damage_state):
+                    ref = model_poes(fm, dsl, self.gmi, sampling)
+                    npt.assert_allclose(poes[m, d], ref, atol=1e-12)
+
+    def test_model_index(self):
+        table = self.fc.compile()
+        model = np.array([[0, 2, 3], [1, 3, 2]])
+
+        poes = table.get_poes(self.gmi, model)
+        self.assertEqual(poes.shape, (3,) + self.gmi.shape)
+
+        full = table.get_poes(self.gmi)
+        for i in range(2):
+            for j in range(3):
+                npt.assert_allclose(poes[:, i, j],
+                                    full[model[i, j], :, i, j])
+
+        # Broadcasting of a model column against realizations
+        poes = table.get_poes(self.gmi, model[:, :1])
+        npt.assert_allclose(poes[:, 1], full[1, :, 1])
+
+    def test_bounds(self):
+        table = self.fc.compile(damage_states=['DS1', 'DS2'])
+        poes = table.get_poes([0.01, 5.], [2, 2])
+
+        # Discrete models are clamped to the end values
+        npt.assert_allclose(poes[:, 0], [0.1, 0.02])
+        npt.assert_allclose(poes[:, 1], [1., 0.95])
+
+
+if __name__ == '__main__':
+    unittest.main()